@@ -15,10 +15,12 @@ from app.services.mongo.emails import email_user_onboarding, send_payment_issue_
 from app.services.mongo.organizations import (
     create_project_by_org,
     get_projects_from_org_id,
+    get_org_plan,
     get_usage_quota,
     change_organization_plan,
 )
 from app.services.slack import slack_notification
+from app.utils.blocking import run_blocking
 
 router = APIRouter(tags=["Organizations"])
 
@@ -145,10 +147,7 @@ async def get_org_usage_quota(
     user: User = Depends(propelauth.require_user),
 ):
     org_member_info = propelauth.require_org_member(user, org_id)
-    org = propelauth.fetch_org(org_id)
-    logger.info(org)
-    org_metadata = org.get("metadata", {})
-    org_plan = org_metadata.get("plan", "hobby")
+    org_plan = await get_org_plan(org_id)
     usage_quota = await get_usage_quota(org_id, plan=org_plan)
     return usage_quota
 
@@ -162,7 +161,7 @@ async def get_org_metadat(
     user: User = Depends(propelauth.require_user),
 ):
     org = propelauth.require_org_member(user, org_id)
-    org = propelauth.fetch_org(org_id)
+    org = await run_blocking(propelauth.fetch_org, org_id)
     return org.get("metadata", {"plan": "hobby"})
 
 
@@ -175,7 +174,7 @@ async def post_create_checkout_session(
     user: User = Depends(propelauth.require_user),
 ):
     org_member_info = propelauth.require_org_member(user, org_id)
-    org = propelauth.fetch_org(org_id)
+    org = await run_blocking(propelauth.fetch_org, org_id)
     org_metadata = org.get("metadata", {})
     org_plan = org_metadata.get("plan", "hobby")
     if org_plan == "pro":
@@ -188,7 +187,8 @@ async def post_create_checkout_session(
             f"Creating checkout session for org {org_id} and user {user.email}"
         )
 
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await run_blocking(
+            stripe.checkout.Session.create,
             line_items=[
                 {
                     # This is the Stripe price ID for the pro plan subscription
@@ -248,7 +248,8 @@ async def post_stripe_webhook(
     if event["type"] == "checkout.session.completed":
         # Retrieve the session. If you require line items in the response,
         # you may include them by expanding line_items.
-        session = stripe.checkout.Session.retrieve(
+        session = await run_blocking(
+            stripe.checkout.Session.retrieve,
             event["data"]["object"]["id"],
             expand=["line_items"],
         )
@@ -300,8 +301,10 @@ async def post_stripe_webhook(
 
     if event["type"].startswith("customer.subscription"):
         # https://docs.stripe.com/api/subscriptions/object
-        subscription = stripe.Subscription.retrieve(
-            event["data"]["object"]["id"], expand=["items.data", "customer"]
+        subscription = await run_blocking(
+            stripe.Subscription.retrieve,
+            event["data"]["object"]["id"],
+            expand=["items.data", "customer"],
         )
         logger.debug(f"Subscription {subscription.id} retrieved: {subscription}")
         # Org id is in the customer metadata
@@ -394,7 +397,7 @@ async def post_create_billing_portal_session(
     user: User = Depends(propelauth.require_user),
 ):
     org_member_info = propelauth.require_org_member(user, org_id)
-    org = propelauth.fetch_org(org_id)
+    org = await run_blocking(propelauth.fetch_org, org_id)
     org_metadata = org.get("metadata", {})
     org_plan = org_metadata.get("plan", "hobby")
     if org_plan == "hobby":
@@ -405,11 +408,13 @@ async def post_create_billing_portal_session(
             f"Creating billing portal session for org {org_id}, user {user.email}, and customer {org_metadata.get('customer_id', None)}"
         )
         # Update the metadata of the customer in stripe
-        customer = stripe.Customer.modify(
+        customer = await run_blocking(
+            stripe.Customer.modify,
             org_metadata.get("customer_id", None),
             metadata={"org_id": org_id},
         )
-        portal_session = stripe.billing_portal.Session.create(
+        portal_session = await run_blocking(
+            stripe.billing_portal.Session.create,
             customer=org_metadata.get("customer_id", None),
             return_url=f"{config.PHOSPHO_FRONTEND_URL}/org/settings/billing",
         )
@@ -1,6 +1,7 @@
 from typing import Optional
 
 from fastapi import APIRouter, BackgroundTasks, Depends
+from fastapi.responses import StreamingResponse
 from loguru import logger
 from propelauth_fastapi import User
 
@@ -32,6 +33,9 @@ from app.services.mongo.projects import (
     get_all_tests,
     get_project_by_id,
     get_all_users_metadata,
+    stream_all_events,
+    stream_all_sessions,
+    stream_all_tasks,
     update_project,
     suggest_events_for_use_case,
     add_project_events,
@@ -42,6 +46,7 @@ from app.services.mongo.search import (
     search_tasks_in_project,
     search_sessions_in_project,
 )
+from app.utils.pagination import NDJSON_MEDIA_TYPE, get_next_cursor, stream_ndjson
 
 router = APIRouter(tags=["Projects"])
 
@@ -117,14 +122,40 @@ async def post_update_project(
 async def get_sessions(
     project_id: str,
     limit: int = 1000,
+    cursor: Optional[str] = None,
     user: User = Depends(propelauth.require_user),
 ) -> Sessions:
     project = await get_project_by_id(project_id)
     propelauth.require_org_member(user, project.org_id)
     sessions = await get_all_sessions(
-        project_id=project_id, limit=limit, get_events=True, get_tasks=False
+        project_id=project_id,
+        limit=limit,
+        get_events=True,
+        get_tasks=False,
+        cursor=cursor,
     )
-    return Sessions(sessions=sessions)
+    return Sessions(sessions=sessions, next_cursor=get_next_cursor(sessions, limit))
+
+
+@router.get(
+    "/projects/{project_id}/sessions/stream",
+    description="Stream all the sessions of a project as newline delimited json",
+)
+async def stream_sessions(
+    project_id: str,
+    cursor: Optional[str] = None,
+    user: User = Depends(propelauth.require_user),
+) -> StreamingResponse:
+    project = await get_project_by_id(project_id)
+    propelauth.require_org_member(user, project.org_id)
+    sessions = stream_all_sessions(
+        project_id=project_id,
+        limit=None,
+        get_events=True,
+        get_tasks=False,
+        cursor=cursor,
+    )
+    return StreamingResponse(stream_ndjson(sessions), media_type=NDJSON_MEDIA_TYPE)
 
 
 @router.get(
@@ -135,12 +166,28 @@ async def get_sessions(
 async def get_events(
     project_id: str,
     limit: int = 1000,
+    cursor: Optional[str] = None,
     user: User = Depends(propelauth.require_user),
 ) -> Events:
     project = await get_project_by_id(project_id)
     propelauth.require_org_member(user, project.org_id)
-    events = await get_all_events(project_id=project_id, limit=limit)
-    return Events(events=events)
+    events = await get_all_events(project_id=project_id, limit=limit, cursor=cursor)
+    return Events(events=events, next_cursor=get_next_cursor(events, limit))
+
+
+@router.get(
+    "/projects/{project_id}/events/stream",
+    description="Stream all the events of a project as newline delimited json",
+)
+async def stream_events(
+    project_id: str,
+    cursor: Optional[str] = None,
+    user: User = Depends(propelauth.require_user),
+) -> StreamingResponse:
+    project = await get_project_by_id(project_id)
+    propelauth.require_org_member(user, project.org_id)
+    events = stream_all_events(project_id=project_id, cursor=cursor)
+    return StreamingResponse(stream_ndjson(events), media_type=NDJSON_MEDIA_TYPE)
 
 
 @router.post(
@@ -161,11 +208,14 @@ async def post_search_tasks(
     project = await get_project_by_id(project_id)
     propelauth.require_org_member(user, project.org_id)
     # Perform the semantic search
-    relevant_tasks = await search_tasks_in_project(
+    task_ids = await search_tasks_in_project(
         project_id=project_id,
         search_query=search_query.query,
+        limit=search_query.limit,
+        offset=search_query.offset,
+        mode=search_query.mode,
     )
-    return SearchResponse(task_ids=[task.id for task in relevant_tasks])
+    return SearchResponse(task_ids=task_ids)
 
 
 @router.post(
@@ -186,14 +236,14 @@ async def post_search_sessions(
     project = await get_project_by_id(project_id)
     propelauth.require_org_member(user, project.org_id)
     # Perform the semantic search
-    relevant_tasks, relevant_sessions = await search_sessions_in_project(
+    task_ids, session_ids = await search_sessions_in_project(
         project_id=project_id,
         search_query=search_query.query,
+        limit=search_query.limit,
+        offset=search_query.offset,
+        mode=search_query.mode,
     )
-    return SearchResponse(
-        task_ids=[task.id for task in relevant_tasks],
-        session_ids=[session.id for session in relevant_sessions],
-    )
+    return SearchResponse(task_ids=task_ids, session_ids=session_ids)
 
 
 @router.get(
@@ -204,21 +254,40 @@ async def post_search_sessions(
 async def get_tasks(
     project_id: str,
     limit: int = 1000,
+    cursor: Optional[str] = None,
     user: User = Depends(propelauth.require_user),
 ):
     """
-    Get all the tasks of a project.
+    Get a page of the tasks of a project, newest first.
 
     Args:
         project_id: The id of the project
         limit: The maximum number of tasks to return
+        cursor: The next_cursor of the previous page
     """
     project = await get_project_by_id(project_id)
     propelauth.require_org_member(user, project.org_id)
     tasks = await get_all_tasks(
-        project_id=project_id, limit=limit, validate_metadata=True
+        project_id=project_id, limit=limit, validate_metadata=True, cursor=cursor
+    )
+    return Tasks(tasks=tasks, next_cursor=get_next_cursor(tasks, limit))
+
+
+@router.get(
+    "/projects/{project_id}/tasks/stream",
+    description="Stream all the tasks of a project as newline delimited json",
+)
+async def stream_tasks(
+    project_id: str,
+    cursor: Optional[str] = None,
+    user: User = Depends(propelauth.require_user),
+) -> StreamingResponse:
+    project = await get_project_by_id(project_id)
+    propelauth.require_org_member(user, project.org_id)
+    tasks = stream_all_tasks(
+        project_id=project_id, validate_metadata=True, limit=None, cursor=cursor
     )
-    return Tasks(tasks=tasks)
+    return StreamingResponse(stream_ndjson(tasks), media_type=NDJSON_MEDIA_TYPE)
 
 
 @router.get(
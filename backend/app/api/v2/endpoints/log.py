@@ -10,11 +10,13 @@ from app.security import (
     verify_propelauth_org_owns_project_id,
     get_quota,
 )
-from app.services.mongo.extractor import run_log_process
+from app.services.mongo.extractor import enqueue_log_process, run_log_process
 from app.services.mongo.emails import send_quota_exceeded_email
 from app.core import config
+from app.utils.compression import DecompressedRequestRoute
 
-router = APIRouter(tags=["Logs"])
+# Log batches can be sent gzip or zstd compressed
+router = APIRouter(tags=["Logs"], route_class=DecompressedRequestRoute)
 
 
 @router.post(
@@ -85,12 +87,21 @@ async def store_batch_of_log_events(
     log_reply = LogReply(logged_events=logged_events)
 
     # All the tasks to process were deemed as valid and part of the usage quota
-    background_tasks.add_task(
-        run_log_process,
-        logs_to_process=logs_to_process,
-        extra_logs_to_save=extra_logs_to_save,
-        project_id=project_id,
-        org_id=org["org"].get("org_id"),
-    )
+    if config.JOB_QUEUE_ENABLED:
+        # Persist the batch before replying, so that it survives restarts
+        await enqueue_log_process(
+            logs_to_process=logs_to_process,
+            extra_logs_to_save=extra_logs_to_save,
+            project_id=project_id,
+            org_id=org["org"].get("org_id"),
+        )
+    else:
+        background_tasks.add_task(
+            run_log_process,
+            logs_to_process=logs_to_process,
+            extra_logs_to_save=extra_logs_to_save,
+            project_id=project_id,
+            org_id=org["org"].get("org_id"),
+        )
 
     return log_reply
@@ -1,12 +1,19 @@
 from typing import Optional
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 
 from app.api.v2.models import ProjectTasksFilter, Sessions, Tasks
 
 # from app.db.client import firestore_db as firestore_db
 from app.security import authenticate_org_key, verify_propelauth_org_owns_project_id
-from app.services.mongo.projects import get_all_sessions, get_all_tasks
+from app.services.mongo.projects import (
+    get_all_sessions,
+    get_all_tasks,
+    stream_all_sessions,
+    stream_all_tasks,
+)
+from app.utils.pagination import NDJSON_MEDIA_TYPE, get_next_cursor, stream_ndjson
 
 router = APIRouter(tags=["Projects"])
 
@@ -19,11 +26,30 @@ router = APIRouter(tags=["Projects"])
 async def get_sessions(
     project_id: str,
     limit: int = 1000,
+    cursor: Optional[str] = None,
     org: dict = Depends(authenticate_org_key),
 ):
+    """
+    Get a page of the sessions of a project, newest first.
+    To get the next page, pass the next_cursor of the response as cursor.
+    """
+    await verify_propelauth_org_owns_project_id(org, project_id)
+    sessions = await get_all_sessions(project_id, limit, cursor=cursor)
+    return Sessions(sessions=sessions, next_cursor=get_next_cursor(sessions, limit))
+
+
+@router.get(
+    "/projects/{project_id}/sessions/stream",
+    description="Stream all the sessions of a project as newline delimited json",
+)
+async def stream_sessions(
+    project_id: str,
+    cursor: Optional[str] = None,
+    org: dict = Depends(authenticate_org_key),
+) -> StreamingResponse:
     await verify_propelauth_org_owns_project_id(org, project_id)
-    sessions = await get_all_sessions(project_id, limit)
-    return Sessions(sessions=sessions)
+    sessions = stream_all_sessions(project_id, limit=None, cursor=cursor)
+    return StreamingResponse(stream_ndjson(sessions), media_type=NDJSON_MEDIA_TYPE)
 
 
 @router.get(
@@ -34,15 +60,17 @@ async def get_sessions(
 async def get_tasks(
     project_id: str,
     limit: int = 1000,
+    cursor: Optional[str] = None,
     task_filter: Optional[ProjectTasksFilter] = None,
     org: dict = Depends(authenticate_org_key),
 ) -> Tasks:
     """
-    Get all the tasks of a project. If task_filter is specified, the tasks will be filtered according to the filter.
+    Get a page of the tasks of a project, newest first. If task_filter is specified, the tasks will be filtered according to the filter.
 
     Args:
         project_id: The id of the project
         limit: The maximum number of tasks to return
+        cursor: The next_cursor of the previous page
         task_filter: This model is used to filter tasks in the get_tasks endpoint. The filters are applied as AND filters.
     """
     await verify_propelauth_org_owns_project_id(org, project_id)
@@ -58,5 +86,38 @@ async def get_tasks(
         event_name_filter=task_filter.event_name,
         last_eval_source_filter=task_filter.last_eval_source,
         metadata_filter=task_filter.metadata,
+        cursor=cursor,
+    )
+    return Tasks(tasks=tasks, next_cursor=get_next_cursor(tasks, limit))
+
+
+@router.get(
+    "/projects/{project_id}/tasks/stream",
+    description="Stream all the tasks of a project as newline delimited json",
+)
+async def stream_tasks(
+    project_id: str,
+    cursor: Optional[str] = None,
+    task_filter: Optional[ProjectTasksFilter] = None,
+    org: dict = Depends(authenticate_org_key),
+) -> StreamingResponse:
+    """
+    Stream the tasks of a project, newest first, without loading all of them in memory.
+    If task_filter is specified, the tasks will be filtered according to the filter.
+    """
+    await verify_propelauth_org_owns_project_id(org, project_id)
+    if task_filter is None:
+        task_filter = ProjectTasksFilter()
+    if isinstance(task_filter.event_name, str):
+        task_filter.event_name = [task_filter.event_name]
+
+    tasks = stream_all_tasks(
+        project_id=project_id,
+        limit=None,
+        flag_filter=task_filter.flag,
+        event_name_filter=task_filter.event_name,
+        last_eval_source_filter=task_filter.last_eval_source,
+        metadata_filter=task_filter.metadata,
+        cursor=cursor,
     )
-    return Tasks(tasks=tasks)
+    return StreamingResponse(stream_ndjson(tasks), media_type=NDJSON_MEDIA_TYPE)
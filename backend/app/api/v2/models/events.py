@@ -1,7 +1,9 @@
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 from app.db.models import Event
 
 
 class Events(BaseModel):
     events: List[Event]
+    # Pass it as the cursor parameter to get the next page. None: this is the last page
+    next_cursor: Optional[str] = None
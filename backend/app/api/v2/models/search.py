@@ -1,10 +1,14 @@
 from app.db.models import Task, Session
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 
 
 class SearchQuery(BaseModel):
     query: str
+    # None: the default mode of the backend
+    mode: Optional[Literal["semantic", "hybrid"]] = None
+    limit: int = Field(default=5, ge=1, le=100)
+    offset: int = Field(default=0, ge=0)
 
 
 class SearchResponse(BaseModel):
@@ -5,6 +5,8 @@ from app.db.models import Session
 
 class Sessions(BaseModel):
     sessions: List[Session]
+    # Pass it as the cursor parameter to get the next page. None: this is the last page
+    next_cursor: Optional[str] = None
 
 
 class SessionCreationRequest(BaseModel):
@@ -9,6 +9,8 @@ from app.utils import generate_uuid
 
 class Tasks(BaseModel):
     tasks: List[Task]
+    # Pass it as the cursor parameter to get the next page. None: this is the last page
+    next_cursor: Optional[str] = None
 
 
 class TaskCreationRequest(BaseModel):
@@ -32,6 +32,27 @@ if MONGODB_NAME == "production" and ENVIRONMENT != "production":
 KEY_COLLECTION = "keys"
 KEY_PREFIX = "sk-"
 
+### CONCURRENCY ###
+# Size of the thread pool running the blocking calls (PropelAuth, Stripe, Resend...)
+BLOCKING_IO_MAX_WORKERS = int(os.getenv("BLOCKING_IO_MAX_WORKERS", 32))
+# Debug: log the stack of the code blocking the event loop for more than this (in ms)
+LOOP_STALL_THRESHOLD_MS = (
+    float(os.environ["LOOP_STALL_THRESHOLD_MS"])
+    if os.getenv("LOOP_STALL_THRESHOLD_MS")
+    else None
+)
+
+### AUTH CACHES ###
+# How long a validated API key is cached (in seconds).
+# It's also how long a key revoked in PropelAuth can still be used.
+API_KEY_CACHE_TTL = 60
+# How long the org_id of a project is cached (in seconds).
+# Other instances see a project moved to another org after at most this delay.
+PROJECT_ORG_CACHE_TTL = 5 * 60
+# How long a project that doesn't exist is cached as missing (in seconds).
+# Keep it short: unknown project_ids are retried against the database after this delay.
+MISSING_PROJECT_CACHE_TTL = 10
+
 ### GCP ###
 
 PROJECT_ID_GCLOUD = "portal-385519"  # Project ID
@@ -55,10 +76,21 @@ DEFAULT_MAX_QUERY_LIMIT = 1000
 MAX_NUMBER_OF_SCREENED_TASKS_PER_PROJECT = 10000
 PLAN_HOBBY_MAX_NB_TASKS = 5 * 1000
 
+# The usage of an org is read from a counter, reconciled with the real number of tasks
+# at most every ORG_USAGE_RECONCILIATION_INTERVAL seconds
+ORG_USAGE_RECONCILIATION_INTERVAL = 60 * 60
+# How long the plan of an org is cached (in seconds)
+ORG_PLAN_CACHE_TTL = 60
+
 PLAN_HOBBY_MAX_USERS = 1
 PLAN_PRO_MAX_USERS = 15
 
 
+### SERIALIZATION ###
+# json library used to serialize the API responses and the payloads sent to the extractor:
+# "orjson", "msgspec", "json" (standard library) or "auto" (the fastest installed one)
+JSON_SERIALIZER = os.getenv("JSON_SERIALIZER", "auto")
+
 ### SECURITY ###
 
 EXCLUDED_LOG_KEYWORDS = ["gserviceaccount", "googleapis.com"]
@@ -92,6 +124,29 @@ if QDRANT_URL is None:
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 if QDRANT_API_KEY is None:
     raise Exception("QDRANT_API_KEY is missing from the environment variables")
+# Model used to embed the tasks and the search queries: "openai" or "local" (requires the
+# local-embeddings extra). Must be the same in the extractor
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_MODEL = "text-embedding-3-small"
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+LOCAL_EMBEDDING_DIMENSION = int(os.getenv("LOCAL_EMBEDDING_DIMENSION", 384))
+LOCAL_EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_MAX_TOKENS_PER_REQUEST = 100_000
+EMBEDDING_MAX_PARALLELISM = 4
+# Rate limited or failed requests are retried with an exponential backoff (in seconds)
+EMBEDDING_MAX_RETRIES = 2
+EMBEDDING_RETRY_BASE_DELAY = 0.5
+
+### SEARCH ###
+# "semantic": vector search only. "hybrid": fuse the vector search with a Mongo text search
+SEARCH_DEFAULT_MODE = os.getenv("SEARCH_DEFAULT_MODE", "semantic")
+# Rank constant of the reciprocal rank fusion of the hybrid search
+SEARCH_RRF_K = 60
+# The sessions are ranked from SEARCH_SESSION_CANDIDATES_FACTOR times more tasks
+SEARCH_SESSION_CANDIDATES_FACTOR = 5
+# The embeddings of the search queries are cached (ttl in seconds)
+QUERY_EMBEDDING_CACHE_TTL = 60 * 60
+QUERY_EMBEDDING_CACHE_MAX_SIZE = 10_000
 
 ### WATCHERS ###
 OPENAI_MODEL_ID = "gpt-4"  # "gpt-4"
@@ -163,3 +218,12 @@ EXTRACTOR_URL = os.getenv("EXTRACTOR_URL")
 assert (
     EXTRACTOR_URL is not None
 ), "EXTRACTOR_URL is missing from the environment variables"
+# Send the work to the extractor through a job queue in mongo, instead of http calls
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "true").lower() == "true"
+# Number of times a job is tried before being marked as failed
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", 5))
+# Max size of the log events of a job (in bytes, BSON encoded). A mongo document is at
+# most 16MB: larger batches are split into several jobs.
+JOB_QUEUE_MAX_PAYLOAD_BYTES = int(
+    os.getenv("JOB_QUEUE_MAX_PAYLOAD_BYTES", 12 * 1024 * 1024)
+)
@@ -9,6 +9,10 @@ from app.core import config
 from app.db.mongo import close_mongo_db, connect_and_init_db
 from app.db.qdrant import close_qdrant, init_qdrant
 from app.services.mongo.extractor import check_health
+from app.services.mongo.projects import ensure_pagination_indexes
+from app.services.mongo.search import ensure_search_indexes
+from app.utils.blocking import start_loop_stall_detector, stop_loop_stall_detector
+from app.utils.serialization import FastJSONResponse
 
 # Setup the Sentry SDK
 
@@ -79,9 +83,15 @@ app.add_middleware(
 
 app.add_event_handler("startup", connect_and_init_db)
 app.add_event_handler("startup", init_qdrant)
+app.add_event_handler("startup", ensure_search_indexes)
+app.add_event_handler("startup", ensure_pagination_indexes)
 app.add_event_handler("shutdown", close_mongo_db)
 app.add_event_handler("shutdown", close_qdrant)
 
+# Debug
+app.add_event_handler("startup", start_loop_stall_detector)
+app.add_event_handler("shutdown", stop_loop_stall_detector)
+
 
 # Other services
 app.add_event_handler("startup", check_health)
@@ -121,6 +131,7 @@ api_v2 = FastAPI(
         "url": "https://phospho.ai",
         "email": "contact@phospho.app",
     },
+    default_response_class=FastJSONResponse,
 )
 
 api_v2.include_router(me.router)
@@ -149,7 +160,7 @@ from app.api.platform.endpoints import (
     tasks,
 )
 
-api_platform = FastAPI()
+api_platform = FastAPI(default_response_class=FastJSONResponse)
 
 api_platform.include_router(debug.router)
 api_platform.include_router(organizations.router)
@@ -2,6 +2,8 @@ from .authentification import (
     authenticate_org_key,
     verify_propelauth_org_owns_project_id,
     verify_if_propelauth_user_can_access_project,
+    get_project_org_id,
+    invalidate_project_org_id,
     propelauth,
 )
 
@@ -5,6 +5,7 @@ We now use Propelauth for authentification. Firebase auth is deprecated.
 """
 
 
+import hashlib
 from typing import Literal, Optional
 
 from fastapi import Depends, HTTPException, Request
@@ -15,9 +16,70 @@ from propelauth_fastapi import User, init_auth
 
 from app.core import config
 from app.db.mongo import get_mongo_db
+from app.utils.cache import TTLCache
 
 propelauth = init_auth(config.PROPELAUTH_URL, config.PROPELAUTH_API_KEY)
 
+# The caches below are per process. The API keys are revoked in PropelAuth, which doesn't
+# notify the backend: a revoked key stays valid for up to API_KEY_CACHE_TTL seconds.
+# A project moved to another org is invalidated on the instance that moved it, and stays
+# accessible to its previous org for up to PROJECT_ORG_CACHE_TTL seconds on the others.
+
+# sha256 of the API key -> org returned by propelauth.validate_org_api_key
+org_key_cache = TTLCache(ttl=config.API_KEY_CACHE_TTL)
+# project_id -> org_id of the project
+project_org_cache = TTLCache(ttl=config.PROJECT_ORG_CACHE_TTL)
+# project_ids of the projects that don't exist, so that unknown ids don't hit the database
+missing_project_cache = TTLCache(ttl=config.MISSING_PROJECT_CACHE_TTL)
+
+
+def _hash_api_key(api_key: str) -> str:
+    # Don't keep the API keys themselves in memory
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def validate_org_api_key(api_key: str) -> dict:
+    """
+    Validate the API key with PropelAuth and return the org.
+    Valid keys are cached for config.API_KEY_CACHE_TTL seconds.
+    """
+    api_key_hash = _hash_api_key(api_key)
+    org = org_key_cache.get(api_key_hash)
+    if org is None:
+        org = propelauth.validate_org_api_key(api_key)
+        org_key_cache.set(api_key_hash, org)
+    return org
+
+
+async def get_project_org_id(project_id: str) -> Optional[str]:
+    """
+    Get the org_id of a project. Returns None if the project doesn't exist.
+    The org_id is cached for config.PROJECT_ORG_CACHE_TTL seconds, and the missing
+    projects for config.MISSING_PROJECT_CACHE_TTL seconds.
+    """
+    if project_id in missing_project_cache:
+        return None
+
+    async def fetch_project_org_id() -> Optional[str]:
+        mongo_db = await get_mongo_db()
+        project_data = await mongo_db["projects"].find_one(
+            {"id": project_id}, {"org_id": 1}
+        )
+        if not project_data:
+            return None
+        return project_data.get("org_id")
+
+    org_id = await project_org_cache.aget_or_set(project_id, fetch_project_org_id)
+    if org_id is None:
+        missing_project_cache.set(project_id, True)
+    return org_id
+
+
+def invalidate_project_org_id(project_id: str) -> None:
+    """Remove the project from the cache. Call it when a project is deleted or moved."""
+    project_org_cache.invalidate(project_id)
+    missing_project_cache.invalidate(project_id)
+
 
 bearer = HTTPBearer()
 
@@ -32,7 +94,7 @@ def authenticate_org_key(
     api_key_token = authorization.credentials
 
     try:
-        org = propelauth.validate_org_api_key(api_key_token)
+        org = validate_org_api_key(api_key_token)
 
     except Exception as e:
         logger.debug(f"Caught Exception: {e}")
@@ -55,7 +117,7 @@ def authenticate_org_key_no_exception(request: Request) -> Optional[dict]:
         scheme, credentials = get_authorization_scheme_param(authorization)
         if authorization is None or scheme.lower() != "bearer":
             return None
-        org = propelauth.validate_org_api_key(credentials)
+        org = validate_org_api_key(credentials)
     except Exception as e:
         logger.debug(f"Caught Exception: {e}")
         return None
@@ -80,14 +142,17 @@ async def verify_propelauth_org_owns_project_id(
     if not org_id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    mongo_db = await get_mongo_db()
-    project_data = await mongo_db["projects"].find_one({"id": project_id})
-    if not project_data:
+    org_id_of_project = await get_project_org_id(project_id)
+    if org_id_of_project is not None and org_id_of_project != org_id:
+        # The cached org_id may be stale, eg if the project was moved to this org
+        # from another instance. A missing project is already cached for a short time.
+        invalidate_project_org_id(project_id)
+        org_id_of_project = await get_project_org_id(project_id)
+    if not org_id_of_project:
         raise HTTPException(
             status_code=404,
             detail=f"Project {project_id} not found",
         )
-    org_id_of_project = project_data.get("org_id")
 
     # Check that the org is the owner of the project
     if org_id != org_id_of_project:
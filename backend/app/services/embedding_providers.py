@@ -0,0 +1,180 @@
+"""
+Models used to embed the tasks, for the vector search.
+
+The provider is set with the EMBEDDING_PROVIDER environment variable:
+- "openai": EMBEDDING_MODEL (text-embedding-3-small), through the OpenAI API
+- "local": a quantized ONNX model (LOCAL_EMBEDDING_MODEL), run on CPU with fastembed
+
+The vectors of each embedding dimension are stored in their own Qdrant collection.
+The backend and the extractor must use the same provider.
+"""
+
+import asyncio
+import random
+from typing import Any, List, Optional
+
+import openai
+from loguru import logger
+
+from app.core import config
+from app.utils.blocking import run_blocking
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class EmbeddingProvider:
+    """
+    Base class of the embedding providers. Subclasses implement embed.
+    """
+
+    name: str
+    dimension: int
+    # Limits of a request, in tokens of the cl100k_base tokenizer
+    max_tokens_per_input: int
+    max_tokens_per_request: int
+    max_inputs_per_request: int
+    # Max number of requests running at once
+    max_parallelism: int
+
+    @property
+    def collection_name(self) -> str:
+        return get_tasks_collection_name(self.dimension)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    async def embed_query(self, query: str) -> List[float]:
+        """Embed a search query"""
+        return (await self.embed([query]))[0]
+
+
+# Dimension of the vectors of the OpenAI embedding models
+OPENAI_EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+    max_tokens_per_input = 8191
+    max_tokens_per_request = config.EMBEDDING_MAX_TOKENS_PER_REQUEST
+    max_inputs_per_request = 2048
+    max_parallelism = config.EMBEDDING_MAX_PARALLELISM
+
+    def __init__(self, model: str = config.EMBEDDING_MODEL):
+        if model not in OPENAI_EMBEDDING_DIMENSIONS:
+            raise ValueError(
+                f"Unknown dimension for the OpenAI embedding model {model}. Supported models: {list(OPENAI_EMBEDDING_DIMENSIONS.keys())}"
+            )
+        self.model = model
+        self.dimension = OPENAI_EMBEDDING_DIMENSIONS[model]
+        self.openai_client = openai.AsyncClient()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed the texts in one request, retrying on rate limits and server errors.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = await self.openai_client.embeddings.create(
+                    input=texts, model=self.model
+                )
+                response_data = sorted(response.data, key=lambda data: data.index)
+                return [data.embedding for data in response_data]
+            except RETRYABLE_ERRORS as e:
+                if attempt >= config.EMBEDDING_MAX_RETRIES:
+                    raise
+                delay = config.EMBEDDING_RETRY_BASE_DELAY * 2**attempt
+                delay += random.uniform(0, delay)
+                attempt += 1
+                logger.warning(
+                    f"Error while embedding {len(texts)} texts (attempt {attempt}), retrying in {delay:.1f}s: {e}"
+                )
+                await asyncio.sleep(delay)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Run a quantized ONNX embedding model on CPU, in the blocking thread pool.
+    The model is downloaded and loaded on the first call.
+    """
+
+    name = "local"
+    max_tokens_per_input = 256  # The model truncates its inputs to 512 of its tokens
+    max_tokens_per_request = config.LOCAL_EMBEDDING_BATCH_SIZE * 256
+    max_inputs_per_request = config.LOCAL_EMBEDDING_BATCH_SIZE
+    # onnxruntime already uses all the cores for one batch
+    max_parallelism = 1
+
+    def __init__(
+        self,
+        model: str = config.LOCAL_EMBEDDING_MODEL,
+        dimension: int = config.LOCAL_EMBEDDING_DIMENSION,
+    ):
+        try:
+            import fastembed  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "Please install the local-embeddings extra to use the local embedding provider: poetry install -E local-embeddings"
+            )
+        self.model = model
+        self.dimension = dimension
+        self._text_embedding: Optional[Any] = None
+
+    def _get_text_embedding(self) -> Any:
+        if self._text_embedding is None:
+            from fastembed import TextEmbedding
+
+            logger.info(f"Loading the local embedding model {self.model}")
+            self._text_embedding = TextEmbedding(model_name=self.model)
+        return self._text_embedding
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        text_embedding = self._get_text_embedding()
+        return [
+            embedding.tolist()
+            for embedding in text_embedding.embed(texts, batch_size=len(texts))
+        ]
+
+    def _embed_query(self, query: str) -> List[float]:
+        text_embedding = self._get_text_embedding()
+        return next(iter(text_embedding.query_embed(query))).tolist()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return await run_blocking(self._embed, texts)
+
+    async def embed_query(self, query: str) -> List[float]:
+        return await run_blocking(self._embed_query, query)
+
+
+def get_tasks_collection_name(dimension: int) -> str:
+    # The collection of the text-embedding-3-small embeddings was created before the other
+    # providers
+    if dimension == OPENAI_EMBEDDING_DIMENSIONS["text-embedding-3-small"]:
+        return "tasks"
+    return f"tasks_{dimension}"
+
+
+embedding_provider: Optional[EmbeddingProvider] = None
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    global embedding_provider
+
+    if embedding_provider is None:
+        if config.EMBEDDING_PROVIDER == "openai":
+            embedding_provider = OpenAIEmbeddingProvider()
+        elif config.EMBEDDING_PROVIDER == "local":
+            embedding_provider = LocalEmbeddingProvider()
+        else:
+            raise NotImplementedError(
+                f"Embedding provider {config.EMBEDDING_PROVIDER} is not supported."
+            )
+    return embedding_provider
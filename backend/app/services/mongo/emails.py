@@ -4,6 +4,7 @@ from loguru import logger
 from app.core import config
 from app.db.mongo import get_mongo_db
 from app.services.mongo.organizations import fetch_users_from_org
+from app.utils.blocking import run_blocking
 
 resend.api_key = config.RESEND_API_KEY
 
@@ -76,7 +77,7 @@ async def send_quota_exceeded_email(org_id: str):
 
     else:
         # Get all the users of the organization
-        users = fetch_users_from_org(org_id)
+        users = await run_blocking(fetch_users_from_org, org_id)
 
         email_subject = "Action required: max quota exceeded"
         email_content = """
@@ -99,7 +100,8 @@ async def send_quota_exceeded_email(org_id: str):
         """
 
         for user in users:
-            send_email(
+            await run_blocking(
+                send_email,
                 user.get("email"),
                 email_subject,
                 email_content,
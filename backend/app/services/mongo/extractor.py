@@ -3,14 +3,18 @@ A service to interact with the extractor server
 """
 
 import traceback
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
+import bson
 import httpx
 from app.api.v2.models import LogEvent
 from app.core import config
 from app.db.models import Task
+from app.services.mongo.job_queue import enqueue_job
 from app.services.slack import slack_notification
 from app.utils import generate_uuid
+from app.utils.compression import compress_body
+from app.utils.serialization import json_dumps
 from loguru import logger
 
 
@@ -37,6 +41,99 @@ def check_health():
         logger.debug(f"Extractor server is reachable at url {config.EXTRACTOR_URL}")
 
 
+def split_log_process_jobs(
+    logs_to_process: List[dict], extra_logs_to_save: List[dict], max_bytes: int
+) -> List[Tuple[Dict[str, List[dict]], int]]:
+    """
+    Group the log events into jobs of at most max_bytes (BSON encoded).
+    Returns the log events of each job, by key, with the size of the job.
+    A log event larger than max_bytes is alone in its job.
+    """
+    keyed_log_events = [
+        ("logs_to_process", log_event) for log_event in logs_to_process
+    ] + [("extra_logs_to_save", log_event) for log_event in extra_logs_to_save]
+
+    jobs: List[Tuple[Dict[str, List[dict]], int]] = []
+    job_log_events: Dict[str, List[dict]] = {
+        "logs_to_process": [],
+        "extra_logs_to_save": [],
+    }
+    job_size = 0
+    for key, log_event in keyed_log_events:
+        log_event_size = len(bson.encode(log_event))
+        if job_size > 0 and job_size + log_event_size > max_bytes:
+            jobs.append((job_log_events, job_size))
+            job_log_events = {"logs_to_process": [], "extra_logs_to_save": []}
+            job_size = 0
+        job_log_events[key].append(log_event)
+        job_size += log_event_size
+    if job_size > 0:
+        jobs.append((job_log_events, job_size))
+    return jobs
+
+
+async def enqueue_log_process(
+    logs_to_process: List[LogEvent],
+    project_id: str,
+    org_id: str,
+    extra_logs_to_save: Optional[List[LogEvent]] = None,
+) -> List[str]:
+    """
+    Add the log processing of a batch to the extractor job queue.
+    Unlike run_log_process, the batch is not lost if the backend or the extractor restarts.
+
+    A mongo document is at most 16MB: the batch is split into jobs of at most
+    config.JOB_QUEUE_MAX_PAYLOAD_BYTES. A log event too large for a job is sent to the
+    extractor over http, like with run_log_process.
+    Returns the ids of the jobs.
+    """
+    if extra_logs_to_save is None:
+        extra_logs_to_save = []
+    jobs = split_log_process_jobs(
+        logs_to_process=[log_event.model_dump() for log_event in logs_to_process],
+        extra_logs_to_save=[log_event.model_dump() for log_event in extra_logs_to_save],
+        max_bytes=config.JOB_QUEUE_MAX_PAYLOAD_BYTES,
+    )
+    job_ids = []
+    for job_log_events, job_size in jobs:
+        payload = {**job_log_events, "project_id": project_id, "org_id": org_id}
+        if job_size > config.JOB_QUEUE_MAX_PAYLOAD_BYTES:
+            logger.warning(
+                f"Log event of {job_size} bytes is too large for the job queue, project {project_id}: sending it over http"
+            )
+            await post_log_process(payload)
+            continue
+        job_id = await enqueue_job(job_type="log_process", payload=payload)
+        job_ids.append(job_id)
+        logger.debug(
+            f"Enqueued job {job_id} for {len(payload['logs_to_process'])} logevents, project {project_id} org {org_id}"
+        )
+    return job_ids
+
+
+async def enqueue_main_pipeline(task: Task) -> str:
+    """
+    Add the main pipeline of a task to the extractor job queue
+    """
+    job_id = await enqueue_job(
+        job_type="main_pipeline", payload={"task": task.model_dump()}
+    )
+    logger.debug(f"Enqueued job {job_id} for the main pipeline of task {task.id}")
+    return job_id
+
+
+async def enqueue_reembed_tasks(project_id: str) -> str:
+    """
+    Add the re-embedding of the tasks of a project to the extractor job queue.
+    Run it for every project after changing the EMBEDDING_PROVIDER.
+    """
+    job_id = await enqueue_job(
+        job_type="reembed_tasks", payload={"project_id": project_id}
+    )
+    logger.debug(f"Enqueued job {job_id} to re-embed the tasks of project {project_id}")
+    return job_id
+
+
 async def run_log_process(
     logs_to_process: List[LogEvent],
     project_id: str,
@@ -49,26 +146,36 @@ async def run_log_process(
     if extra_logs_to_save is None:
         extra_logs_to_save = []
 
+    await post_log_process(
+        {
+            "logs_to_process": [log_event.model_dump() for log_event in logs_to_process],
+            "extra_logs_to_save": [
+                log_event.model_dump() for log_event in extra_logs_to_save
+            ],
+            "project_id": project_id,
+            "org_id": org_id,
+        }
+    )
+
+
+async def post_log_process(payload: dict):
+    """
+    Send the log processing payload to the extractor over http
+    """
     async with httpx.AsyncClient() as client:
         logger.debug(
-            f"Calling the extractor API for {len(logs_to_process)} logevents, project {project_id} org {org_id}: {config.EXTRACTOR_URL}/v1/pipelines/log"
+            f"Calling the extractor API for {len(payload['logs_to_process'])} logevents, project {payload['project_id']} org {payload['org_id']}: {config.EXTRACTOR_URL}/v1/pipelines/log"
         )
         try:
+            # Log events are large json payloads: compress them
+            body, compression_headers = compress_body(json_dumps(payload))
             response = await client.post(
                 f"{config.EXTRACTOR_URL}/v1/pipelines/log",  # WARNING: hardcoded API version
-                json={
-                    "logs_to_process": [
-                        log_event.model_dump() for log_event in logs_to_process
-                    ],
-                    "extra_logs_to_save": [
-                        log_event.model_dump() for log_event in extra_logs_to_save
-                    ],
-                    "project_id": project_id,
-                    "org_id": org_id,
-                },
+                content=body,
                 headers={
                     "Authorization": f"Bearer {config.EXTRACTOR_SECRET_KEY}",
                     "Content-Type": "application/json",
+                    **compression_headers,
                 },
                 timeout=60,
             )
@@ -106,9 +213,11 @@ async def run_main_pipeline(task: Task):
         try:
             response = await client.post(
                 f"{config.EXTRACTOR_URL}/v1/pipelines/main",  # WARNING: hardcoded API version
-                json={
-                    "task": task.model_dump(),
-                },
+                content=json_dumps(
+                    {
+                        "task": task.model_dump(),
+                    }
+                ),
                 headers={
                     "Authorization": f"Bearer {config.EXTRACTOR_SECRET_KEY}",
                     "Content-Type": "application/json",
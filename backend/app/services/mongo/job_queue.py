@@ -0,0 +1,46 @@
+"""
+Durable queue of the work sent to the extractor.
+
+Jobs are documents of the `job_queue` collection. The extractor workers claim them with a
+lease, and retry them if they fail or if the worker dies (see extractor/app/services/job_queue.py).
+"""
+
+from typing import Literal, Optional
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+from app.utils import generate_timestamp, generate_uuid
+
+JOB_QUEUE_COLLECTION = "job_queue"
+
+JobType = Literal["log_process", "main_pipeline", "reembed_tasks"]
+
+
+async def enqueue_job(
+    job_type: JobType,
+    payload: dict,
+    max_attempts: Optional[int] = None,
+) -> str:
+    """
+    Add a job to the queue. Returns the job id.
+    """
+    mongo_db = await get_mongo_db()
+    if max_attempts is None:
+        max_attempts = config.JOB_QUEUE_MAX_ATTEMPTS
+    now = generate_timestamp()
+    job_id = generate_uuid()
+    await mongo_db[JOB_QUEUE_COLLECTION].insert_one(
+        {
+            "_id": job_id,
+            "job_type": job_type,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "created_at": now,
+            "available_at": now,
+            "lease_expires_at": None,
+            "worker_id": None,
+        }
+    )
+    return job_id
@@ -8,6 +8,12 @@ from app.db.models import Project
 from app.db.mongo import get_mongo_db
 from app.core import config
 from app.security.authentification import propelauth
+from app.utils import generate_timestamp
+from app.utils.blocking import run_blocking
+from app.utils.cache import TTLCache
+
+# org_id -> plan of the organization
+org_plan_cache = TTLCache(ttl=config.ORG_PLAN_CACHE_TTL)
 
 
 async def get_projects_from_org_id(org_id: str, limit: int = 1000) -> List[Project]:
@@ -47,13 +53,73 @@ async def create_project_by_org(org_id: str, user_id: str, **kwargs) -> Project:
     return project
 
 
+async def get_org_plan(org_id: str) -> str:
+    """
+    Get the plan of an organization from its PropelAuth metadata.
+    The plan is cached for config.ORG_PLAN_CACHE_TTL seconds.
+    """
+    org_plan = org_plan_cache.get(org_id)
+    if org_plan is not None:
+        return org_plan
+    org = await run_blocking(propelauth.fetch_org, org_id)
+    if not org:
+        raise ValueError(f"Organization {org_id} not found")
+    # Default org_plan: org_plan = "hobby"
+    org_plan = "hobby"
+    org_metadata = org.get("metadata", None)
+    if org_metadata:
+        org_plan = org_metadata.get("plan", "hobby")
+    org_plan_cache.set(org_id, org_plan)
+    return org_plan
+
+
+async def increment_org_usage(org_id: str, nb_tasks: int) -> None:
+    """
+    Add nb_tasks to the number of tasks logged by the organization.
+    Call it when tasks are created.
+    """
+    if nb_tasks == 0:
+        return
+    mongo_db = await get_mongo_db()
+    # The document _id is the org_id, so that concurrent upserts can't create duplicates
+    await mongo_db["org_usage"].update_one(
+        {"_id": org_id}, {"$inc": {"nb_tasks": nb_tasks}}, upsert=True
+    )
+
+
+async def get_nb_tasks_logged(org_id: str) -> int:
+    """
+    Get the number of tasks logged by the organization.
+
+    The number is read from a counter, incremented when tasks are created. To correct the
+    drift (tasks created or deleted without updating the counter), the counter is
+    reconciled with the real number of tasks every config.ORG_USAGE_RECONCILIATION_INTERVAL.
+    """
+    mongo_db = await get_mongo_db()
+    org_usage = await mongo_db["org_usage"].find_one({"_id": org_id})
+    now = generate_timestamp()
+    if (
+        org_usage is not None
+        and now - org_usage.get("reconciled_at", 0)
+        < config.ORG_USAGE_RECONCILIATION_INTERVAL
+    ):
+        return org_usage.get("nb_tasks", 0)
+
+    nb_tasks_logged = await mongo_db["tasks"].count_documents({"org_id": org_id})
+    await mongo_db["org_usage"].update_one(
+        {"_id": org_id},
+        {"$set": {"nb_tasks": nb_tasks_logged, "reconciled_at": now}},
+        upsert=True,
+    )
+    return nb_tasks_logged
+
+
 async def get_usage_quota(org_id: str, plan: str) -> dict:
     """
     Calculate the usage quota of an organization.
     The usage quota is the number of tasks logged by the organization.
     """
-    mongo_db = await get_mongo_db()
-    nb_tasks_logged = await mongo_db["tasks"].count_documents({"org_id": org_id})
+    nb_tasks_logged = await get_nb_tasks_logged(org_id)
 
     # These orgs are exempted from the quota
     EXEMPTED_ORG_IDS = [
@@ -126,6 +192,7 @@ def change_organization_plan(
         propelauth.update_org_metadata(
             org_id, max_users=config.PLAN_PRO_MAX_USERS, metadata=org_metadata
         )
+        org_plan_cache.invalidate(org_id)
         return org_metadata
     except Exception as e:
         logger.error(f"Error upgrading organization {org_id} to pro plan: {e}")
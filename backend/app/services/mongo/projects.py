@@ -1,9 +1,11 @@
+import asyncio
 import datetime
 import io
 import time
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 import pandas as pd
+import pymongo
 import resend
 from app.api.platform.models import (
     ProjectEventsFilters,
@@ -20,19 +22,56 @@ from app.db.models import (
     Test,
 )
 from app.db.mongo import get_mongo_db
-from app.security.authentification import propelauth
+from app.security.authentification import invalidate_project_org_id, propelauth
 from app.services.mongo.metadata import fetch_user_metadata
 from app.services.slack import slack_notification
 from app.utils import generate_timestamp
+from app.utils.blocking import run_blocking
+from app.utils.pagination import PAGINATION_SORT, cursor_filter
 from fastapi import HTTPException
 from loguru import logger
 from openai import AsyncOpenAI
 from propelauth_fastapi import User
+from pydantic import ValidationError
 
 import phospho
 from phospho.utils import filter_nonjsonable_keys
 
 
+# Collections listed with keyset pagination
+PAGINATED_COLLECTIONS = ["tasks", "sessions", "events"]
+
+# Keep a reference to the background index builds
+pagination_indexes_task: Optional[asyncio.Task] = None
+
+
+async def ensure_pagination_indexes() -> None:
+    """
+    Create the indexes of the paginated listings, in the PAGINATION_SORT order: a page is
+    then read from the index whatever its position. The builds run in the background.
+    """
+    global pagination_indexes_task
+
+    async def create_pagination_indexes() -> None:
+        mongo_db = await get_mongo_db()
+        for collection in PAGINATED_COLLECTIONS:
+            try:
+                await mongo_db[collection].create_index(
+                    [("project_id", pymongo.ASCENDING)]
+                    + [
+                        (field, pymongo.DESCENDING if order < 0 else pymongo.ASCENDING)
+                        for field, order in PAGINATION_SORT.items()
+                    ],
+                    name=f"{collection}_pagination",
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Could not create the pagination index of the {collection}: {e}"
+                )
+
+    pagination_indexes_task = asyncio.create_task(create_pagination_indexes())
+
+
 def cast_datetime_or_timestamp_to_timestamp(
     date_or_ts: Union[datetime.datetime, int],
 ) -> int:
@@ -83,6 +122,7 @@ async def delete_project_from_id(project_id: str) -> bool:
     """
     mongo_db = await get_mongo_db()
     delete_result = await mongo_db["projects"].delete_one({"id": project_id})
+    invalidate_project_org_id(project_id)
     status = delete_result.deleted_count > 0
     return status
 
@@ -113,6 +153,9 @@ async def update_project(project: Project, **kwargs) -> Project:
         update_result = await mongo_db["projects"].update_one(
             {"id": project.id}, {"$set": payload}
         )
+        if "org_id" in payload:
+            # The project was moved to another org
+            invalidate_project_org_id(project.id)
     updated_project = await get_project_by_id(project.id)
     return updated_project
 
@@ -141,7 +184,20 @@ async def add_project_events(project_id: str, events: List[EventDefinition]) ->
     return updated_project
 
 
-async def get_all_tasks(
+def event_summary_stages(get_events: bool) -> List[Dict[str, object]]:
+    """
+    Return the event_summary of the documents as their events, without joining the events
+    collection: it has one event per event name (see scripts/backfill_event_names.py).
+    """
+    if not get_events:
+        return [{"$project": {"events": 0, "event_summary": 0}}]
+    return [
+        {"$set": {"events": {"$ifNull": ["$event_summary", []]}}},
+        {"$project": {"event_summary": 0}},
+    ]
+
+
+def get_tasks_pipeline(
     project_id: str,
     flag_filter: Optional[str] = None,
     metadata_filter: Optional[Dict[str, object]] = None,
@@ -151,24 +207,18 @@ async def get_all_tasks(
     created_at_end: Optional[Union[int, datetime.datetime]] = None,
     get_events: bool = True,
     get_tests: bool = False,
-    validate_metadata: bool = False,
     limit: Optional[int] = 1000,
-) -> List[Task]:
+    cursor: Optional[str] = None,
+) -> List[Dict[str, object]]:
     """
-    Get all the tasks of a project.
-
-    limit: Set to None to get all tasks
-    get_tests:
+    Aggregation pipeline of the tasks of a project, newest first.
     """
-
-    mongo_db = await get_mongo_db()
-
     main_filter: Dict[str, object] = {}
     main_filter["project_id"] = project_id
     if flag_filter:
         main_filter["flag"] = flag_filter
     if event_name_filter:
-        main_filter["event_name"] = {"$in": event_name_filter}
+        main_filter["event_names"] = {"$in": event_name_filter}
     if last_eval_source_filter:
         main_filter["last_eval.source"] = last_eval_source_filter
     if metadata_filter:
@@ -184,70 +234,84 @@ async def get_all_tasks(
         }
     if not get_tests:
         main_filter["test_id"] = None
+    if cursor is not None:
+        main_filter = {"$and": [main_filter, cursor_filter(cursor)]}
 
-    if get_events or event_name_filter is not None:
-        pipeline = [
-            {"$match": main_filter},
-            {"$sort": {"created_at": -1}},
-            {
-                "$lookup": {
-                    "from": "events",
-                    "localField": "id",
-                    "foreignField": "task_id",
-                    "as": "events",
-                }
-            },
-            # Deduplicate events names. We want the unique event_names of the task
-            {
-                "$addFields": {
-                    "events": {
-                        "$reduce": {
-                            "input": "$events",
-                            "initialValue": [],
-                            "in": {
-                                "$concatArrays": [
-                                    "$$value",
-                                    {
-                                        "$cond": [
-                                            {
-                                                "$in": [
-                                                    "$$this.event_name",
-                                                    "$$value.event_name",
-                                                ]
-                                            },
-                                            [],
-                                            ["$$this"],
-                                        ]
-                                    },
-                                ]
-                            },
-                        }
-                    }
-                }
-            },
-        ]
-        if event_name_filter is not None:
-            pipeline.append(
-                {"$match": {"events.event_name": {"$in": event_name_filter}}}
-            )
-        tasks = await mongo_db["tasks"].aggregate(pipeline).to_list(length=limit)
-    else:
-        tasks = (
-            await mongo_db["tasks"]
-            .find(main_filter)
-            .sort("created_at", -1)
-            .to_list(length=limit)
-        )
+    pipeline: List[Dict[str, object]] = [
+        {"$match": main_filter},
+        {"$sort": PAGINATION_SORT},
+    ]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline.extend(event_summary_stages(get_events))
+    return pipeline
 
-    # Cast to tasks
-    valid_tasks = [Task.model_validate(task) for task in tasks]
-    if validate_metadata:
-        for task in valid_tasks:
-            # Remove the _id field from the task metadata
-            if task.metadata is not None:
-                task.metadata = filter_nonjsonable_keys(task.metadata)
 
-    return valid_tasks
+def validate_task(task: dict, validate_metadata: bool = False) -> Task:
+    valid_task = Task.model_validate(task)
+    if validate_metadata and valid_task.metadata is not None:
+        # Remove the _id field from the task metadata
+        valid_task.metadata = filter_nonjsonable_keys(valid_task.metadata)
+    return valid_task
+
+
+async def get_all_tasks(
+    project_id: str,
+    flag_filter: Optional[str] = None,
+    metadata_filter: Optional[Dict[str, object]] = None,
+    last_eval_source_filter: Optional[str] = None,
+    event_name_filter: Optional[List[str]] = None,
+    created_at_start: Optional[Union[int, datetime.datetime]] = None,
+    created_at_end: Optional[Union[int, datetime.datetime]] = None,
+    get_events: bool = True,
+    get_tests: bool = False,
+    validate_metadata: bool = False,
+    limit: Optional[int] = 1000,
+    cursor: Optional[str] = None,
+) -> List[Task]:
+    """
+    Get all the tasks of a project.
+
+    limit: Set to None to get all tasks
+    cursor: Get the tasks after this cursor (see app/utils/pagination.py)
+    """
+    mongo_db = await get_mongo_db()
+    pipeline = get_tasks_pipeline(
+        project_id=project_id,
+        flag_filter=flag_filter,
+        metadata_filter=metadata_filter,
+        last_eval_source_filter=last_eval_source_filter,
+        event_name_filter=event_name_filter,
+        created_at_start=created_at_start,
+        created_at_end=created_at_end,
+        get_events=get_events,
+        get_tests=get_tests,
+        limit=limit,
+        cursor=cursor,
+    )
+    tasks = await mongo_db["tasks"].aggregate(pipeline).to_list(length=None)
+    return [validate_task(task, validate_metadata) for task in tasks]
+
+
+async def stream_all_tasks(
+    project_id: str,
+    validate_metadata: bool = False,
+    **filters: Any,
+) -> AsyncIterator[Task]:
+    """
+    Yield the tasks of a project as the Mongo cursor returns them, without loading all of
+    them in memory. Takes the same filters as get_all_tasks.
+    """
+    mongo_db = await get_mongo_db()
+    pipeline = get_tasks_pipeline(project_id=project_id, **filters)
+    async for task in mongo_db["tasks"].aggregate(pipeline):
+        try:
+            valid_task = validate_task(task, validate_metadata)
+        except ValidationError as e:
+            # The response has started: skip the task rather than cutting the stream
+            logger.error(f"Skipping the invalid task {task.get('id')}: {e}")
+            continue
+        yield valid_task
 
 
 async def email_project_tasks(
@@ -258,7 +322,9 @@ async def email_project_tasks(
     tasks_list = await get_all_tasks(project_id=project_id)
 
     # Get the user email
-    user = propelauth.fetch_user_metadata_by_user_id(uid, include_orgs=False)
+    user = await run_blocking(
+        propelauth.fetch_user_metadata_by_user_id, uid, include_orgs=False
+    )
 
     # Use Resend to send the email
     resend.api_key = config.RESEND_API_KEY
@@ -300,7 +366,7 @@ async def email_project_tasks(
             ],
         }
 
-        email = resend.Emails.send(params)
+        email = await run_blocking(resend.Emails.send, params)
 
         logger.info(f"Successfully sent tasks by email to {user.get('email')}")
 
@@ -319,17 +385,16 @@ async def email_project_tasks(
             """,
         }
 
-        email = resend.Emails.send(params)
+        email = await run_blocking(resend.Emails.send, params)
 
         logger.debug("Sent error message to user")
 
 
-async def get_all_events(
+def get_events_filter(
     project_id: str,
-    limit: Optional[int] = None,
     events_filter: Optional[ProjectEventsFilters] = None,
-) -> List[Event]:
-    mongo_db = await get_mongo_db()
+    cursor: Optional[str] = None,
+) -> Dict[str, object]:
     additional_event_filters: Dict[str, object] = {}
     if events_filter is not None:
         if events_filter.event_name is not None:
@@ -352,11 +417,26 @@ async def get_all_events(
                     events_filter.created_at_end
                 ),
             }
+    main_filter: Dict[str, object] = {
+        "project_id": project_id,
+        **additional_event_filters,
+    }
+    if cursor is not None:
+        main_filter = {"$and": [main_filter, cursor_filter(cursor)]}
+    return main_filter
 
+
+async def get_all_events(
+    project_id: str,
+    limit: Optional[int] = None,
+    events_filter: Optional[ProjectEventsFilters] = None,
+    cursor: Optional[str] = None,
+) -> List[Event]:
+    mongo_db = await get_mongo_db()
     events = (
         await mongo_db["events"]
-        .find({"project_id": project_id, **additional_event_filters})
-        .sort("created_at", -1)
+        .find(get_events_filter(project_id, events_filter, cursor))
+        .sort(list(PAGINATION_SORT.items()))
         .to_list(length=limit)
     )
     # Cast to model
@@ -364,14 +444,40 @@ async def get_all_events(
     return events
 
 
-async def get_all_sessions(
+async def stream_all_events(
     project_id: str,
-    limit: int = 1000,
+    events_filter: Optional[ProjectEventsFilters] = None,
+    cursor: Optional[str] = None,
+) -> AsyncIterator[Event]:
+    """
+    Yield the events of a project as the Mongo cursor returns them.
+    """
+    mongo_db = await get_mongo_db()
+    async for event in (
+        mongo_db["events"]
+        .find(get_events_filter(project_id, events_filter, cursor))
+        .sort(list(PAGINATION_SORT.items()))
+    ):
+        try:
+            valid_event = Event.model_validate(event)
+        except ValidationError as e:
+            # The response has started: skip the event rather than cutting the stream
+            logger.error(f"Skipping the invalid event {event.get('id')}: {e}")
+            continue
+        yield valid_event
+
+
+def get_sessions_pipeline(
+    project_id: str,
+    limit: Optional[int] = 1000,
     sessions_filter: Optional[ProjectSessionsFilters] = None,
     get_events: bool = True,
     get_tasks: bool = False,
-) -> List[Session]:
-    mongo_db = await get_mongo_db()
+    cursor: Optional[str] = None,
+) -> List[Dict[str, object]]:
+    """
+    Aggregation pipeline of the sessions of a project, newest first.
+    """
     additional_sessions_filter: Dict[str, object] = {}
     if sessions_filter is not None:
         if sessions_filter.created_at_start is not None:
@@ -385,88 +491,80 @@ async def get_all_sessions(
                 **additional_sessions_filter.get("created_at", {}),
                 "$lte": sessions_filter.created_at_end,
             }
-
-    if not get_events and not get_tasks:
-        sessions = (
-            await mongo_db["sessions"]
-            .find({"project_id": project_id})
-            .sort("created_at", -1)
-            .to_list(length=limit)
+    main_filter: Dict[str, object] = {
+        "project_id": project_id,
+        **additional_sessions_filter,
+    }
+    if cursor is not None:
+        main_filter = {"$and": [main_filter, cursor_filter(cursor)]}
+
+    pipeline: List[Dict[str, object]] = [
+        {"$match": main_filter},
+        {"$sort": PAGINATION_SORT},
+    ]
+    # Only look up the tasks of the sessions returned
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline.extend(event_summary_stages(get_events))
+    if get_tasks:
+        pipeline.extend(
+            [
+                {
+                    "$lookup": {
+                        "from": "tasks",
+                        "localField": "id",
+                        "foreignField": "session_id",
+                        "as": "tasks",
+                    }
+                },
+                # If tasks is None, set to empty list
+                {"$addFields": {"tasks": {"$ifNull": ["$tasks", []]}}},
+            ]
         )
-    else:
-        pipeline = [
-            {
-                "$match": {
-                    "project_id": project_id,
-                    **additional_sessions_filter,
-                }
-            },
-            {"$sort": {"created_at": -1}},
-        ]
-        if get_events:
-            pipeline.extend(
-                [
-                    {
-                        "$lookup": {
-                            "from": "events",
-                            "localField": "id",
-                            "foreignField": "session_id",
-                            "as": "events",
-                        }
-                    },
-                    # If events is None, set to empty list
-                    {"$addFields": {"events": {"$ifNull": ["$events", []]}}},
-                    # Deduplicate events names. We want the unique event_names of the session
-                    {
-                        "$addFields": {
-                            "events": {
-                                "$reduce": {
-                                    "input": "$events",
-                                    "initialValue": [],
-                                    "in": {
-                                        "$concatArrays": [
-                                            "$$value",
-                                            {
-                                                "$cond": [
-                                                    {
-                                                        "$in": [
-                                                            "$$this.event_name",
-                                                            "$$value.event_name",
-                                                        ]
-                                                    },
-                                                    [],
-                                                    ["$$this"],
-                                                ]
-                                            },
-                                        ]
-                                    },
-                                }
-                            }
-                        }
-                    },
-                ]
-            )
-        if get_tasks:
-            pipeline.extend(
-                [
-                    {
-                        "$lookup": {
-                            "from": "tasks",
-                            "localField": "id",
-                            "foreignField": "session_id",
-                            "as": "tasks",
-                        }
-                    },
-                    # If tasks is None, set to empty list
-                    {"$addFields": {"tasks": {"$ifNull": ["$tasks", []]}}},
-                ]
-            )
-        sessions = await mongo_db["sessions"].aggregate(pipeline).to_list(length=limit)
+    return pipeline
+
 
+async def get_all_sessions(
+    project_id: str,
+    limit: Optional[int] = 1000,
+    sessions_filter: Optional[ProjectSessionsFilters] = None,
+    get_events: bool = True,
+    get_tasks: bool = False,
+    cursor: Optional[str] = None,
+) -> List[Session]:
+    mongo_db = await get_mongo_db()
+    pipeline = get_sessions_pipeline(
+        project_id=project_id,
+        limit=limit,
+        sessions_filter=sessions_filter,
+        get_events=get_events,
+        get_tasks=get_tasks,
+        cursor=cursor,
+    )
+    sessions = await mongo_db["sessions"].aggregate(pipeline).to_list(length=None)
     sessions = [Session.model_validate(data) for data in sessions]
     return sessions
 
 
+async def stream_all_sessions(
+    project_id: str, **filters: Any
+) -> AsyncIterator[Session]:
+    """
+    Yield the sessions of a project as the Mongo cursor returns them.
+    Takes the same filters as get_all_sessions.
+    """
+    mongo_db = await get_mongo_db()
+    pipeline = get_sessions_pipeline(project_id=project_id, **filters)
+    async for session in mongo_db["sessions"].aggregate(pipeline):
+        try:
+            valid_session = Session.model_validate(session)
+        except ValidationError as e:
+            # The response has started: skip the session rather than cutting the stream
+            logger.error(f"Skipping the invalid session {session.get('id')}: {e}")
+            continue
+        yield valid_session
+
+
 async def get_all_tests(project_id: str, limit: int = 1000) -> List[Test]:
     mongo_db = await get_mongo_db()
     tests = (
@@ -1,35 +1,95 @@
-from typing import List, Tuple
+"""
+Search in the tasks and sessions of a project.
 
-import openai
-from app.db.models import Session, Task
+- "semantic" mode: similarity of the embeddings of the query and of the tasks (Qdrant)
+- "hybrid" mode: the semantic ranking is fused with a Mongo text search, which finds the
+  exact words and identifiers the embeddings miss, with reciprocal rank fusion
+
+The search functions return ranked ids. The text search results already have the task_id
+and session_id. The vectors of deleted tasks may remain in Qdrant: the vector hits are
+checked against the tasks with a projection-only fetch of their ids.
+"""
+
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import pymongo
+from pymongo.errors import OperationFailure
+from app.core import config
 from app.db.mongo import get_mongo_db
 from app.db.qdrant import get_qdrant, models
+from app.services.embedding_providers import get_embedding_provider
+from app.utils.cache import TTLCache
 from loguru import logger
 
-openai_client = openai.AsyncClient()
+# (provider collection, normalized query) -> embedding
+query_embedding_cache = TTLCache(
+    ttl=config.QUERY_EMBEDDING_CACHE_TTL,
+    max_size=config.QUERY_EMBEDDING_CACHE_MAX_SIZE,
+)
 
+# (task_id, session_id)
+SearchHit = Tuple[str, Optional[str]]
 
-async def search_tasks_in_project(
-    project_id: str,
-    search_query: str,
-) -> List[Task]:
-    mongo_db = await get_mongo_db()
-    qdrant_db = await get_qdrant()
-    # Embed the query
+# Keep a reference to the background index build
+text_index_task: Optional[asyncio.Task] = None
+
+
+async def ensure_search_indexes() -> None:
+    """
+    Create the text index of the hybrid search. The build runs in the background.
+    """
+    global text_index_task
+
+    async def create_text_index() -> None:
+        mongo_db = await get_mongo_db()
+        try:
+            await mongo_db["tasks"].create_index(
+                [
+                    ("project_id", pymongo.ASCENDING),
+                    ("input", pymongo.TEXT),
+                    ("output", pymongo.TEXT),
+                ],
+                name="tasks_search_text",
+            )
+        except Exception as e:
+            logger.warning(f"Could not create the text index of the tasks: {e}")
+
+    text_index_task = asyncio.create_task(create_text_index())
+
+
+def normalize_query(search_query: str) -> str:
+    return " ".join(search_query.split()).lower()
+
+
+async def embed_query(search_query: str) -> Optional[List[float]]:
+    embedding_provider = get_embedding_provider()
+    query = normalize_query(search_query)
+    if query == "":
+        return None
     try:
-        query_embedding = await openai_client.embeddings.create(
-            input=search_query, model="text-embedding-3-small"
+        return await query_embedding_cache.aget_or_set(
+            (embedding_provider.collection_name, query),
+            lambda: embedding_provider.embed_query(query),
         )
-    except openai.APIError as e:
-        # If the query is too short, we can't embed it
-        # In this case, we just return an empty list
+    except Exception as e:
+        # Eg: the query is too short to be embedded, or the provider (OpenAI API, local
+        # model) failed. The search returns no semantic results.
         logger.warning(f"Error while embedding the query: {e}")
-        return []
+        return None
+
 
-    # Search in the project
+async def vector_search(
+    project_id: str, search_query: str, limit: int
+) -> List[SearchHit]:
+    query_embedding = await embed_query(search_query)
+    if query_embedding is None:
+        return []
+    qdrant_db = await get_qdrant()
     found_vectors = await qdrant_db.search(
-        collection_name="tasks",
-        query_vector=query_embedding.data[0].embedding,
+        collection_name=get_embedding_provider().collection_name,
+        query_vector=query_embedding,
         query_filter=models.Filter(
             must=[
                 models.FieldCondition(
@@ -37,59 +97,141 @@ async def search_tasks_in_project(
                 )
             ]
         ),
-        limit=5,
-        # score_threshold=0.5,
+        limit=limit,
     )
-    foud_vectors_mapping = {
-        vector.payload.get("task_id"): vector
+    task_ids = [
+        vector.payload["task_id"]
         for vector in found_vectors
         if vector.payload is not None
         and vector.payload.get("task_id", None) is not None
-    }
+    ]
+    return await existing_tasks_hits(project_id, task_ids)
+
 
-    # Get the tasks
+async def existing_tasks_hits(project_id: str, task_ids: List[str]) -> List[SearchHit]:
+    """
+    Keep the tasks that still exist, in the same order, with their current session_id.
+    """
+    if len(task_ids) == 0:
+        return []
+    mongo_db = await get_mongo_db()
     tasks = (
         await mongo_db["tasks"]
-        .find({"id": {"$in": list(foud_vectors_mapping.keys())}})
+        .find(
+            {"project_id": project_id, "id": {"$in": task_ids}},
+            {"_id": 0, "id": 1, "session_id": 1},
+        )
         .to_list(length=None)
     )
+    session_ids = {task["id"]: task.get("session_id") for task in tasks}
+    return [
+        (task_id, session_ids[task_id])
+        for task_id in task_ids
+        if task_id in session_ids
+    ]
 
-    # Sort the tasks by the order of the found_vectors
-    tasks = sorted(
-        tasks,
-        key=lambda task: foud_vectors_mapping[task["id"]].score,
-        reverse=True,
-    )
 
-    # Return the tasks
-    tasks = [Task.model_validate(task) for task in tasks]
-    return tasks
+async def text_search(
+    project_id: str, search_query: str, limit: int
+) -> List[SearchHit]:
+    mongo_db = await get_mongo_db()
+    try:
+        tasks = (
+            await mongo_db["tasks"]
+            .find(
+                {"project_id": project_id, "$text": {"$search": search_query}},
+                {"id": 1, "session_id": 1, "score": {"$meta": "textScore"}},
+            )
+            .sort([("score", {"$meta": "textScore"})])
+            .limit(limit)
+            .to_list(length=None)
+        )
+    except OperationFailure as e:
+        # Eg: the text index is not built yet
+        logger.warning(f"Error during the text search: {e}")
+        return []
+    return [(task["id"], task.get("session_id")) for task in tasks if "id" in task]
 
 
-async def search_sessions_in_project(
+def reciprocal_rank_fusion(
+    rankings: List[List[SearchHit]], k: int
+) -> List[SearchHit]:
+    """
+    Fuse rankings: the score of a hit is the sum of 1 / (k + rank) over the rankings.
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    hits: Dict[str, SearchHit] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            scores[hit[0]] += 1 / (k + rank)
+            hits.setdefault(hit[0], hit)
+    return [hits[task_id] for task_id in sorted(scores, key=scores.get, reverse=True)]
+
+
+async def search_ranked_tasks(
+    project_id: str, search_query: str, limit: int, mode: Optional[str] = None
+) -> List[SearchHit]:
+    """
+    The limit most relevant tasks of the project for the query, best first.
+    """
+    if mode is None:
+        mode = config.SEARCH_DEFAULT_MODE
+    if mode == "semantic":
+        return await vector_search(project_id, search_query, limit)
+    if mode == "hybrid":
+        vector_hits, text_hits = await asyncio.gather(
+            vector_search(project_id, search_query, limit),
+            text_search(project_id, search_query, limit),
+        )
+        fused_hits = reciprocal_rank_fusion(
+            [vector_hits, text_hits], k=config.SEARCH_RRF_K
+        )
+        return fused_hits[:limit]
+    raise NotImplementedError(f"Search mode {mode} is not supported.")
+
+
+async def search_tasks_in_project(
     project_id: str,
     search_query: str,
-) -> Tuple[
-    List[Task],
-    List[Session],
-]:
-    relevant_tasks = await search_tasks_in_project(
-        project_id=project_id,
-        search_query=search_query,
+    limit: int = 5,
+    offset: int = 0,
+    mode: Optional[str] = None,
+) -> List[str]:
+    """
+    Returns the ids of the relevant tasks, best first.
+    """
+    hits = await search_ranked_tasks(
+        project_id, search_query, limit=offset + limit, mode=mode
     )
-    # Find the sessions that contain the relevant tasks
-    mongo_db = await get_mongo_db()
-    relevant_sessions = (
-        await mongo_db["sessions"]
-        .find(
-            {
-                "project_id": project_id,
-                "id": {"$in": [task.session_id for task in relevant_tasks]},
-            }
-        )
-        .to_list(length=None)
+    return [task_id for task_id, _ in hits[offset : offset + limit]]
+
+
+async def search_sessions_in_project(
+    project_id: str,
+    search_query: str,
+    limit: int = 5,
+    offset: int = 0,
+    mode: Optional[str] = None,
+) -> Tuple[List[str], List[str]]:
+    """
+    Returns the ids of the relevant tasks and sessions, best first.
+    A session is ranked by its most relevant task. The tasks returned are the relevant
+    tasks of the sessions returned.
+    """
+    hits = await search_ranked_tasks(
+        project_id,
+        search_query,
+        limit=(offset + limit) * config.SEARCH_SESSION_CANDIDATES_FACTOR,
+        mode=mode,
     )
-    relevant_sessions = [
-        Session.model_validate(session) for session in relevant_sessions
+    # session_id -> ids of its relevant tasks, best first
+    session_tasks: Dict[str, List[str]] = {}
+    for task_id, session_id in hits:
+        if session_id is not None:
+            session_tasks.setdefault(session_id, []).append(task_id)
+
+    session_ids = list(session_tasks.keys())[offset : offset + limit]
+    task_ids = [
+        task_id for session_id in session_ids for task_id in session_tasks[session_id]
     ]
-    return relevant_tasks, relevant_sessions
+    return task_ids, session_ids
@@ -4,6 +4,7 @@ from phospho.utils import filter_nonjsonable_keys
 import pydantic
 from app.db.models import Eval, Task
 from app.db.mongo import get_mongo_db
+from app.services.mongo.organizations import increment_org_usage
 from fastapi import HTTPException
 
 from app.utils import generate_uuid
@@ -41,6 +42,7 @@ async def create_task(
     doc_creation = await mongo_db["tasks"].insert_one(task_data.model_dump())
     if not doc_creation:
         raise Exception("Failed to insert the task in database")
+    await increment_org_usage(org_id, 1)
     return task_data
 
 
@@ -64,6 +66,20 @@ async def get_task_by_id(task_id: str) -> Task:
     return task
 
 
+async def invalidate_few_shot_examples(project_id: str, source: str) -> None:
+    """
+    The extractor caches the user evals of a project, to use them as few shot examples.
+    Increment the version of the project to invalidate this cache.
+    """
+    if source in ["phospho", "phospho-4"]:
+        # Evals made by phospho are not used as examples
+        return
+    mongo_db = await get_mongo_db()
+    await mongo_db["few_shot_examples_versions"].update_one(
+        {"_id": project_id}, {"$inc": {"version": 1}}, upsert=True
+    )
+
+
 async def flag_task(
     task_model: Task,
     flag: str,
@@ -90,6 +106,7 @@ async def flag_task(
         raise HTTPException(status_code=400, detail=f"Failed to create eval: {e}")
 
     eval_insert = await mongo_db["evals"].insert_one(eval_data.model_dump())
+    await invalidate_few_shot_examples(task_model.project_id, source)
 
     # Update the task object
     try:
@@ -148,6 +165,7 @@ async def update_task(
             source=flag_source,
         )
         eval_insert = await mongo_db["evals"].insert_one(eval_data.model_dump())
+        await invalidate_few_shot_examples(task_model.project_id, flag_source)
         task_model.last_eval = eval_data
 
     # Update the task object
@@ -0,0 +1,117 @@
+"""
+Keep blocking calls (PropelAuth, Stripe, Resend, requests...) out of the event loop.
+
+A blocking call made from an `async def` stalls every concurrent request of the worker.
+Use `await run_blocking(func, *args, **kwargs)` to run it in a bounded thread pool.
+
+In debug, `start_loop_stall_detector()` logs the stack of the code blocking the event
+loop for more than LOOP_STALL_THRESHOLD_MS milliseconds.
+"""
+
+import asyncio
+import contextvars
+import functools
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from loguru import logger
+
+from app.core import config
+
+T = TypeVar("T")
+
+blocking_executor = ThreadPoolExecutor(
+    max_workers=config.BLOCKING_IO_MAX_WORKERS, thread_name_prefix="blocking-io"
+)
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function in the thread pool, without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    # Keep the context variables (eg: logging and tracing context) in the thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        blocking_executor, functools.partial(context.run, func, *args, **kwargs)
+    )
+
+
+class LoopStallDetector:
+    """
+    Detect when the event loop is blocked for more than threshold_ms milliseconds.
+
+    A task on the event loop updates a heartbeat every interval. A watchdog thread
+    checks the heartbeat, and logs the current stack of the event loop thread when
+    the heartbeat is late.
+    """
+
+    def __init__(self, threshold_ms: float, interval_ms: Optional[float] = None) -> None:
+        self.threshold = threshold_ms / 1000
+        self.interval = (interval_ms or threshold_ms / 4) / 1000
+        self.last_heartbeat = time.monotonic()
+        self.running = False
+        self.loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def _heartbeat(self) -> None:
+        while self.running:
+            self.last_heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        # Only report a stall once
+        reported_heartbeat = None
+        while self.running:
+            time.sleep(self.interval)
+            last_heartbeat = self.last_heartbeat
+            stall_duration = time.monotonic() - last_heartbeat
+            if stall_duration < self.threshold or last_heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = last_heartbeat
+            frame = sys._current_frames().get(self.loop_thread_id)  # type: ignore
+            stack = "".join(traceback.format_stack(frame)) if frame else "unknown"
+            logger.warning(
+                f"Event loop blocked for more than {stall_duration * 1000:.0f}ms. Stack:\n{stack}"
+            )
+
+    def start(self) -> None:
+        """Start the detector. Must be called from the event loop."""
+        self.running = True
+        self.loop_thread_id = threading.get_ident()
+        self.last_heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(
+            target=self._watch, daemon=True, name="loop-stall-detector"
+        )
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self._task is not None:
+            self._task.cancel()
+
+
+loop_stall_detector: Optional[LoopStallDetector] = None
+
+
+async def start_loop_stall_detector() -> None:
+    """Start the loop stall detector if LOOP_STALL_THRESHOLD_MS is set"""
+    global loop_stall_detector
+    if config.LOOP_STALL_THRESHOLD_MS is None:
+        return
+    loop_stall_detector = LoopStallDetector(threshold_ms=config.LOOP_STALL_THRESHOLD_MS)
+    loop_stall_detector.start()
+    logger.info(
+        f"Loop stall detector started (threshold: {config.LOOP_STALL_THRESHOLD_MS}ms)"
+    )
+
+
+async def stop_loop_stall_detector() -> None:
+    global loop_stall_detector
+    if loop_stall_detector is not None:
+        loop_stall_detector.stop()
+        loop_stall_detector = None
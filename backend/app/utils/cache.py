@@ -0,0 +1,99 @@
+"""
+In-memory caches, used to avoid hitting the database or PropelAuth on every request.
+
+The caches are local to the process: use a short ttl for data that can be changed by
+other instances of the backend.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    A dict whose entries expire ttl seconds after they were set.
+    When max_size is reached, the entry set the longest time ago is evicted.
+
+    The cache can be used from the event loop and from the threads of the threadpool.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10_000) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # key -> (expiration time, value)
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        # key -> value being computed by aget_or_set
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self.lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.max_size:
+                # Evict the entry set the longest time ago
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self.lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self._entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def aget_or_set(
+        self, key: Hashable, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Get the value of key. If it's not cached, await compute() and cache its result,
+        unless it's None. Concurrent calls for the same key share the same computation.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Don't warn about an exception never retrieved if there is no concurrent call
+            future.exception()
+            raise
+        else:
+            if value is not None:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._pending[key]
+
+
+_MISSING = object()
@@ -0,0 +1,112 @@
+"""
+Compression of the request bodies exchanged with the SDK and the extractor.
+
+Log batches carry full LLM payloads, which are highly compressible json.
+Clients can send them with a `Content-Encoding: gzip` (or `zstd`) header.
+"""
+
+import zlib
+from typing import Callable, Coroutine, Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are not worth compressing
+COMPRESSION_MIN_SIZE = 1024  # in bytes
+# Protect against decompression bombs
+MAX_DECOMPRESSED_BODY_SIZE = 512 * 1024 * 1024  # in bytes
+
+
+def compress_body(
+    body: bytes, min_size: int = COMPRESSION_MIN_SIZE
+) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Gzip the body if it's bigger than min_size.
+    Returns the body to send and the headers to add to the request.
+    """
+    if len(body) < min_size:
+        return body, {}
+    # wbits=16+MAX_WBITS produces a gzip container
+    compressor = zlib.compressobj(level=6, wbits=16 + zlib.MAX_WBITS)
+    compressed_body = compressor.compress(body) + compressor.flush()
+    return compressed_body, {"Content-Encoding": "gzip"}
+
+
+def decompress_body(
+    body: bytes,
+    content_encoding: Optional[str],
+    max_size: int = MAX_DECOMPRESSED_BODY_SIZE,
+) -> bytes:
+    """
+    Decompress a request body according to its Content-Encoding header.
+    Raises an HTTPException if the encoding is not supported or the body is invalid.
+    """
+    if content_encoding is None:
+        return body
+    content_encoding = content_encoding.strip().lower()
+    if content_encoding in ("", "identity"):
+        return body
+
+    if content_encoding in ("gzip", "deflate"):
+        # 32+MAX_WBITS automatically detects the gzip or zlib header
+        decompressor = zlib.decompressobj(wbits=32 + zlib.MAX_WBITS)
+        try:
+            decompressed_body = decompressor.decompress(body, max_size)
+        except zlib.error as e:
+            raise HTTPException(
+                status_code=400, detail=f"Invalid {content_encoding} body: {e}"
+            )
+        if decompressor.unconsumed_tail:
+            raise HTTPException(status_code=413, detail="Request body is too large")
+        return decompressed_body
+
+    if content_encoding == "zstd":
+        if zstandard is None:
+            raise HTTPException(
+                status_code=415, detail="zstd Content-Encoding is not supported"
+            )
+        try:
+            reader = zstandard.ZstdDecompressor().stream_reader(body)
+            decompressed_body = reader.read(max_size + 1)
+        except zstandard.ZstdError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid zstd body: {e}")
+        if len(decompressed_body) > max_size:
+            raise HTTPException(status_code=413, detail="Request body is too large")
+        return decompressed_body
+
+    raise HTTPException(
+        status_code=415, detail=f"Unsupported Content-Encoding: {content_encoding}"
+    )
+
+
+class DecompressedRequest(Request):
+    """A request whose body is transparently decompressed"""
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            self._body = decompress_body(
+                body, self.headers.get("content-encoding", None)
+            )
+        return self._body
+
+
+class DecompressedRequestRoute(APIRoute):
+    """
+    Route class that accepts gzip or zstd compressed request bodies.
+    Usage: `APIRouter(route_class=DecompressedRequestRoute)`
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            request = DecompressedRequest(request.scope, request.receive)
+            return await original_route_handler(request)
+
+        return custom_route_handler
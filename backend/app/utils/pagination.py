@@ -0,0 +1,71 @@
+"""
+Keyset pagination of the listing endpoints.
+
+Documents are sorted by (created_at, id), newest first. A page ends with a cursor, an opaque
+string encoding the (created_at, id) of its last document: the next page starts strictly
+after it. Unlike skip/offset, getting a page costs the same whatever its position, with the
+(project_id, created_at, id) indexes created at startup (ensure_pagination_indexes).
+"""
+
+import base64
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Protocol, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from app.utils.serialization import json_dumps
+
+# Sort of the paginated documents
+PAGINATION_SORT = {"created_at": -1, "id": -1}
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class Paginated(Protocol):
+    created_at: int
+    id: str
+
+
+def encode_cursor(created_at: int, id: str) -> str:
+    return base64.urlsafe_b64encode(json_dumps([created_at, id])).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    return created_at, id
+
+
+def cursor_filter(cursor: Optional[str]) -> Dict[str, object]:
+    """
+    Mongo filter of the documents after the cursor, in the PAGINATION_SORT order
+    """
+    if cursor is None:
+        return {}
+    created_at, id = decode_cursor(cursor)
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": id}},
+        ]
+    }
+
+
+def get_next_cursor(items: List[Paginated], limit: Optional[int]) -> Optional[str]:
+    """
+    The cursor of the page after items, or None if items is the last page.
+    """
+    if limit is None or len(items) == 0 or len(items) < limit:
+        return None
+    return encode_cursor(items[-1].created_at, items[-1].id)
+
+
+async def stream_ndjson(items: AsyncIterator[BaseModel]) -> AsyncIterator[bytes]:
+    """
+    Serialize the items as newline delimited json, one line per item.
+    """
+    async for item in items:
+        yield json_dumps(item.model_dump()) + b"\n"
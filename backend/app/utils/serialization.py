@@ -0,0 +1,87 @@
+"""
+Fast json serialization of the large payloads of the API: responses, and log batches
+forwarded to the extractor.
+
+orjson or msgspec are used when installed, with a fallback to the standard library.
+Set the JSON_SERIALIZER environment variable to choose one of them.
+
+Like the standard library, the serializers raise a TypeError on the types they don't
+support, instead of silently converting them to strings.
+"""
+
+import json
+from typing import Any, Callable
+
+from fastapi.responses import JSONResponse
+from loguru import logger
+
+from app.core import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _orjson_dumps(content: Any) -> bytes:
+    # orjson natively serializes datetimes, dataclasses and numpy arrays
+    return orjson.dumps(
+        content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    )
+
+
+def _msgspec_dumps(content: Any) -> bytes:
+    return msgspec.json.encode(content)
+
+
+def _json_dumps(content: Any) -> bytes:
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def get_json_dumps(serializer: str = "auto") -> Callable[[Any], bytes]:
+    """
+    Get a function serializing content to json bytes.
+    serializer is "orjson", "msgspec", "json" or "auto" (the fastest installed one).
+    """
+    if serializer == "auto":
+        if orjson is not None:
+            return _orjson_dumps
+        if msgspec is not None:
+            return _msgspec_dumps
+        return _json_dumps
+    if serializer == "orjson":
+        if orjson is None:
+            raise ImportError(
+                "Please install the `orjson` package to use it as serializer."
+            )
+        return _orjson_dumps
+    if serializer == "msgspec":
+        if msgspec is None:
+            raise ImportError(
+                "Please install the `msgspec` package to use it as serializer."
+            )
+        return _msgspec_dumps
+    if serializer == "json":
+        return _json_dumps
+    raise NotImplementedError(f"Serializer {serializer} is not supported.")
+
+
+json_dumps = get_json_dumps(config.JSON_SERIALIZER)
+logger.debug(f"Using {json_dumps.__name__} to serialize json")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with the fastest json serializer installed.
+    Usage: `FastAPI(default_response_class=FastJSONResponse)`
+    """
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
@@ -0,0 +1,90 @@
+"""
+This script fills the event_names and event_summary fields of the tasks and sessions, and
+the events field of the tasks, from the events collection. Run it during the deploy: the
+task and session listings read these fields without joining the events collection, and
+the extractor maintains them when it detects events.
+
+Usage: python -m scripts.backfill_event_names [project_id ...]
+Without project_id, all the projects are backfilled.
+"""
+
+import asyncio
+import sys
+from typing import List
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.mongo import close_mongo_db, connect_and_init_db, get_mongo_db
+
+BATCH_SIZE = 1000
+
+
+async def backfill(
+    collection: str, key: str, project_ids: List[str], with_events: bool
+) -> None:
+    """
+    Set the event_names and event_summary of the documents of collection, grouped by the
+    key field of the events (task_id or session_id). The summary has the first event of
+    each name. If with_events, also set their events, oldest first, as the extractor
+    pushes them.
+    """
+    mongo_db = await get_mongo_db()
+    match: dict = {key: {"$ne": None}}
+    if len(project_ids) > 0:
+        match["project_id"] = {"$in": project_ids}
+    # One group per document and event name, then one per document
+    name_group: dict = {
+        "_id": {"id": f"${key}", "event_name": "$event_name"},
+        "first_event": {"$first": "$$ROOT"},
+    }
+    group: dict = {
+        "_id": "$_id.id",
+        "event_names": {"$push": "$_id.event_name"},
+        "event_summary": {"$push": "$first_event"},
+    }
+    if with_events:
+        name_group["events"] = {"$push": "$$ROOT"}
+        group["events"] = {"$push": "$events"}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"created_at": 1}},
+        {"$project": {"_id": 0}},
+        {"$group": name_group},
+        {"$sort": {"first_event.created_at": 1}},
+        {"$group": group},
+    ]
+    operations = []
+    nb_updated = 0
+    async for group in mongo_db["events"].aggregate(pipeline, allowDiskUse=True):
+        update = {
+            "event_names": group["event_names"],
+            "event_summary": group["event_summary"],
+        }
+        if with_events:
+            update["events"] = sorted(
+                [event for events in group["events"] for event in events],
+                key=lambda event: event["created_at"],
+            )
+        operations.append(UpdateOne({"id": group["_id"]}, {"$set": update}))
+        if len(operations) >= BATCH_SIZE:
+            result = await mongo_db[collection].bulk_write(operations, ordered=False)
+            nb_updated += result.modified_count
+            operations = []
+    if len(operations) > 0:
+        result = await mongo_db[collection].bulk_write(operations, ordered=False)
+        nb_updated += result.modified_count
+    logger.info(f"Backfilled the event names of {nb_updated} {collection}")
+
+
+async def main(project_ids: List[str]) -> None:
+    await connect_and_init_db()
+    try:
+        await backfill("tasks", "task_id", project_ids, with_events=True)
+        await backfill("sessions", "session_id", project_ids, with_events=False)
+    finally:
+        await close_mongo_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,33 @@
+"""
+This script enqueues the re-embedding of the tasks, after changing the EMBEDDING_PROVIDER.
+The extractor workers embed the tasks of each project into the collection of the new provider.
+
+Usage: python -m scripts.reembed_tasks [project_id ...]
+Without project_id, all the projects are re-embedded.
+"""
+
+import asyncio
+import sys
+
+from loguru import logger
+
+from app.db.mongo import close_mongo_db, connect_and_init_db, get_mongo_db
+from app.services.mongo.extractor import enqueue_reembed_tasks
+
+
+async def main(project_ids: list) -> None:
+    await connect_and_init_db()
+    try:
+        if len(project_ids) == 0:
+            mongo_db = await get_mongo_db()
+            project_ids = await mongo_db["tasks"].distinct("project_id")
+            project_ids = [project_id for project_id in project_ids if project_id]
+        for project_id in project_ids:
+            await enqueue_reembed_tasks(project_id)
+        logger.info(f"Enqueued the re-embedding of {len(project_ids)} projects")
+    finally:
+        await close_mongo_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -1,5 +1,8 @@
+import json
+
 import app.core.config as config
 from app.api.v2.models import Project
+from app.db.models import Task
 from app.main import app as router
 from app.utils import generate_uuid
 from fastapi.testclient import TestClient
@@ -205,6 +208,59 @@ def test_create_and_update_task(
     cleanup(mongo_db, {"tasks": [task["id"]]})
 
 
+def test_tasks_pagination(
+    mongo_db,
+    dummy_project,
+    access_token,
+):
+    # Tasks from the newest to the oldest
+    tasks = [
+        Task(project_id=dummy_project.id, input=f"test {i}", created_at=1000 - 2 * i)
+        for i in range(3)
+    ]
+    mongo_db["tasks"].insert_many([task.model_dump() for task in tasks])
+    invalid_task_id = generate_uuid()
+
+    with TestClient(router) as client:
+        # First page
+        response = client.get(
+            f"/api/projects/{dummy_project.id}/tasks",
+            params={"limit": 2},
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        assert response.status_code == 200, response.text
+        assert [task["id"] for task in response.json()["tasks"]] == [
+            task.id for task in tasks[:2]
+        ]
+        cursor = response.json()["next_cursor"]
+        assert cursor is not None
+
+        # The next page starts after the cursor
+        response = client.get(
+            f"/api/projects/{dummy_project.id}/tasks",
+            params={"limit": 2, "cursor": cursor},
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        assert response.status_code == 200, response.text
+        assert [task["id"] for task in response.json()["tasks"]] == [tasks[2].id]
+        assert response.json()["next_cursor"] is None
+
+        # The stream starts after the cursor too, and skips the invalid tasks
+        mongo_db["tasks"].insert_one(
+            {"id": invalid_task_id, "project_id": dummy_project.id, "created_at": 997}
+        )
+        response = client.get(
+            f"/api/projects/{dummy_project.id}/tasks/stream",
+            params={"cursor": cursor},
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        assert response.status_code == 200, response.text
+        streamed_tasks = [json.loads(line) for line in response.text.splitlines()]
+        assert [task["id"] for task in streamed_tasks] == [tasks[2].id]
+
+    cleanup(mongo_db, {"tasks": [task.id for task in tasks] + [invalid_task_id]})
+
+
 # API v2 tests
 
 
@@ -0,0 +1,34 @@
+import bson
+
+from app.services.mongo.extractor import split_log_process_jobs
+
+
+def test_split_log_process_jobs():
+    log_event = {"input": "a" * 1000, "output": "b" * 1000}
+    log_event_size = len(bson.encode(log_event))
+
+    # A batch larger than the max size of a job is split into several jobs
+    jobs = split_log_process_jobs(
+        logs_to_process=[log_event] * 10,
+        extra_logs_to_save=[log_event] * 5,
+        max_bytes=4 * log_event_size,
+    )
+    assert [job_size for _, job_size in jobs] == [4 * log_event_size] * 3 + [
+        3 * log_event_size
+    ]
+    assert sum(len(job["logs_to_process"]) for job, _ in jobs) == 10
+    assert sum(len(job["extra_logs_to_save"]) for job, _ in jobs) == 5
+
+    # A log event larger than the max size is alone in its job
+    large_log_event = {"input": "a" * 10_000}
+    jobs = split_log_process_jobs(
+        logs_to_process=[log_event, large_log_event, log_event],
+        extra_logs_to_save=[],
+        max_bytes=4 * log_event_size,
+    )
+    assert [job["logs_to_process"] for job, _ in jobs] == [
+        [log_event],
+        [large_log_event],
+        [log_event],
+    ]
+    assert jobs[1][1] > 4 * log_event_size
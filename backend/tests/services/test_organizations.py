@@ -1,7 +1,13 @@
 import pytest
 from loguru import logger
 
-from app.services.mongo.organizations import get_usage_quota
+from app.db.models import Task
+from app.services.mongo.organizations import (
+    get_nb_tasks_logged,
+    get_usage_quota,
+    increment_org_usage,
+)
+from app.utils import generate_uuid
 
 
 @pytest.mark.asyncio
@@ -15,3 +21,35 @@ async def test_org_service(db, populated_project):
         logger.debug(f"Usage: {usage}")
 
         assert usage.get("current_usage") == 4
+
+
+@pytest.mark.asyncio
+async def test_org_usage_counter(db, dummy_project):
+    async for mongo_db in db:
+        org_id = generate_uuid()
+        tasks = [
+            Task(project_id=dummy_project.id, org_id=org_id, input=f"test {i}")
+            for i in range(3)
+        ]
+        await mongo_db["tasks"].insert_many([task.model_dump() for task in tasks])
+
+        # No counter yet: it's initialized with the real number of tasks
+        assert await get_nb_tasks_logged(org_id) == 3
+
+        # The counter is incremented when tasks are created, without counting them
+        await increment_org_usage(org_id, 2)
+        assert await get_nb_tasks_logged(org_id) == 5
+
+        # Once the reconciliation interval has passed, the drift is corrected
+        await mongo_db["org_usage"].update_one(
+            {"_id": org_id}, {"$set": {"reconciled_at": 0}}
+        )
+        assert await get_nb_tasks_logged(org_id) == 3
+        org_usage = await mongo_db["org_usage"].find_one({"_id": org_id})
+        assert org_usage["nb_tasks"] == 3
+        assert org_usage["reconciled_at"] > 0
+
+        await mongo_db["tasks"].delete_many(
+            {"id": {"$in": [task.id for task in tasks]}}
+        )
+        await mongo_db["org_usage"].delete_one({"_id": org_id})
@@ -0,0 +1,77 @@
+import pytest
+
+from app.db.models import Event, Session, Task
+from app.services.mongo.projects import get_all_sessions, get_all_tasks
+
+
+@pytest.mark.asyncio
+async def test_event_summary_listings(db, dummy_project):
+    async for mongo_db in db:
+        session = Session(project_id=dummy_project.id)
+        task = Task(
+            project_id=dummy_project.id,
+            session_id=session.id,
+            input="What is the weather like today?",
+            created_at=1000,
+        )
+        task_without_events = Task(
+            project_id=dummy_project.id, input="Hello", created_at=999
+        )
+        # The same event detected twice, eg when the task was reprocessed
+        events = [
+            Event(
+                event_name="question_answering",
+                task_id=task.id,
+                session_id=session.id,
+                project_id=dummy_project.id,
+                source="phospho-4",
+            )
+            for _ in range(2)
+        ]
+        # The fields maintained by the extractor. The events collection is left empty:
+        # the listings don't join it.
+        await mongo_db["tasks"].insert_many(
+            [
+                {
+                    **task.model_dump(),
+                    "events": [event.model_dump() for event in events],
+                    "event_names": ["question_answering"],
+                    "event_summary": [events[0].model_dump()],
+                },
+                task_without_events.model_dump(),
+            ]
+        )
+        await mongo_db["sessions"].insert_one(
+            {
+                **session.model_dump(),
+                "event_names": ["question_answering"],
+                "event_summary": [events[0].model_dump()],
+            }
+        )
+
+        # The events of the tasks are their summary, one per event name
+        tasks = await get_all_tasks(dummy_project.id)
+        assert [listed_task.id for listed_task in tasks] == [
+            task.id,
+            task_without_events.id,
+        ]
+        assert [event.id for event in tasks[0].events] == [events[0].id]
+        assert tasks[1].events == []
+
+        tasks = await get_all_tasks(
+            dummy_project.id, event_name_filter=["question_answering"]
+        )
+        assert [listed_task.id for listed_task in tasks] == [task.id]
+
+        tasks = await get_all_tasks(dummy_project.id, get_events=False)
+        assert all(listed_task.events == [] for listed_task in tasks)
+
+        sessions = await get_all_sessions(dummy_project.id)
+        assert [listed_session.id for listed_session in sessions] == [session.id]
+        assert [event.id for event in sessions[0].events] == [events[0].id]
+        assert sessions[0].event_names == ["question_answering"]
+
+        await mongo_db["tasks"].delete_many(
+            {"id": {"$in": [task.id, task_without_events.id]}}
+        )
+        await mongo_db["sessions"].delete_many({"id": session.id})
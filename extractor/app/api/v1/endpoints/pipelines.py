@@ -5,13 +5,16 @@ from loguru import logger
 from app.security.authentication import authenticate_key
 
 # Services
-from app.services.pipelines import main_pipeline
+from app.services.pipelines import scheduled_main_pipeline
 from app.services.log import process_log
 
 # Models
 from app.api.v1.models import MainPipelineRequest, LogProcessRequest
 
-router = APIRouter()
+from app.utils.compression import DecompressedRequestRoute
+
+# The backend sends compressed log batches
+router = APIRouter(route_class=DecompressedRequestRoute)
 
 
 @router.post(
@@ -25,7 +28,7 @@ async def post_main_pipeline(
 ):
     logger.debug(f"task: {request_body.task}")
     if is_request_authenticated:
-        background_tasks.add_task(main_pipeline, request_body.task)
+        background_tasks.add_task(scheduled_main_pipeline, request_body.task)
     return {"status": "ok"}
 
 
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+
+from app.security.authentication import authenticate_key
+from app.services.job_queue import get_job_queue_metrics
+
+router = APIRouter()
+
+
+@router.get(
+    "/queue/metrics",
+    description="Depth, age and throughput of the job queue, to scale the extractor replicas",
+)
+async def get_queue_metrics(
+    is_request_authenticated: bool = Depends(authenticate_key),
+):
+    return await get_job_queue_metrics()
@@ -37,6 +37,9 @@ API_KEY_WAITING_TIME = 0.1  # in seconds
 ### OPENAI ###
 OPENAI_ORGANIZATION = "org-kH8tMbx6wJGWWUb3qQiLk73Z"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Connection pool of the LLM provider clients, shared by the pipelines
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
 
 ### WATCHERS ###
 OPENAI_MODEL_ID = "gpt-4"  # "gpt-4"
@@ -45,6 +48,16 @@ OPENAI_MODEL_ID_FOR_EVENTS = "gpt-3.5-turbo-16k"
 EVALUATION_SOURCE = "phospho-4"  # If phospho
 FEW_SHOT_MIN_NUMBER_OF_EXAMPLES = 10  # Make it even
 FEW_SHOT_MAX_NUMBER_OF_EXAMPLES = 50  # Imposed by Cohere API
+# The few shot examples of a project are cached. A user eval on the project invalidates them
+FEW_SHOT_EXAMPLES_CACHE_TTL = 10 * 60  # in seconds
+FEW_SHOT_EXAMPLES_VERSION_CHECK_INTERVAL = 10  # in seconds
+FEW_SHOT_EXAMPLES_CACHE_MAX_PROJECTS = 1000
+# Max number of event detection jobs running at once for a task, in total and per LLM provider
+EVENT_DETECTION_MAX_PARALLELISM = int(os.getenv("EVENT_DETECTION_MAX_PARALLELISM", 10))
+EVENT_DETECTION_MAX_PARALLELISM_PER_PROVIDER = {"openai": 10, "mistral": 5}
+# "per_event": one LLM call per event. "batched": one LLM call for all the events of a project,
+# with a fallback to per event calls for the events without a valid verdict
+EVENT_DETECTION_MODE = os.getenv("EVENT_DETECTION_MODE", "per_event")
 
 ### COHERE ###
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
@@ -59,3 +72,61 @@ if QDRANT_URL is None:
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 if QDRANT_API_KEY is None:
     raise Exception("QDRANT_API_KEY is missing from the environment variables")
+# Model used to embed the tasks: "openai" or "local" (requires the local-embeddings extra)
+# Must be the same in the backend
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_MODEL = "text-embedding-3-small"
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+LOCAL_EMBEDDING_DIMENSION = int(os.getenv("LOCAL_EMBEDDING_DIMENSION", 384))
+LOCAL_EMBEDDING_BATCH_SIZE = 64
+# The texts of the tasks are embedded in requests of at most EMBEDDING_MAX_TOKENS_PER_REQUEST
+# tokens (OpenAI limit: 300k tokens)
+EMBEDDING_MAX_TOKENS_PER_REQUEST = 100_000
+# Longer tasks are split in chunks, whose embeddings are averaged. The rest is truncated.
+EMBEDDING_MAX_CHUNKS_PER_TASK = 4
+# Max number of embedding requests running at once
+EMBEDDING_MAX_PARALLELISM = int(os.getenv("EMBEDDING_MAX_PARALLELISM", 4))
+# Rate limited or failed requests are retried with an exponential backoff (in seconds)
+EMBEDDING_MAX_RETRIES = 4
+EMBEDDING_RETRY_BASE_DELAY = 1.0
+# Number of tasks embedded at once when re-embedding a project
+REEMBED_TASKS_BATCH_SIZE = 1000
+
+### CONCURRENCY ###
+# Size of the thread pool running the blocking calls
+BLOCKING_IO_MAX_WORKERS = int(os.getenv("BLOCKING_IO_MAX_WORKERS", 32))
+# Debug: log the stack of the code blocking the event loop for more than this (in ms)
+LOOP_STALL_THRESHOLD_MS = (
+    float(os.environ["LOOP_STALL_THRESHOLD_MS"])
+    if os.getenv("LOOP_STALL_THRESHOLD_MS")
+    else None
+)
+# Max number of main pipelines running at once, in total and per organization
+PIPELINE_MAX_CONCURRENCY = int(os.getenv("PIPELINE_MAX_CONCURRENCY", 16))
+PIPELINE_MAX_CONCURRENCY_PER_ORG = int(os.getenv("PIPELINE_MAX_CONCURRENCY_PER_ORG", 4))
+# The writes of the pipelines are sent to mongo in bulk, when there are WRITE_BUFFER_MAX_SIZE
+# of them, WRITE_BUFFER_MAX_DELAY seconds after the first one, or at the end of the batch
+WRITE_BUFFER_MAX_SIZE = 500
+WRITE_BUFFER_MAX_DELAY = 2.0
+
+### JOB QUEUE ###
+# Claim the work sent by the backend from the job queue in mongo
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "true").lower() == "true"
+# Number of jobs processed concurrently by this replica
+JOB_QUEUE_WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", 4))
+# Number of times a job enqueued by the extractor is tried before being marked as failed
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv("JOB_QUEUE_MAX_ATTEMPTS", 5))
+# A claimed job is retried by another worker if its lease is not renewed for this long (in seconds)
+JOB_QUEUE_VISIBILITY_TIMEOUT = 5 * 60
+# How often idle workers look for new jobs (in seconds)
+JOB_QUEUE_POLL_INTERVAL = 1.0
+# Failed jobs are retried after RETRY_BACKOFF * 2**(attempts - 1) seconds
+JOB_QUEUE_RETRY_BACKOFF = 10
+# Completed jobs are deleted after this long (in seconds)
+JOB_QUEUE_RETENTION = 7 * 24 * 60 * 60
+
+### LLM CACHE ###
+# Cache of the deterministic LLM calls of the pipelines: "memory", "mongo" or "none"
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_MAX_SIZE = 10_000  # Only for the memory backend
+LLM_CACHE_TTL = 7 * 24 * 60 * 60  # in seconds
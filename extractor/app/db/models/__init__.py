@@ -58,6 +58,9 @@ class Task(BaseModel):
     last_eval: Optional[Eval] = None
     # Events are stored in a subcollection of the task document
     events: Optional[List[Event]] = Field(default_factory=list)
+    # Names of the events of the task. The extractor also stores in event_summary the
+    # first event of each name, which the listings return as events.
+    event_names: Optional[List[str]] = Field(default_factory=list)
     # The environment is a label
     environment: str = Field(default="default environment")
     # Notes are a free text field that can be edited
@@ -90,6 +93,9 @@ class Session(BaseModel):
     # The environment is a label
     environment: str = "default environment"
     events: Optional[List[Event]] = Field(default_factory=list)
+    # Names of the events of the session. The extractor also stores in event_summary the
+    # first event of each name, which the listings return as events.
+    event_names: Optional[List[str]] = Field(default_factory=list)
     tasks: Optional[List[Task]] = None
     # Session length is computed dynamically. It may be None if not computed
     session_length: Optional[int] = None
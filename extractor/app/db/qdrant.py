@@ -1,6 +1,7 @@
 from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models
 from app.core import config
+from app.services.embedding_providers import get_embedding_provider
 from loguru import logger
 
 
@@ -24,13 +25,17 @@ async def init_qdrant():
     # /!\ Once the collection is created, it cannot be updated
     # To change the underlying embedding model, we need to create a new collection
     # And re-embed all the tasks
-    if "tasks" in [collection.name for collection in existing_collections.collections]:
-        logger.info("Collection tasks already exists")
+    embedding_provider = get_embedding_provider()
+    collection_name = embedding_provider.collection_name
+    if collection_name in [
+        collection.name for collection in existing_collections.collections
+    ]:
+        logger.info(f"Collection {collection_name} already exists")
     else:
         await qdrant_db.create_collection(
-            collection_name="tasks",
+            collection_name=collection_name,
             vectors_config=models.VectorParams(
-                size=1536, distance=models.Distance.COSINE
+                size=embedding_provider.dimension, distance=models.Distance.COSINE
             ),
         )
     logger.info("Qdrant initialized")
@@ -0,0 +1,155 @@
+"""
+Buffer of the writes of the pipelines, to send them to mongo in bulk.
+
+Every pipeline of a batch writes events, evals, llm_calls and task updates. Instead of one
+round-trip per write, the writes are grouped into one bulk_write per collection, sent when
+the buffer is full, after a delay, or at the end of the batch.
+
+```python
+async with write_buffer_scope():
+    ...
+    await get_write_buffer().insert_one("events", event.model_dump())
+# Flushed here
+```
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+from loguru import logger
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+
+WriteOperation = Union[InsertOne, UpdateOne]
+
+
+class WriteBuffer:
+    def __init__(
+        self,
+        max_size: int = config.WRITE_BUFFER_MAX_SIZE,
+        max_delay: float = config.WRITE_BUFFER_MAX_DELAY,
+    ):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        # collection name -> operations
+        self._operations: Dict[str, List[WriteOperation]] = defaultdict(list)
+        self._nb_operations = 0
+        self._flush_lock = asyncio.Lock()
+        self._delayed_flush: Optional[asyncio.Task] = None
+        # Error of a delayed flush, raised by the next flush
+        self._delayed_flush_error: Optional[BaseException] = None
+
+    async def insert_one(self, collection: str, document: dict) -> None:
+        await self._add(collection, InsertOne(document))
+
+    async def update_one(
+        self, collection: str, filter: dict, update: Union[dict, List[dict]]
+    ) -> None:
+        await self._add(collection, UpdateOne(filter, update))
+
+    async def _add(self, collection: str, operation: WriteOperation) -> None:
+        self._operations[collection].append(operation)
+        self._nb_operations += 1
+        if self._nb_operations >= self.max_size:
+            await self.flush()
+        elif self._delayed_flush is None:
+            self._delayed_flush = asyncio.create_task(self._flush_after_delay())
+
+    async def _flush_after_delay(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        self._delayed_flush = None
+        try:
+            await self.flush()
+        except Exception as e:
+            # Nobody awaits this task: keep the error for the next flush, at the latest
+            # the one at the end of write_buffer_scope()
+            self._delayed_flush_error = e
+
+    async def flush(self) -> None:
+        """
+        Send the buffered writes, with one bulk_write per collection.
+        Raises an exception if some writes failed, after trying all the collections, or
+        if a delayed flush failed since the last flush.
+        """
+        if self._delayed_flush is not None:
+            # Called before the delay: the delayed flush is not needed anymore
+            self._delayed_flush.cancel()
+            self._delayed_flush = None
+        errors: List[BaseException] = []
+        async with self._flush_lock:
+            if self._delayed_flush_error is not None:
+                errors.append(self._delayed_flush_error)
+                self._delayed_flush_error = None
+            operations, self._operations = self._operations, defaultdict(list)
+            self._nb_operations = 0
+            if len(operations) == 0:
+                if len(errors) > 0:
+                    raise errors[0]
+                return
+            mongo_db = await get_mongo_db()
+            start_time = time.time()
+            results = await asyncio.gather(
+                *[
+                    mongo_db[collection].bulk_write(collection_operations, ordered=False)
+                    for collection, collection_operations in operations.items()
+                ],
+                return_exceptions=True,
+            )
+
+        for collection, result in zip(operations.keys(), results):
+            if isinstance(result, BulkWriteError):
+                write_errors = result.details.get("writeErrors", [])
+                logger.error(
+                    f"Write buffer: {len(write_errors)}/{len(operations[collection])} writes failed in {collection}: {write_errors[:3]}"
+                )
+                errors.append(result)
+            elif isinstance(result, BaseException):
+                logger.error(
+                    f"Write buffer: failed to write {len(operations[collection])} operations in {collection}: {result}"
+                )
+                errors.append(result)
+        logger.debug(
+            f"Write buffer: flushed {sum(len(ops) for ops in operations.values())} operations in {time.time() - start_time:.3f}s"
+        )
+        if len(errors) > 0:
+            raise errors[0]
+
+
+current_write_buffer: contextvars.ContextVar[Optional[WriteBuffer]] = (
+    contextvars.ContextVar("current_write_buffer", default=None)
+)
+
+
+def get_write_buffer() -> WriteBuffer:
+    """The write buffer of the current scope. Use it inside write_buffer_scope()."""
+    write_buffer = current_write_buffer.get()
+    if write_buffer is None:
+        raise RuntimeError("get_write_buffer() called outside of write_buffer_scope()")
+    return write_buffer
+
+
+@contextlib.asynccontextmanager
+async def write_buffer_scope() -> AsyncIterator[WriteBuffer]:
+    """
+    Buffer the writes made inside the scope and flush them at the end.
+    Nested scopes share the buffer of the outermost scope.
+    """
+    write_buffer = current_write_buffer.get()
+    if write_buffer is not None:
+        yield write_buffer
+        return
+
+    write_buffer = WriteBuffer()
+    token = current_write_buffer.set(write_buffer)
+    try:
+        yield write_buffer
+    finally:
+        current_write_buffer.reset(token)
+        await write_buffer.flush()
@@ -1,10 +1,14 @@
 import sentry_sdk
 from fastapi import FastAPI
 
-from app.api.v1.endpoints import health, pipelines
+from app.api.v1.endpoints import health, pipelines, queue
 from app.core import config
 from app.db.mongo import close_mongo_db, connect_and_init_db
 from app.db.qdrant import close_qdrant, init_qdrant
+from app.services.job_queue import start_job_queue_workers, stop_job_queue_workers
+from app.services.llm_cache import init_llm_cache, log_llm_cache_stats
+from app.services.llm_clients import close_llm_clients, init_llm_clients
+from app.utils.blocking import start_loop_stall_detector, stop_loop_stall_detector
 
 sentry_sdk.init(
     dsn=config.EXTRACTOR_SENTRY_DSN,
@@ -18,8 +22,18 @@ app = FastAPI()
 # Event handlers
 app.add_event_handler("startup", connect_and_init_db)
 app.add_event_handler("startup", init_qdrant)
+app.add_event_handler("startup", init_llm_clients)
+app.add_event_handler("startup", init_llm_cache)
+# Workers are stopped before the mongo connection is closed
+app.add_event_handler("startup", start_job_queue_workers)
+app.add_event_handler("shutdown", stop_job_queue_workers)
 app.add_event_handler("shutdown", close_mongo_db)
 app.add_event_handler("shutdown", close_qdrant)
+app.add_event_handler("shutdown", close_llm_clients)
+app.add_event_handler("shutdown", log_llm_cache_stats)
+# Debug
+app.add_event_handler("startup", start_loop_stall_detector)
+app.add_event_handler("shutdown", stop_loop_stall_detector)
 
 
 API_VERSION = "v1"
@@ -40,5 +54,6 @@ app_v1 = FastAPI(
 # Attach the endpoints
 app_v1.include_router(health.router, tags=["Health Check"])
 app_v1.include_router(pipelines.router, tags=["Pipelines"])
+app_v1.include_router(queue.router, tags=["Job Queue"])
 
 app.mount("/v1", app_v1)
@@ -0,0 +1,220 @@
+"""
+Embeddings of the tasks, for the vector search.
+
+The text of a task is split in chunks that fit in the embedding model (see
+embedding_providers.py). The tasks are packed into requests by token budget, which are sent
+concurrently. A failed request is retried alone, and the embeddings of a request are
+upserted to Qdrant as soon as they arrive.
+"""
+
+import asyncio
+import math
+from typing import List, Tuple
+
+import tiktoken
+from loguru import logger
+
+from app.core import config
+from app.db.models import Task
+from app.db.mongo import get_mongo_db
+from app.db.qdrant import get_qdrant, models
+from app.services.embedding_providers import EmbeddingProvider, get_embedding_provider
+from app.services.tasks import fix_task_schema
+from app.utils.blocking import run_blocking
+
+# (task, chunks of text, number of tokens of each chunk)
+TaskChunks = Tuple[Task, List[str], List[int]]
+
+
+def get_task_text(task: Task) -> str:
+    return f"{task.input} {task.output}"
+
+
+def split_in_chunks(tasks: List[Task], max_tokens: int) -> List[TaskChunks]:
+    """
+    Tokenize the text of the tasks and split it in chunks of at most max_tokens tokens.
+    """
+    encoding = tiktoken.get_encoding("cl100k_base")
+    tasks_chunks: List[TaskChunks] = []
+    for task in tasks:
+        tokens = encoding.encode(get_task_text(task), disallowed_special=())
+        chunks = [
+            tokens[i : i + max_tokens] for i in range(0, len(tokens), max_tokens)
+        ]
+        if len(chunks) > config.EMBEDDING_MAX_CHUNKS_PER_TASK:
+            logger.debug(
+                f"Task {task.id} has {len(tokens)} tokens: truncated to {config.EMBEDDING_MAX_CHUNKS_PER_TASK} chunks"
+            )
+            chunks = chunks[: config.EMBEDDING_MAX_CHUNKS_PER_TASK]
+        if len(chunks) == 1:
+            tasks_chunks.append((task, [get_task_text(task)], [len(tokens)]))
+        elif len(chunks) > 1:
+            tasks_chunks.append(
+                (
+                    task,
+                    [encoding.decode(chunk) for chunk in chunks],
+                    [len(chunk) for chunk in chunks],
+                )
+            )
+    return tasks_chunks
+
+
+def pack_requests(
+    tasks_chunks: List[TaskChunks], max_tokens: int, max_inputs: int
+) -> List[List[TaskChunks]]:
+    """
+    Group the tasks into requests of at most max_tokens tokens and max_inputs inputs.
+    The chunks of a task are in the same request.
+    """
+    requests: List[List[TaskChunks]] = []
+    current_request: List[TaskChunks] = []
+    nb_tokens = 0
+    nb_inputs = 0
+    for task, chunks, chunks_tokens in tasks_chunks:
+        task_tokens = sum(chunks_tokens)
+        if len(current_request) > 0 and (
+            nb_tokens + task_tokens > max_tokens
+            or nb_inputs + len(chunks) > max_inputs
+        ):
+            requests.append(current_request)
+            current_request, nb_tokens, nb_inputs = [], 0, 0
+        current_request.append((task, chunks, chunks_tokens))
+        nb_tokens += task_tokens
+        nb_inputs += len(chunks)
+    if len(current_request) > 0:
+        requests.append(current_request)
+    return requests
+
+
+def average_embeddings(
+    embeddings: List[List[float]], weights: List[int]
+) -> List[float]:
+    """
+    Average of the embeddings of the chunks, weighted by their number of tokens,
+    normalized to length 1.
+    """
+    if len(embeddings) == 1:
+        return embeddings[0]
+    total_weight = sum(weights)
+    average = [
+        sum(embedding[i] * weight for embedding, weight in zip(embeddings, weights))
+        / total_weight
+        for i in range(len(embeddings[0]))
+    ]
+    norm = math.sqrt(sum(value * value for value in average))
+    if norm == 0:
+        return average
+    return [value / norm for value in average]
+
+
+async def embed_and_upsert(
+    request: List[TaskChunks],
+    embedding_provider: EmbeddingProvider,
+    semaphore: asyncio.Semaphore,
+) -> int:
+    """
+    Embed the tasks of a request and upsert them to Qdrant.
+    Returns the number of tasks upserted.
+    """
+    async with semaphore:
+        embeddings = await embedding_provider.embed(
+            [chunk for _, chunks, _ in request for chunk in chunks]
+        )
+
+    points = []
+    offset = 0
+    for task, chunks, chunks_tokens in request:
+        task_embeddings = embeddings[offset : offset + len(chunks)]
+        offset += len(chunks)
+        points.append(
+            models.PointStruct(
+                id=task.id,
+                vector=average_embeddings(task_embeddings, chunks_tokens),
+                payload={
+                    "task_id": task.id,
+                    "project_id": task.project_id,
+                    "session_id": task.session_id,
+                },
+            )
+        )
+    qdrant_db = await get_qdrant()
+    await qdrant_db.upsert(
+        collection_name=embedding_provider.collection_name, points=points
+    )
+    return len(points)
+
+
+async def add_vectorized_tasks(tasks: List[Task]) -> int:
+    """
+    Embed the tasks and add them to the vector search.
+    Returns the number of tasks added.
+    """
+    if len(tasks) == 0:
+        return 0
+    embedding_provider = get_embedding_provider()
+    tasks_chunks = await run_blocking(
+        split_in_chunks, tasks, embedding_provider.max_tokens_per_input
+    )
+    requests = pack_requests(
+        tasks_chunks,
+        max_tokens=embedding_provider.max_tokens_per_request,
+        max_inputs=embedding_provider.max_inputs_per_request,
+    )
+    semaphore = asyncio.Semaphore(embedding_provider.max_parallelism)
+    results = await asyncio.gather(
+        *[
+            embed_and_upsert(request, embedding_provider, semaphore)
+            for request in requests
+        ],
+        return_exceptions=True,
+    )
+
+    nb_vectorized = 0
+    for request, result in zip(requests, results):
+        if isinstance(result, BaseException):
+            logger.warning(
+                f"Error while vectorizing {len(request)} tasks: {type(result).__name__} {result}"
+            )
+        else:
+            nb_vectorized += result
+    logger.info(
+        f"Vectorized {nb_vectorized}/{len(tasks)} tasks in {len(requests)} requests"
+    )
+    return nb_vectorized
+
+
+async def reembed_project_tasks(project_id: str) -> None:
+    """
+    Embed all the tasks of the project with the current embedding provider.
+    Used to fill the collection of a new provider.
+    """
+    mongo_db = await get_mongo_db()
+    nb_tasks = 0
+    nb_vectorized = 0
+    last_id = None
+    while True:
+        query: dict = {"project_id": project_id}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        tasks = (
+            await mongo_db["tasks"]
+            .find(query)
+            .sort("_id", 1)
+            .limit(config.REEMBED_TASKS_BATCH_SIZE)
+            .to_list(length=None)
+        )
+        if len(tasks) == 0:
+            break
+        last_id = tasks[-1]["_id"]
+        nb_tasks += len(tasks)
+        valid_tasks = []
+        for task in tasks:
+            try:
+                task = fix_task_schema(task, task.get("id", str(task["_id"])))
+                valid_tasks.append(Task.model_validate(task))
+            except Exception as e:
+                logger.warning(f"Skipping invalid task {task['_id']}: {e}")
+        nb_vectorized += await add_vectorized_tasks(valid_tasks)
+    logger.info(
+        f"Re-embedded {nb_vectorized}/{nb_tasks} tasks of project {project_id}"
+    )
@@ -0,0 +1,130 @@
+"""
+Few shot examples of the task scoring pipeline.
+
+The examples of a project are its latest tasks evaluated by a user. They barely change
+between two scored tasks, so they are cached per project. A cached entry is refetched when:
+- the backend writes a user eval on the project, which increments the version of the project
+  in the `few_shot_examples_versions` collection (checked at most every
+  FEW_SHOT_EXAMPLES_VERSION_CHECK_INTERVAL seconds)
+- it is older than FEW_SHOT_EXAMPLES_CACHE_TTL seconds
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+
+PHOSPHO_EVAL_MODELS_NAMES = ["phospho", "phospho-4"]
+
+# project_id -> {"version", "fetched_at", "checked_at", "successful_examples", "unsuccessful_examples"}
+few_shot_examples_cache: "OrderedDict[str, dict]" = OrderedDict()
+# Only one fetch at a time per project: the concurrent pipelines of a batch share it
+few_shot_examples_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def fetch_examples(project_id: str, flag: str, limit: int) -> List[dict]:
+    """
+    Fetch the latest tasks of the project evaluated as `flag` by a user
+    """
+    mongo_db = await get_mongo_db()
+    return (
+        await mongo_db["evals"]
+        .aggregate(
+            [
+                {
+                    "$match": {
+                        "project_id": project_id,
+                        "source": {"$nin": PHOSPHO_EVAL_MODELS_NAMES},
+                        "value": flag,
+                    }
+                },
+                {"$sort": {"created_at": -1}},
+                {"$limit": limit},
+                {
+                    "$lookup": {
+                        "from": "tasks",
+                        "localField": "task_id",
+                        "foreignField": "id",
+                        "as": "task",
+                    }
+                },
+                {"$unwind": "$task"},
+                {
+                    "$addFields": {
+                        "flag": "$value",
+                        "output": "$task.output",
+                        "input": "$task.input",
+                    }
+                },
+                {"$project": {"input": 1, "output": 1, "flag": 1}},
+            ]
+        )
+        .to_list(length=None)
+    )
+
+
+async def get_few_shot_examples_version(project_id: str) -> int:
+    mongo_db = await get_mongo_db()
+    version = await mongo_db["few_shot_examples_versions"].find_one({"_id": project_id})
+    if version is None:
+        return 0
+    return version.get("version", 0)
+
+
+async def get_few_shot_examples(project_id: str) -> Tuple[List[dict], List[dict]]:
+    """
+    Returns the successful and unsuccessful examples of the project, from the cache if
+    they are up to date.
+    """
+    if project_id not in few_shot_examples_locks:
+        few_shot_examples_locks[project_id] = asyncio.Lock()
+    async with few_shot_examples_locks[project_id]:
+        now = time.time()
+        entry = few_shot_examples_cache.get(project_id)
+        is_expired = (
+            entry is None
+            or now - entry["fetched_at"] > config.FEW_SHOT_EXAMPLES_CACHE_TTL
+        )
+        if entry is not None and not is_expired:
+            if (
+                now - entry["checked_at"]
+                < config.FEW_SHOT_EXAMPLES_VERSION_CHECK_INTERVAL
+            ):
+                few_shot_examples_cache.move_to_end(project_id)
+                return entry["successful_examples"], entry["unsuccessful_examples"]
+            version = await get_few_shot_examples_version(project_id)
+            if version == entry["version"]:
+                entry["checked_at"] = now
+                few_shot_examples_cache.move_to_end(project_id)
+                return entry["successful_examples"], entry["unsuccessful_examples"]
+        else:
+            version = await get_few_shot_examples_version(project_id)
+
+        # We want 50/50 success and failure examples
+        nb_examples = int(config.FEW_SHOT_MAX_NUMBER_OF_EXAMPLES / 2)
+        successful_examples, unsuccessful_examples = await asyncio.gather(
+            fetch_examples(project_id, "success", nb_examples),
+            fetch_examples(project_id, "failure", nb_examples),
+        )
+        logger.debug(
+            f"Fetched {len(successful_examples)} successful and {len(unsuccessful_examples)} unsuccessful examples for project {project_id}"
+        )
+        few_shot_examples_cache[project_id] = {
+            "version": version,
+            "fetched_at": now,
+            "checked_at": now,
+            "successful_examples": successful_examples,
+            "unsuccessful_examples": unsuccessful_examples,
+        }
+        few_shot_examples_cache.move_to_end(project_id)
+        while (
+            len(few_shot_examples_cache) > config.FEW_SHOT_EXAMPLES_CACHE_MAX_PROJECTS
+        ):
+            evicted_project_id, _ = few_shot_examples_cache.popitem(last=False)
+            few_shot_examples_locks.pop(evicted_project_id, None)
+        return successful_examples, unsuccessful_examples
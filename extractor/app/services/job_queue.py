@@ -0,0 +1,357 @@
+"""
+Durable queue of the work sent by the backend.
+
+The backend inserts jobs in the `job_queue` collection (see backend/app/services/mongo/job_queue.py).
+A pool of workers in every extractor replica claims them:
+- Claiming a job sets a lease on it. The worker renews the lease while the job runs.
+- If the worker dies, the lease expires and another worker claims the job again.
+- A failed job is retried with an exponential backoff, up to `max_attempts` times.
+Jobs are processed at least once: a retried log batch skips the tasks already created.
+A log batch whose main pipeline failed for some tasks completes, and enqueues a
+`main_pipeline` job for each of these tasks: the logs are not saved again and the
+pipelines that succeeded are not run again.
+
+`get_job_queue_metrics` returns the depth, age and throughput of the queue, to scale
+the number of extractor replicas from the backlog.
+"""
+
+import asyncio
+import datetime
+import os
+import socket
+import traceback
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import pymongo
+from loguru import logger
+
+from app.api.v1.models import LogProcessRequest
+from app.core import config
+from app.db.models import Task
+from app.db.mongo import get_mongo_db
+from app.services.embeddings import reembed_project_tasks
+from app.services.log import process_log
+from app.services.pipelines import scheduled_main_pipeline
+from app.utils import generate_timestamp, generate_uuid
+
+JOB_QUEUE_COLLECTION = "job_queue"
+
+
+async def enqueue_job(
+    job_type: str,
+    payload: dict,
+    max_attempts: Optional[int] = None,
+) -> str:
+    """
+    Add a job to the queue. Returns the job id.
+    Same as enqueue_job of the backend (backend/app/services/mongo/job_queue.py).
+    """
+    mongo_db = await get_mongo_db()
+    if max_attempts is None:
+        max_attempts = config.JOB_QUEUE_MAX_ATTEMPTS
+    now = generate_timestamp()
+    job_id = generate_uuid()
+    await mongo_db[JOB_QUEUE_COLLECTION].insert_one(
+        {
+            "_id": job_id,
+            "job_type": job_type,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "created_at": now,
+            "available_at": now,
+            "lease_expires_at": None,
+            "worker_id": None,
+        }
+    )
+    return job_id
+
+
+async def run_log_process_job(payload: dict) -> None:
+    request = LogProcessRequest.model_validate(payload)
+    failed_tasks = await process_log(
+        project_id=request.project_id,
+        org_id=request.org_id,
+        logs_to_process=request.logs_to_process,
+        extra_logs_to_save=request.extra_logs_to_save,
+    )
+    # Only retry the pipelines that failed, not the whole batch
+    for task in failed_tasks:
+        job_id = await enqueue_job(
+            job_type="main_pipeline", payload={"task": task.model_dump()}
+        )
+        logger.info(
+            f"Enqueued job {job_id} to retry the main pipeline of task {task.id}"
+        )
+
+
+async def run_main_pipeline_job(payload: dict) -> None:
+    await scheduled_main_pipeline(Task.model_validate(payload["task"]))
+
+
+async def run_reembed_tasks_job(payload: dict) -> None:
+    await reembed_project_tasks(payload["project_id"])
+
+
+JOB_HANDLERS: Dict[str, Callable[[dict], Awaitable[None]]] = {
+    "log_process": run_log_process_job,
+    "main_pipeline": run_main_pipeline_job,
+    "reembed_tasks": run_reembed_tasks_job,
+}
+
+# Workers of this replica
+job_queue_workers: List[asyncio.Task] = []
+
+
+async def ensure_job_queue_indexes() -> None:
+    mongo_db = await get_mongo_db()
+    collection = mongo_db[JOB_QUEUE_COLLECTION]
+    await collection.create_index(
+        [("status", pymongo.ASCENDING), ("available_at", pymongo.ASCENDING)]
+    )
+    await collection.create_index(
+        [("status", pymongo.ASCENDING), ("lease_expires_at", pymongo.ASCENDING)]
+    )
+    await collection.create_index(
+        [("status", pymongo.ASCENDING), ("completed_at", pymongo.ASCENDING)]
+    )
+    # Finished jobs are deleted by mongo once expired
+    await collection.create_index("expire_at", expireAfterSeconds=0)
+
+
+async def claim_job(worker_id: str) -> Optional[dict]:
+    """
+    Claim the oldest available job: a pending job, or a running job whose lease expired.
+    Returns None if there is no job to process.
+    """
+    mongo_db = await get_mongo_db()
+    now = generate_timestamp()
+    return await mongo_db[JOB_QUEUE_COLLECTION].find_one_and_update(
+        {
+            "$or": [
+                {"status": "pending", "available_at": {"$lte": now}},
+                {"status": "running", "lease_expires_at": {"$lte": now}},
+            ]
+        },
+        {
+            "$set": {
+                "status": "running",
+                "worker_id": worker_id,
+                "claimed_at": now,
+                "lease_expires_at": now + config.JOB_QUEUE_VISIBILITY_TIMEOUT,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("available_at", pymongo.ASCENDING)],
+        return_document=pymongo.ReturnDocument.AFTER,
+    )
+
+
+async def renew_lease(job_id: str, worker_id: str) -> bool:
+    """
+    Extend the lease of a running job. Returns False if the job was claimed by another worker.
+    """
+    mongo_db = await get_mongo_db()
+    result = await mongo_db[JOB_QUEUE_COLLECTION].update_one(
+        {"_id": job_id, "worker_id": worker_id, "status": "running"},
+        {
+            "$set": {
+                "lease_expires_at": generate_timestamp()
+                + config.JOB_QUEUE_VISIBILITY_TIMEOUT
+            }
+        },
+    )
+    return result.modified_count == 1
+
+
+async def complete_job(job_id: str, worker_id: str) -> None:
+    mongo_db = await get_mongo_db()
+    now = generate_timestamp()
+    await mongo_db[JOB_QUEUE_COLLECTION].update_one(
+        {"_id": job_id, "worker_id": worker_id},
+        {
+            "$set": {
+                "status": "done",
+                "completed_at": now,
+                "lease_expires_at": None,
+                "expire_at": datetime.datetime.fromtimestamp(
+                    now + config.JOB_QUEUE_RETENTION, tz=datetime.timezone.utc
+                ),
+            },
+            # The payload of large log batches is not kept
+            "$unset": {"payload": ""},
+        },
+    )
+
+
+async def fail_job(job: dict, worker_id: str, error: str) -> None:
+    """
+    Retry the job later with an exponential backoff, or mark it as failed
+    if it reached its max number of attempts.
+    """
+    mongo_db = await get_mongo_db()
+    now = generate_timestamp()
+    if job["attempts"] >= job["max_attempts"]:
+        logger.error(
+            f"Job {job['_id']} ({job['job_type']}) failed after {job['attempts']} attempts: {error}"
+        )
+        update = {
+            "status": "failed",
+            "completed_at": now,
+            "lease_expires_at": None,
+            "expire_at": datetime.datetime.fromtimestamp(
+                now + config.JOB_QUEUE_RETENTION, tz=datetime.timezone.utc
+            ),
+            "last_error": error,
+        }
+    else:
+        backoff = config.JOB_QUEUE_RETRY_BACKOFF * 2 ** (job["attempts"] - 1)
+        logger.warning(
+            f"Job {job['_id']} ({job['job_type']}) failed (attempt {job['attempts']}), retrying in {backoff}s: {error}"
+        )
+        update = {
+            "status": "pending",
+            "available_at": now + backoff,
+            "lease_expires_at": None,
+            "last_error": error,
+        }
+    await mongo_db[JOB_QUEUE_COLLECTION].update_one(
+        {"_id": job["_id"], "worker_id": worker_id}, {"$set": update}
+    )
+
+
+async def release_job(job_id: str, worker_id: str) -> None:
+    """
+    Put back a job interrupted by a shutdown, without counting the attempt.
+    """
+    mongo_db = await get_mongo_db()
+    await mongo_db[JOB_QUEUE_COLLECTION].update_one(
+        {"_id": job_id, "worker_id": worker_id, "status": "running"},
+        {
+            "$set": {
+                "status": "pending",
+                "available_at": generate_timestamp(),
+                "lease_expires_at": None,
+            },
+            "$inc": {"attempts": -1},
+        },
+    )
+
+
+async def keep_lease(job_id: str, worker_id: str) -> None:
+    """Renew the lease of a job until cancelled"""
+    while True:
+        await asyncio.sleep(config.JOB_QUEUE_VISIBILITY_TIMEOUT / 3)
+        try:
+            if not await renew_lease(job_id, worker_id):
+                logger.warning(f"Lost the lease of job {job_id}")
+                return
+        except Exception as e:
+            logger.warning(f"Failed to renew the lease of job {job_id}: {e}")
+
+
+async def process_job(job: dict, worker_id: str) -> None:
+    if job["attempts"] > job["max_attempts"]:
+        # The worker processing the last attempt died
+        await fail_job(job, worker_id, error=job.get("last_error", "Lease expired"))
+        return
+    handler = JOB_HANDLERS.get(job["job_type"])
+    if handler is None:
+        await fail_job(job, worker_id, error=f"Unknown job type {job['job_type']}")
+        return
+
+    lease_task = asyncio.create_task(keep_lease(job["_id"], worker_id))
+    try:
+        await handler(job["payload"])
+    except asyncio.CancelledError:
+        await release_job(job["_id"], worker_id)
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        await fail_job(job, worker_id, error=str(e))
+    else:
+        await complete_job(job["_id"], worker_id)
+    finally:
+        lease_task.cancel()
+
+
+async def run_job_queue_worker(worker_id: str) -> None:
+    """Claim and process jobs until cancelled"""
+    logger.info(f"Job queue worker {worker_id} started")
+    while True:
+        try:
+            job = await claim_job(worker_id)
+        except Exception as e:
+            logger.error(f"Job queue worker {worker_id} failed to claim a job: {e}")
+            job = None
+        if job is None:
+            await asyncio.sleep(config.JOB_QUEUE_POLL_INTERVAL)
+            continue
+        logger.debug(f"Worker {worker_id} processing job {job['_id']} ({job['job_type']})")
+        try:
+            await process_job(job, worker_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Eg: mongo is unreachable. The lease expires and the job is retried.
+            logger.error(f"Job queue worker {worker_id} failed on job {job['_id']}: {e}")
+
+
+async def start_job_queue_workers() -> None:
+    if not config.JOB_QUEUE_ENABLED or config.MONGODB_URL is None:
+        return
+    await ensure_job_queue_indexes()
+    worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+    for i in range(config.JOB_QUEUE_WORKERS):
+        job_queue_workers.append(
+            asyncio.create_task(run_job_queue_worker(f"{worker_prefix}-{i}"))
+        )
+
+
+async def stop_job_queue_workers() -> None:
+    # The jobs in progress are released, to be claimed by another replica
+    for worker in job_queue_workers:
+        worker.cancel()
+    await asyncio.gather(*job_queue_workers, return_exceptions=True)
+    job_queue_workers.clear()
+
+
+async def get_job_queue_metrics() -> dict:
+    """
+    Depth, age and throughput of the job queue
+    """
+    mongo_db = await get_mongo_db()
+    collection = mongo_db[JOB_QUEUE_COLLECTION]
+    now = generate_timestamp()
+
+    count_by_status = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+    async for status_count in collection.aggregate(
+        [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+    ):
+        count_by_status[status_count["_id"]] = status_count["count"]
+
+    ready = await collection.count_documents(
+        {"status": "pending", "available_at": {"$lte": now}}
+    )
+    oldest_pending = await collection.find_one(
+        {"status": "pending"},
+        projection={"created_at": 1},
+        sort=[("created_at", pymongo.ASCENDING)],
+    )
+    completed_last_minute = await collection.count_documents(
+        {"status": "done", "completed_at": {"$gte": now - 60}}
+    )
+    failed_last_minute = await collection.count_documents(
+        {"status": "failed", "completed_at": {"$gte": now - 60}}
+    )
+    return {
+        **count_by_status,
+        "ready": ready,
+        "oldest_pending_age": now - oldest_pending["created_at"]
+        if oldest_pending
+        else 0,
+        "completed_last_minute": completed_last_minute,
+        "failed_last_minute": failed_last_minute,
+        "replica_workers": len(job_queue_workers),
+    }
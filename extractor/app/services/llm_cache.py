@@ -0,0 +1,36 @@
+"""
+Cache of the LLM responses of the pipelines, to make reprocessing tasks almost free.
+"""
+
+import pymongo
+from loguru import logger
+
+from app.core import config
+from phospho import lab
+
+
+def init_llm_cache() -> None:
+    if config.LLM_CACHE_BACKEND == "memory":
+        lab.set_llm_cache(
+            lab.InMemoryLLMCache(
+                max_size=config.LLM_CACHE_MAX_SIZE, ttl=config.LLM_CACHE_TTL
+            )
+        )
+    elif config.LLM_CACHE_BACKEND == "mongo":
+        if config.MONGODB_URL is None:
+            logger.warning("MONGODB_URL is None. Skipping the LLM cache.")
+            return
+        # The cache is shared by the extractor replicas. Calls are run in a thread.
+        collection = pymongo.MongoClient(config.MONGODB_URL)[config.MONGODB_NAME][
+            "llm_cache"
+        ]
+        lab.set_llm_cache(lab.MongoLLMCache(collection, ttl=config.LLM_CACHE_TTL))
+    elif config.LLM_CACHE_BACKEND != "none":
+        raise ValueError(f"Unknown LLM_CACHE_BACKEND {config.LLM_CACHE_BACKEND}")
+    logger.info(f"LLM cache: {config.LLM_CACHE_BACKEND}")
+
+
+def log_llm_cache_stats() -> None:
+    llm_cache = lab.get_llm_cache()
+    if llm_cache is not None:
+        logger.info(f"LLM cache stats: {llm_cache.stats()}")
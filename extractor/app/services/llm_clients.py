@@ -0,0 +1,17 @@
+"""
+The LLM provider clients are shared by all the pipelines of the extractor.
+"""
+
+from app.core import config
+from phospho import lab
+
+
+def init_llm_clients() -> None:
+    lab.set_client_limits(
+        max_connections=config.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+    )
+
+
+async def close_llm_clients() -> None:
+    await lab.aclose_clients()
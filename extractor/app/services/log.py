@@ -1,6 +1,5 @@
 from typing import Any, Dict, List, Optional, Union
 
-import openai
 import tiktoken
 from loguru import logger
 
@@ -8,11 +7,11 @@ from loguru import logger
 from app.api.v1.models import LogEvent, LogReply
 from app.db.models import Session, Task
 from app.db.mongo import get_mongo_db
-from app.db.qdrant import get_qdrant, models
-from app.services.pipelines import main_pipeline
+from app.services.embeddings import add_vectorized_tasks
+from app.services.pipelines import run_main_pipelines
 
 # Service
-from app.services.tasks import get_task_by_id
+from app.services.tasks import get_tasks_by_ids
 from app.utils import generate_timestamp
 from phospho.utils import filter_nonjsonable_keys, is_jsonable
 
@@ -245,49 +244,6 @@ def collect_metadata(log_event: LogEvent) -> Optional[dict]:
     return metadata
 
 
-async def add_vectorized_tasks(
-    tasks_id: List[str],
-):
-    mongo_db = await get_mongo_db()
-    qdrant_db = await get_qdrant()
-    # Get tasks
-    tasks = await mongo_db["tasks"].find({"id": {"$in": tasks_id}}).to_list(length=None)
-    tasks = [Task.model_validate(task) for task in tasks]
-
-    openai_client = openai.AsyncClient()
-
-    # Create tasks_text representations
-    tasks_text = [f"{task.input} {task.output}" for task in tasks]
-    try:
-        # TODO : count the number of token for each task_text and if it's too big, do something smart
-        embedding = await openai_client.embeddings.create(
-            input=tasks_text, model="text-embedding-3-small"
-        )
-    except openai.APIError as e:
-        logger.warning(f"Error while embedding the tasks: {e}")
-        return
-
-    try:
-        await qdrant_db.upsert(
-            collection_name="tasks",
-            points=[
-                models.PointStruct(
-                    id=task.id,
-                    vector=embedding.embedding,
-                    payload={
-                        "task_id": task.id,
-                        "project_id": task.project_id,
-                        "session_id": task.session_id,
-                    },
-                )
-                for task, embedding in zip(tasks, embedding.data)
-            ],
-        )
-    except Exception as e:
-        logger.warning(f"Error while adding the tasks to Qdrant: {e}")
-        return
-
-
 def create_task_from_logevent(
     org_id: str,
     project_id: str,
@@ -343,18 +299,33 @@ async def ignore_existing_tasks(
     return new_tasks_to_create
 
 
+async def increment_org_usage(org_id: str, nb_tasks: int) -> None:
+    """
+    Add nb_tasks to the usage counter of the organization, read by the backend to check
+    the usage quota.
+    """
+    if nb_tasks == 0:
+        return
+    mongo_db = await get_mongo_db()
+    # The document _id is the org_id, so that concurrent upserts can't create duplicates
+    await mongo_db["org_usage"].update_one(
+        {"_id": org_id}, {"$inc": {"nb_tasks": nb_tasks}}, upsert=True
+    )
+
+
 async def process_log_without_session_id(
     project_id: str,
     org_id: str,
     list_of_log_event: List[LogEvent],
     trigger_pipeline: bool = True,
-) -> None:
+) -> List[Task]:
     """
-    Process a list of log events without session_id
+    Process a list of log events without session_id.
+    Returns the tasks whose main pipeline failed.
     """
     if len(list_of_log_event) == 0:
         logger.debug("No log event without session_id to process")
-        return None
+        return []
 
     mongo_db = await get_mongo_db()
 
@@ -373,26 +344,26 @@ async def process_log_without_session_id(
     # Skip task creation if there is no task to create
     if len(tasks_to_create) == 0:
         logger.debug("No task to create")
-        return None
+        return []
 
     # Create the tasks
     tasks_to_create = await ignore_existing_tasks(tasks_to_create)
     if len(tasks_to_create) > 0:
         await mongo_db["tasks"].insert_many(tasks_to_create)
+        await increment_org_usage(org_id, len(tasks_to_create))
 
     if trigger_pipeline:
+        # Fetch the tasks data from the database, in one query
+        tasks_to_process = await get_tasks_by_ids(tasks_id_to_process)
+
         # Vectorize them
-        await add_vectorized_tasks(tasks_id_to_process)
+        await add_vectorized_tasks(tasks_to_process)
 
         # Trigger the pipeline
-        for task_id in tasks_id_to_process:
-            # Fetch the task data from the database
-            # For now it's a double call to the database, but it's not a big deal
-            task_data = await get_task_by_id(task_id)
-            logger.info(f"Logevent: pipeline triggered for task {task_id}")
-            await main_pipeline(task_data)
+        logger.info(f"Logevent: pipeline triggered for {len(tasks_to_process)} tasks")
+        return await run_main_pipelines(tasks_to_process)
 
-    return None
+    return []
 
 
 async def process_log_with_session_id(
@@ -400,13 +371,14 @@ async def process_log_with_session_id(
     org_id: str,
     list_of_log_event: List[LogEvent],
     trigger_pipeline: bool = True,
-) -> None:
+) -> List[Task]:
     """
-    Process a list of log events with session_id
+    Process a list of log events with session_id.
+    Returns the tasks whose main pipeline failed.
     """
     if len(list_of_log_event) == 0:
         logger.debug("No log event with session_id to process")
-        return None
+        return []
 
     tasks_id_to_process: List[str] = []
     tasks_to_create: List[Dict[str, object]] = []
@@ -487,6 +459,7 @@ async def process_log_with_session_id(
     tasks_to_create = await ignore_existing_tasks(tasks_to_create)
     if len(tasks_to_create) > 0:
         await mongo_db["tasks"].insert_many(tasks_to_create)
+        await increment_org_usage(org_id, len(tasks_to_create))
 
     # Add sessions to database
     if len(sessions_to_create) > 0:
@@ -526,15 +499,17 @@ async def process_log_with_session_id(
         logger.info("Logevent: no session to create")
 
     if trigger_pipeline:
+        # Fetch the tasks data from the database, in one query
+        tasks_to_process = await get_tasks_by_ids(tasks_id_to_process)
+
         # Vectorize them
-        await add_vectorized_tasks(tasks_id_to_process)
+        await add_vectorized_tasks(tasks_to_process)
 
         # Trigger the pipeline
-        for task_id in tasks_id_to_process:
-            # Fetch the task data from the database
-            # For now it's a double call to the database, but it's not a big deal
-            task_data = await get_task_by_id(task_id)
-            await main_pipeline(task_data)
+        logger.info(f"Logevent: pipeline triggered for {len(tasks_to_process)} tasks")
+        return await run_main_pipelines(tasks_to_process)
+
+    return []
 
 
 async def process_log(
@@ -542,11 +517,13 @@ async def process_log(
     org_id: str,
     logs_to_process: List[LogEvent],
     extra_logs_to_save: List[LogEvent],
-) -> None:
+) -> List[Task]:
     """From logs
     - Create Tasks
     - Create a Session
     - Trigger the Tasks processing pipeline
+
+    Returns the tasks whose main pipeline failed (eg so that the job queue retries them).
     """
     mongo_db = await get_mongo_db()
     logger.info(f"Logevent: processing {len(logs_to_process)} log events")
@@ -565,12 +542,12 @@ async def process_log(
 
     # Save the non-error log events
     if len(nonerror_log_events) > 0:
-        mongo_db["logs"].insert_many(
+        await mongo_db["logs"].insert_many(
             [log_event.model_dump() for log_event in nonerror_log_events]
         )
 
     # Process logs without session_id
-    await process_log_without_session_id(
+    failed_tasks = await process_log_without_session_id(
         project_id=project_id,
         org_id=org_id,
         list_of_log_event=[
@@ -579,7 +556,7 @@ async def process_log(
     )
 
     # Process logs with session_id
-    await process_log_with_session_id(
+    failed_tasks += await process_log_with_session_id(
         project_id=project_id,
         org_id=org_id,
         list_of_log_event=[
@@ -615,4 +592,4 @@ async def process_log(
             trigger_pipeline=False,
         )
 
-    return None
+    return failed_tasks
@@ -1,12 +1,15 @@
+import asyncio
 import time
-from typing import Dict
+from typing import Dict, List
 
 from loguru import logger
 
 from app.core import config
 from app.db.models import Eval, Event, EventDefinition, LlmCall, Task
 from app.db.mongo import get_mongo_db
+from app.db.write_buffer import get_write_buffer, write_buffer_scope
 from app.services.data import fetch_previous_tasks
+from app.services.examples import get_few_shot_examples
 from app.services.projects import get_project_by_id
 
 # from app.services.topics import extract_topics  # TODO
@@ -19,12 +22,47 @@ class EventConfig(lab.JobConfig):
     event_description: str
 
 
+class MultiEventConfig(lab.JobConfig):
+    # event_name -> event_description
+    events: Dict[str, str]
+
+
+def add_to_event_summary(new_events: List[dict]) -> List[Dict[str, object]]:
+    """
+    Stages of an update pipeline adding the new events to the event_summary of a document,
+    unless it already has an event with the same name. The event_names are the names of
+    the events of the summary.
+    """
+    summary_names = {"$ifNull": ["$event_summary.event_name", []]}
+    return [
+        {
+            "$set": {
+                "event_summary": {
+                    "$concatArrays": [
+                        {"$ifNull": ["$event_summary", []]},
+                        {
+                            "$filter": {
+                                "input": {"$literal": new_events},
+                                "cond": {
+                                    "$not": [
+                                        {"$in": ["$$this.event_name", summary_names]}
+                                    ]
+                                },
+                            }
+                        },
+                    ]
+                }
+            }
+        },
+        {"$set": {"event_names": "$event_summary.event_name"}},
+    ]
+
+
 async def event_detection_pipeline(task: Task) -> None:
     """
     Run the event detection pipeline for a given task
     """
     logger.info(f"Run the event detection pipeline for task {task.id}")
-    mongo_db = await get_mongo_db()
 
     # Get the data of all the task before the task[task_id]
     previous_tasks = await fetch_previous_tasks(task.id)
@@ -61,18 +99,37 @@ async def event_detection_pipeline(task: Task) -> None:
     # Create the phospho workload
     workload = lab.Workload()
     # Add the event detection jobs to the workload
-    for event_name, event in valid_project_events.items():
-        logger.debug(f"Add event detection job for event {event_name}")
+    batched_event_detection = (
+        config.EVENT_DETECTION_MODE == "batched" and len(valid_project_events) > 1
+    )
+    if batched_event_detection:
+        # A single job detects all the events in one LLM call
+        logger.debug(f"Add multi event detection job for {len(valid_project_events)} events")
         workload.add_job(
             lab.Job(
-                id=event_name,
-                job_function=lab.job_library.event_detection,
-                config=EventConfig(
-                    event_name=event_name,
-                    event_description=event.description,
+                id="multi_event_detection",
+                job_function=lab.job_library.multi_event_detection,
+                config=MultiEventConfig(
+                    events={
+                        event_name: event.description
+                        for event_name, event in valid_project_events.items()
+                    }
                 ),
             )
         )
+    else:
+        for event_name, event in valid_project_events.items():
+            logger.debug(f"Add event detection job for event {event_name}")
+            workload.add_job(
+                lab.Job(
+                    id=event_name,
+                    job_function=lab.job_library.event_detection,
+                    config=EventConfig(
+                        event_name=event_name,
+                        event_description=event.description,
+                    ),
+                )
+            )
     # Convert the tasks into a list of messages
     previous_messages = []
     for i, previous_task in enumerate(task_context):
@@ -108,7 +165,9 @@ async def event_detection_pipeline(task: Task) -> None:
                     previous_messages=previous_messages,
                 )
             ],
-            executor_type="sequential",
+            executor_type="parallel",
+            max_parallelism=config.EVENT_DETECTION_MAX_PARALLELISM,
+            max_parallelism_per_provider=config.EVENT_DETECTION_MAX_PARALLELISM_PER_PROVIDER,
         )
     else:
         latest_message_id = "input_" + task_data.id
@@ -121,19 +180,32 @@ async def event_detection_pipeline(task: Task) -> None:
                     previous_messages=previous_messages,
                 )
             ],
-            executor_type="sequential",
+            executor_type="parallel",
+            max_parallelism=config.EVENT_DETECTION_MAX_PARALLELISM,
+            max_parallelism_per_provider=config.EVENT_DETECTION_MAX_PARALLELISM_PER_PROVIDER,
         )
 
     # Check the results of the workload
     message_results = workload.results[latest_message_id]
     logger.debug(f"Results of the event detection pipeline: {message_results}")
+    write_buffer = get_write_buffer()
+    if batched_event_detection:
+        multi_event_result = message_results["multi_event_detection"]
+        # Store the batched LLM call in the database
+        llm_call = multi_event_result.metadata.get("llm_call", None)
+        if llm_call is not None:
+            llm_call_obj = LlmCall(**llm_call, org_id=task_data.org_id)
+            await write_buffer.insert_one("llm_calls", llm_call_obj.model_dump())
+        # The results of the single events
+        message_results = multi_event_result.metadata["event_results"]
+    detected_events: List[Event] = []
     for event_name, result in message_results.items():
         # Store the LLM call in the database
         metadata = result.metadata
         llm_call = metadata.get("llm_call", None)
         if llm_call is not None:
             llm_call_obj = LlmCall(**llm_call, org_id=task_data.org_id)
-            mongo_db["llm_calls"].insert_one(llm_call_obj.model_dump())
+            await write_buffer.insert_one("llm_calls", llm_call_obj.model_dump())
 
         # When the event is detected, result is True
         if result.value:
@@ -150,107 +222,55 @@ async def event_detection_pipeline(task: Task) -> None:
                 webhook=event.webhook,
                 org_id=task_data.org_id,
             )
-            mongo_db["events"].insert_one(detected_event_data.model_dump())
-            # Update the task object with the event
-            mongo_db["tasks"].update_one(
-                {"id": task.id},
-                # Add the event to the list of events
-                {"$push": {"events": detected_event_data.model_dump()}},
-            )
+            detected_events.append(detected_event_data)
+            await write_buffer.insert_one("events", detected_event_data.model_dump())
             # Trigger the webhook if it exists
             if event.webhook is not None:
-                trigger_webhook(
+                await trigger_webhook(
                     url=event.webhook,
                     json=detected_event_data.model_dump(),
                     headers=event.webhook_headers,
                 )
 
+    if len(detected_events) > 0:
+        new_events = [event.model_dump() for event in detected_events]
+        # Add all the detected events to the task. The event_summary keeps one event per
+        # event name, so that the listings read it without deduplicating the events.
+        await write_buffer.update_one(
+            "tasks",
+            {"id": task.id},
+            [
+                {
+                    "$set": {
+                        "events": {
+                            "$concatArrays": [
+                                {"$ifNull": ["$events", []]},
+                                {"$literal": new_events},
+                            ]
+                        }
+                    }
+                },
+                *add_to_event_summary(new_events),
+            ],
+        )
+        if task.session_id is not None:
+            await write_buffer.update_one(
+                "sessions", {"id": task.session_id}, add_to_event_summary(new_events)
+            )
+
 
 async def task_scoring_pipeline(task: Task) -> None:
     """
     Run the task scoring pipeline for a given task
     """
     logger.debug(f"Run the task scoring pipeline for task {task.id}")
-    mongo_db = await get_mongo_db()
-
-    # We want 50/50 success and failure examples
-    nb_success = int(config.FEW_SHOT_MAX_NUMBER_OF_EXAMPLES / 2)
-    nb_failure = int(config.FEW_SHOT_MAX_NUMBER_OF_EXAMPLES / 2)
-
-    PHOSPHO_EVAL_MODELS_NAMES = ["phospho", "phospho-4"]
 
-    # Get the user evals from the db
-    successful_examples_tasks = (
-        await mongo_db["evals"]
-        .aggregate(
-            [
-                {
-                    "$match": {
-                        "project_id": task.project_id,
-                        "source": {"$nin": PHOSPHO_EVAL_MODELS_NAMES},
-                        "value": "success",
-                    }
-                },
-                {"$sort": {"created_at": -1}},
-                {"$limit": nb_success},
-                {
-                    "$lookup": {
-                        "from": "tasks",
-                        "localField": "task_id",
-                        "foreignField": "id",
-                        "as": "task",
-                    }
-                },
-                {"$unwind": "$task"},
-                {
-                    "$addFields": {
-                        "flag": "$value",
-                        "output": "$task.output",
-                        "input": "$task.input",
-                    }
-                },
-                {"$project": {"input": 1, "output": 1, "flag": 1}},
-            ]
-        )
-        .to_list(length=None)
-    )
+    # Get the latest user evals of the project, usually from the cache
+    (
+        successful_examples_tasks,
+        unsuccessful_examples_tasks,
+    ) = await get_few_shot_examples(task.project_id)
     logger.debug(f"Nb of successful examples: {len(successful_examples_tasks)}")
-
-    # Get the failure examples
-    unsuccessful_examples_tasks = (
-        await mongo_db["evals"]
-        .aggregate(
-            [
-                {
-                    "$match": {
-                        "project_id": task.project_id,
-                        "source": {"$nin": PHOSPHO_EVAL_MODELS_NAMES},
-                        "value": "failure",
-                    }
-                },
-                {"$sort": {"created_at": -1}},
-                {"$limit": nb_failure},
-                {
-                    "$lookup": {
-                        "from": "tasks",
-                        "localField": "task_id",
-                        "foreignField": "id",
-                        "as": "task",
-                    }
-                },
-                {"$unwind": "$task"},
-                {
-                    "$addFields": {
-                        "flag": "$value",
-                        "output": "$task.output",
-                        "input": "$task.input",
-                    }
-                },
-                {"$project": {"input": 1, "output": 1, "flag": 1}},
-            ]
-        )
-        .to_list(length=None)
-    )
     logger.debug(f"Nb of failure examples: {len(unsuccessful_examples_tasks)}")
 
     # Call the eval function
@@ -299,9 +319,10 @@ async def task_scoring_pipeline(task: Task) -> None:
     flag = workload.results["output_" + task.id]["evaluate_task"].value
     metadata = workload.results["output_" + task.id]["evaluate_task"].metadata
     llm_call = metadata.get("llm_call", None)
+    write_buffer = get_write_buffer()
     if llm_call is not None:
         llm_call_obj = LlmCall(**llm_call, org_id=task.org_id)
-        mongo_db["llm_calls"].insert_one(llm_call_obj.model_dump())
+        await write_buffer.insert_one("llm_calls", llm_call_obj.model_dump())
 
     logger.debug(f"Flag for task {task.id} : {flag}")
     # Create the Evaluation object and store it in the db
@@ -314,12 +335,20 @@ async def task_scoring_pipeline(task: Task) -> None:
         test_id=task.test_id,
         org_id=task.org_id,
     )
-    mongo_db["evals"].insert_one(evaluation_data.model_dump())
+    await write_buffer.insert_one("evals", evaluation_data.model_dump())
 
     # Update the task object
-    mongo_db["tasks"].update_one(
+    await write_buffer.update_one(
+        "tasks",
         {"id": task.id},
-        {"$set": {"flag": flag, "last_eval": evaluation_data.model_dump()}},
+        {
+            "$set": {
+                "flag": flag,
+                "last_eval": evaluation_data.model_dump(),
+                # The prediction source that was used
+                "evaluation_source": config.EVALUATION_SOURCE,
+            }
+        },
     )
 
 
@@ -373,22 +402,16 @@ async def main_pipeline(task: Task) -> None:
     logger.info(f"Starting main pipeline for task {task.id}")
 
     # For now, do things sequentially
+    # The results are written in bulk at the end of the pipeline (or of the batch)
+    async with write_buffer_scope():
+        # Do the event detection
+        if task.test_id is None:
+            await event_detection_pipeline(task)
 
-    # Do the event detection
-    if task.test_id is None:
-        await event_detection_pipeline(task)
-
-    # Do the session scoring -> success, failure
-    if task.flag is None:
-        mongo_db = await get_mongo_db()
-
-        await task_scoring_pipeline(task)
-        # Optional: later add the moderation pipeline on input and outputs
-
-        # Update the task with the prediction source that was used
-        await mongo_db["tasks"].update_one(
-            {"id": task.id}, {"$set": {"evaluation_source": config.EVALUATION_SOURCE}}
-        )
+        # Do the session scoring -> success, failure
+        if task.flag is None:
+            await task_scoring_pipeline(task)
+            # Optional: later add the moderation pipeline on input and outputs
 
     # Do the topic extraction
     # await topic_extraction_pipeline(task_id)
@@ -397,3 +420,55 @@ async def main_pipeline(task: Task) -> None:
     logger.info(
         f"Main pipeline completed in {time.time() - start_time:.2f} seconds for task {task.id}"
     )
+
+
+# Limit the number of main pipelines running at once, in total and per organization.
+# An org waits on its own semaphore before the global one, so that a large batch of one
+# org can't take all the slots: the global semaphore serves the orgs in turn.
+pipeline_semaphore = asyncio.Semaphore(config.PIPELINE_MAX_CONCURRENCY)
+org_pipeline_semaphores: Dict[str, asyncio.Semaphore] = {}
+# Number of pipelines running or waiting, per org
+org_pipeline_counts: Dict[str, int] = {}
+
+
+async def scheduled_main_pipeline(task: Task) -> None:
+    """
+    Run the main pipeline of a task, within the concurrency limits
+    """
+    org_id = task.org_id or task.project_id
+    if org_id not in org_pipeline_semaphores:
+        org_pipeline_semaphores[org_id] = asyncio.Semaphore(
+            config.PIPELINE_MAX_CONCURRENCY_PER_ORG
+        )
+        org_pipeline_counts[org_id] = 0
+    org_pipeline_counts[org_id] += 1
+    try:
+        async with org_pipeline_semaphores[org_id]:
+            async with pipeline_semaphore:
+                await main_pipeline(task)
+    finally:
+        org_pipeline_counts[org_id] -= 1
+        if org_pipeline_counts[org_id] == 0:
+            del org_pipeline_semaphores[org_id]
+            del org_pipeline_counts[org_id]
+
+
+async def run_main_pipelines(tasks: List[Task]) -> List[Task]:
+    """
+    Run the main pipeline of a batch of tasks concurrently.
+    A failed pipeline is logged and doesn't stop the others. Returns the tasks whose
+    pipeline failed, eg so that the job queue retries them.
+    """
+    # The pipelines of the batch share a write buffer
+    async with write_buffer_scope():
+        results = await asyncio.gather(
+            *[scheduled_main_pipeline(task) for task in tasks], return_exceptions=True
+        )
+    failed_tasks: List[Task] = []
+    for task, result in zip(tasks, results):
+        if isinstance(result, BaseException):
+            logger.opt(exception=result).error(
+                f"Main pipeline failed for task {task.id}: {result}"
+            )
+            failed_tasks.append(task)
+    return failed_tasks
@@ -1,7 +1,20 @@
+from typing import List
+
 from app.db.mongo import get_mongo_db
 from app.db.models import Task
 import pydantic
 from fastapi import HTTPException
+from loguru import logger
+
+
+def fix_task_schema(task: dict, task_id: str) -> dict:
+    """Account for schema discrepancies"""
+    if "id" not in task.keys():
+        task["id"] = task_id
+
+    if task["flag"] == "undefined":
+        task["flag"] = None
+    return task
 
 
 async def get_task_by_id(task_id: str) -> Task:
@@ -10,12 +23,7 @@ async def get_task_by_id(task_id: str) -> Task:
     if task is None:
         raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
 
-    # Account for schema discrepancies
-    if "id" not in task.keys():
-        task["id"] = task_id
-
-    if task["flag"] == "undefined":
-        task["flag"] = None
+    task = fix_task_schema(task, task_id)
 
     try:
         task = Task.model_validate(task, strict=True)
@@ -25,3 +33,28 @@ async def get_task_by_id(task_id: str) -> Task:
         )
 
     return task
+
+
+async def get_tasks_by_ids(task_ids: List[str]) -> List[Task]:
+    """
+    Fetch a batch of tasks in one query, in the order of task_ids.
+    Tasks that are not found or not valid are skipped.
+    """
+    mongo_db = await get_mongo_db()
+    tasks_by_id = {
+        task["id"]: task
+        async for task in mongo_db["tasks"].find({"id": {"$in": task_ids}})
+    }
+    tasks: List[Task] = []
+    for task_id in task_ids:
+        task = tasks_by_id.get(task_id)
+        if task is None:
+            logger.warning(f"Task {task_id} not found")
+            continue
+        try:
+            tasks.append(
+                Task.model_validate(fix_task_schema(task, task_id), strict=True)
+            )
+        except pydantic.ValidationError as e:
+            logger.error(f"Failed to validate task {task_id}: {e}")
+    return tasks
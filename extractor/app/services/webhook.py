@@ -1,10 +1,10 @@
 from typing import Optional
 
-import requests
+import httpx
 from loguru import logger
 
 
-def trigger_webhook(
+async def trigger_webhook(
     url: str, json: dict, timeout: int = 1, headers: Optional[dict] = None
 ):
     """
@@ -20,13 +20,16 @@ def trigger_webhook(
         logger.warning("No webhook URL set, skipping webhook trigger")
         return
     try:
-        response = requests.post(url, json=json, timeout=timeout, headers=headers)
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                url, json=json, timeout=timeout, headers=headers
+            )
         response.raise_for_status()
         logger.info(f"Webhook triggered successfully: {response.status_code}")
         return response.text
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.debug(f"Request timed out when sending webhook to {url}")
-    except requests.exceptions.HTTPError as err:
+    except httpx.HTTPStatusError as err:
         logger.debug(f"HTTP error occurred when webhook {url}: {err}")
-    except requests.exceptions.RequestException as err:
+    except httpx.HTTPError as err:
         logger.debug(f"A request exception occurred when webhook {url}: {err}")
@@ -0,0 +1,116 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import app.db.write_buffer as write_buffer_module
+from app.db.write_buffer import WriteBuffer, get_write_buffer, write_buffer_scope
+
+
+class FakeCollection:
+    def __init__(self, name: str, fail: bool = False):
+        self.name = name
+        self.fail = fail
+        self.bulk_writes: List[list] = []
+
+    async def bulk_write(self, operations, ordered=True):
+        self.bulk_writes.append(operations)
+        if self.fail:
+            raise BulkWriteError({"writeErrors": [{"index": 0, "errmsg": "failed"}]})
+
+
+class FakeMongoDb:
+    def __init__(self, failing_collections: List[str] = []):
+        self.failing_collections = failing_collections
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(
+                name, fail=name in self.failing_collections
+            )
+        return self.collections[name]
+
+
+def use_fake_mongo_db(monkeypatch, fake_mongo_db: FakeMongoDb) -> None:
+    async def get_mongo_db():
+        return fake_mongo_db
+
+    monkeypatch.setattr(write_buffer_module, "get_mongo_db", get_mongo_db)
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_flush(monkeypatch):
+    fake_mongo_db = FakeMongoDb()
+    use_fake_mongo_db(monkeypatch, fake_mongo_db)
+
+    async with write_buffer_scope() as write_buffer:
+        await get_write_buffer().insert_one("events", {"id": "event_1"})
+        await get_write_buffer().insert_one("events", {"id": "event_2"})
+        # Nested scopes share the buffer
+        async with write_buffer_scope() as nested_write_buffer:
+            assert nested_write_buffer is write_buffer
+            await get_write_buffer().update_one(
+                "tasks", {"id": "task_1"}, {"$set": {"flag": "success"}}
+            )
+        # Not flushed yet
+        assert fake_mongo_db.collections == {}
+
+    # One bulk_write per collection
+    assert fake_mongo_db["events"].bulk_writes == [
+        [InsertOne({"id": "event_1"}), InsertOne({"id": "event_2"})]
+    ]
+    assert fake_mongo_db["tasks"].bulk_writes == [
+        [UpdateOne({"id": "task_1"}, {"$set": {"flag": "success"}})]
+    ]
+
+    with pytest.raises(RuntimeError):
+        get_write_buffer()
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_flush_when_full(monkeypatch):
+    fake_mongo_db = FakeMongoDb()
+    use_fake_mongo_db(monkeypatch, fake_mongo_db)
+
+    write_buffer = WriteBuffer(max_size=2, max_delay=60)
+    for i in range(3):
+        await write_buffer.insert_one("events", {"id": f"event_{i}"})
+    assert len(fake_mongo_db["events"].bulk_writes) == 1
+    await write_buffer.flush()
+    assert [len(ops) for ops in fake_mongo_db["events"].bulk_writes] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_flush_after_delay(monkeypatch):
+    fake_mongo_db = FakeMongoDb()
+    use_fake_mongo_db(monkeypatch, fake_mongo_db)
+
+    write_buffer = WriteBuffer(max_size=100, max_delay=0.01)
+    await write_buffer.insert_one("events", {"id": "event_1"})
+    await asyncio.sleep(0.05)
+    assert len(fake_mongo_db["events"].bulk_writes) == 1
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_errors(monkeypatch):
+    fake_mongo_db = FakeMongoDb(failing_collections=["events"])
+    use_fake_mongo_db(monkeypatch, fake_mongo_db)
+
+    # The other collections are written, then the error is raised
+    write_buffer = WriteBuffer(max_size=100, max_delay=60)
+    await write_buffer.insert_one("events", {"id": "event_1"})
+    await write_buffer.insert_one("evals", {"id": "eval_1"})
+    with pytest.raises(BulkWriteError):
+        await write_buffer.flush()
+    assert len(fake_mongo_db["evals"].bulk_writes) == 1
+
+    # The error of a delayed flush is raised at the end of the scope
+    with pytest.raises(BulkWriteError):
+        async with write_buffer_scope() as write_buffer:
+            write_buffer.max_delay = 0.01
+            await write_buffer.insert_one("events", {"id": "event_2"})
+            await asyncio.sleep(0.05)
+            assert len(fake_mongo_db["events"].bulk_writes) == 2
@@ -0,0 +1,49 @@
+import pytest
+
+import app.services.examples as examples_module
+from app.core import config
+from app.services.examples import few_shot_examples_cache, get_few_shot_examples
+from app.utils import generate_uuid
+
+assert config.ENVIRONMENT != "production"
+
+
+@pytest.mark.asyncio
+async def test_few_shot_examples_cache(db, monkeypatch):
+    fetches = []
+
+    async def fake_fetch_examples(project_id, flag, limit):
+        fetches.append(flag)
+        return [{"input": "input", "output": "output", "flag": flag}]
+
+    monkeypatch.setattr(examples_module, "fetch_examples", fake_fetch_examples)
+    # Check the version of the project on every call
+    monkeypatch.setattr(config, "FEW_SHOT_EXAMPLES_VERSION_CHECK_INTERVAL", 0)
+
+    async for mongo_db in db:
+        project_id = generate_uuid()
+
+        successful_examples, unsuccessful_examples = await get_few_shot_examples(
+            project_id
+        )
+        assert successful_examples[0]["flag"] == "success"
+        assert unsuccessful_examples[0]["flag"] == "failure"
+        assert len(fetches) == 2
+
+        # Same version: the examples are read from the cache
+        await get_few_shot_examples(project_id)
+        assert len(fetches) == 2
+
+        # A user eval was written: the backend increments the version of the project
+        await mongo_db["few_shot_examples_versions"].update_one(
+            {"_id": project_id}, {"$inc": {"version": 1}}, upsert=True
+        )
+        await get_few_shot_examples(project_id)
+        assert len(fetches) == 4
+        assert few_shot_examples_cache[project_id]["version"] == 1
+
+        await get_few_shot_examples(project_id)
+        assert len(fetches) == 4
+
+        few_shot_examples_cache.pop(project_id, None)
+        await mongo_db["few_shot_examples_versions"].delete_one({"_id": project_id})
@@ -0,0 +1,211 @@
+import pytest
+
+import app.services.job_queue as job_queue
+from app.core import config
+from app.db.models import Task
+from app.services.job_queue import (
+    JOB_QUEUE_COLLECTION,
+    claim_job,
+    process_job,
+    release_job,
+    run_log_process_job,
+)
+from app.utils import generate_timestamp, generate_uuid
+
+assert config.ENVIRONMENT != "production"
+
+TEST_JOB_QUEUE_COLLECTION = "test_job_queue"
+
+
+@pytest.fixture
+def job_queue_collection(monkeypatch):
+    """Claim the jobs of a test collection, not the ones of the shared queue"""
+    monkeypatch.setattr(job_queue, "JOB_QUEUE_COLLECTION", TEST_JOB_QUEUE_COLLECTION)
+    return TEST_JOB_QUEUE_COLLECTION
+
+
+def make_job(**fields) -> dict:
+    now = generate_timestamp()
+    return {
+        "_id": generate_uuid(),
+        "job_type": "test_job",
+        "payload": {},
+        "status": "pending",
+        "attempts": 0,
+        "max_attempts": 3,
+        "created_at": now,
+        "available_at": now,
+        "lease_expires_at": None,
+        "worker_id": None,
+        **fields,
+    }
+
+
+@pytest.mark.asyncio
+async def test_claim_job_after_lease_expiry(db, job_queue_collection, monkeypatch):
+    handled_payloads = []
+
+    async def handler(payload):
+        handled_payloads.append(payload)
+
+    monkeypatch.setitem(job_queue.JOB_HANDLERS, "test_job", handler)
+
+    async for mongo_db in db:
+        collection = mongo_db[job_queue_collection]
+        now = generate_timestamp()
+        # Claimed by a worker which still holds the lease, or not available yet
+        await collection.insert_many(
+            [
+                make_job(
+                    status="running",
+                    attempts=1,
+                    worker_id="worker-alive",
+                    lease_expires_at=now + 60,
+                ),
+                make_job(available_at=now + 60),
+            ]
+        )
+        assert await claim_job("worker-2") is None
+
+        # The worker died: its lease expired
+        expired_job = make_job(
+            status="running",
+            attempts=1,
+            worker_id="worker-dead",
+            lease_expires_at=now - 1,
+            payload={"task_id": "task-1"},
+        )
+        await collection.insert_one(expired_job)
+        job = await claim_job("worker-2")
+        assert job["_id"] == expired_job["_id"]
+        assert job["worker_id"] == "worker-2"
+        assert job["attempts"] == 2
+        assert job["lease_expires_at"] >= now + config.JOB_QUEUE_VISIBILITY_TIMEOUT
+
+        await process_job(job, "worker-2")
+        assert handled_payloads == [{"task_id": "task-1"}]
+        job = await collection.find_one({"_id": expired_job["_id"]})
+        assert job["status"] == "done"
+        assert "payload" not in job
+
+        # The worker of the last attempt died: the job fails without running again
+        last_attempt_job = make_job(
+            status="running",
+            attempts=3,
+            worker_id="worker-dead",
+            lease_expires_at=now - 1,
+            last_error="Timeout",
+        )
+        await collection.insert_one(last_attempt_job)
+        job = await claim_job("worker-2")
+        assert job["_id"] == last_attempt_job["_id"]
+        await process_job(job, "worker-2")
+        assert len(handled_payloads) == 1
+        job = await collection.find_one({"_id": last_attempt_job["_id"]})
+        assert job["status"] == "failed"
+        assert job["last_error"] == "Timeout"
+
+        await collection.drop()
+
+
+@pytest.mark.asyncio
+async def test_job_retried_until_max_attempts(db, job_queue_collection, monkeypatch):
+    async def failing_handler(payload):
+        raise ValueError("Pipeline failed")
+
+    monkeypatch.setitem(job_queue.JOB_HANDLERS, "test_job", failing_handler)
+
+    async for mongo_db in db:
+        collection = mongo_db[job_queue_collection]
+        failing_job = make_job(max_attempts=2)
+        await collection.insert_one(failing_job)
+
+        # First attempt: retried after the backoff
+        job = await claim_job("worker-1")
+        await process_job(job, "worker-1")
+        job = await collection.find_one({"_id": failing_job["_id"]})
+        assert job["status"] == "pending"
+        assert job["attempts"] == 1
+        assert job["last_error"] == "Pipeline failed"
+        backoff = config.JOB_QUEUE_RETRY_BACKOFF
+        assert job["available_at"] >= job["claimed_at"] + backoff
+        assert await claim_job("worker-1") is None
+
+        # Last attempt: the job is marked as failed
+        await collection.update_one(
+            {"_id": failing_job["_id"]},
+            {"$set": {"available_at": generate_timestamp()}},
+        )
+        job = await claim_job("worker-1")
+        assert job["attempts"] == 2
+        await process_job(job, "worker-1")
+        job = await collection.find_one({"_id": failing_job["_id"]})
+        assert job["status"] == "failed"
+        assert job["expire_at"] is not None
+        assert await claim_job("worker-1") is None
+
+        await collection.drop()
+
+
+@pytest.mark.asyncio
+async def test_release_job(db, job_queue_collection):
+    async for mongo_db in db:
+        collection = mongo_db[job_queue_collection]
+        interrupted_job = make_job()
+        await collection.insert_one(interrupted_job)
+
+        job = await claim_job("worker-1")
+        assert job["attempts"] == 1
+        # The worker shuts down: the job is available again, and the attempt not counted
+        await release_job(job["_id"], "worker-1")
+        job = await collection.find_one({"_id": interrupted_job["_id"]})
+        assert job["status"] == "pending"
+        assert job["attempts"] == 0
+        assert job["lease_expires_at"] is None
+
+        job = await claim_job("worker-2")
+        assert job["_id"] == interrupted_job["_id"]
+        assert job["attempts"] == 1
+
+        await collection.drop()
+
+
+@pytest.mark.asyncio
+async def test_log_process_job_enqueues_failed_pipelines(
+    db, org_id, dummy_project, monkeypatch
+):
+    failed_task = Task(
+        project_id=dummy_project.id,
+        org_id=org_id,
+        input="What is the weather like today?",
+        output="Sunny and warm.",
+    )
+
+    async def fake_process_log(**kwargs):
+        return [failed_task]
+
+    monkeypatch.setattr(job_queue, "process_log", fake_process_log)
+
+    async for mongo_db in db:
+        # The batch job completes, and only the failed pipeline is retried
+        await run_log_process_job(
+            {
+                "project_id": dummy_project.id,
+                "org_id": org_id,
+                "logs_to_process": [],
+                "extra_logs_to_save": [],
+            }
+        )
+        jobs = (
+            await mongo_db[JOB_QUEUE_COLLECTION]
+            .find({"payload.task.id": failed_task.id})
+            .to_list(length=None)
+        )
+        assert len(jobs) == 1
+        assert jobs[0]["job_type"] == "main_pipeline"
+        assert jobs[0]["status"] == "pending"
+        assert jobs[0]["max_attempts"] == config.JOB_QUEUE_MAX_ATTEMPTS
+
+        await mongo_db[JOB_QUEUE_COLLECTION].delete_many(
+            {"payload.task.id": failed_task.id}
+        )
@@ -41,3 +41,127 @@ async def test_main_pipeline(db, org_id, dummy_project):
 
         # Cleanup
         cleanup(mongo_db, {"tasks": [dummy_task.id]})
+
+
+@pytest.mark.asyncio
+async def test_batched_event_detection_pipeline(db, dummy_project, monkeypatch):
+    from types import SimpleNamespace
+
+    from phospho import lab
+
+    from app.db.write_buffer import write_buffer_scope
+    from app.services.pipelines import event_detection_pipeline
+
+    prompts = []
+
+    class FakeCompletions:
+        async def create(self, model, messages, **kwargs):
+            prompts.append(messages[-1]["content"])
+            content = '{"question_answering": true, "webhook_trigger": false}'
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+            )
+
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    monkeypatch.setattr(
+        lab.job_library, "get_async_client", lambda provider: fake_client
+    )
+    monkeypatch.setattr(config, "EVENT_DETECTION_MODE", "batched")
+
+    async for mongo_db in db:
+        dummy_task = Task(
+            project_id=dummy_project.id,
+            input="What is the weather like today?",
+            output="Sunny and warm.",
+        )
+        await mongo_db["tasks"].insert_one(dummy_task.model_dump())
+
+        async with write_buffer_scope():
+            await event_detection_pipeline(dummy_task)
+
+        # One LLM call for all the events of the project
+        assert len(prompts) == 1
+        events = await mongo_db["events"].find({"task_id": dummy_task.id}).to_list(
+            length=None
+        )
+        assert [event["event_name"] for event in events] == ["question_answering"]
+        assert events[0]["source"] == "phospho-4"
+        task = await mongo_db["tasks"].find_one({"id": dummy_task.id})
+        assert task["event_names"] == ["question_answering"]
+        assert [event["event_name"] for event in task["event_summary"]] == [
+            "question_answering"
+        ]
+
+        cleanup(
+            mongo_db,
+            {
+                "tasks": [dummy_task.id],
+                "events": [event["id"] for event in events],
+            },
+        )
+
+
+@pytest.mark.asyncio
+async def test_event_summary(db, dummy_project, monkeypatch):
+    from types import SimpleNamespace
+
+    from phospho import lab
+
+    from app.db.models import Session
+    from app.db.write_buffer import write_buffer_scope
+    from app.services.pipelines import event_detection_pipeline
+
+    class FakeCompletions:
+        async def create(self, model, messages, **kwargs):
+            content = '{"question_answering": true, "webhook_trigger": false}'
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+            )
+
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    monkeypatch.setattr(
+        lab.job_library, "get_async_client", lambda provider: fake_client
+    )
+    monkeypatch.setattr(config, "EVENT_DETECTION_MODE", "batched")
+
+    async for mongo_db in db:
+        dummy_session = Session(project_id=dummy_project.id)
+        await mongo_db["sessions"].insert_one(dummy_session.model_dump())
+        dummy_task = Task(
+            project_id=dummy_project.id,
+            session_id=dummy_session.id,
+            input="What is the weather like today?",
+            output="Sunny and warm.",
+        )
+        await mongo_db["tasks"].insert_one(dummy_task.model_dump())
+
+        # The task is processed twice, eg when it's reprocessed
+        for _ in range(2):
+            async with write_buffer_scope():
+                await event_detection_pipeline(dummy_task)
+
+        events = await mongo_db["events"].find({"task_id": dummy_task.id}).to_list(
+            length=None
+        )
+        assert len(events) == 2
+        # The task keeps all its events, and one event per name in its summary
+        task = await mongo_db["tasks"].find_one({"id": dummy_task.id})
+        assert sorted(event["id"] for event in task["events"]) == sorted(
+            event["id"] for event in events
+        )
+        assert len(task["event_summary"]) == 1
+        assert task["event_names"] == ["question_answering"]
+        # The session only has the summary
+        session = await mongo_db["sessions"].find_one({"id": dummy_session.id})
+        assert session.get("events", []) == []
+        assert session["event_summary"] == task["event_summary"]
+        assert session["event_names"] == ["question_answering"]
+
+        cleanup(
+            mongo_db,
+            {
+                "sessions": [dummy_session.id],
+                "tasks": [dummy_task.id],
+                "events": [event["id"] for event in events],
+            },
+        )
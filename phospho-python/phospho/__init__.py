@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import os
 from copy import deepcopy
 from typing import (
     Any,
@@ -8,6 +10,7 @@ from typing import (
     Coroutine,
     Dict,
     Generator,
+    IO,
     Iterable,
     Literal,
     Optional,
@@ -19,6 +22,8 @@ import pydantic
 from . import config, integrations, lab, models, utils
 from ._version import __version__ as __version__
 from .client import Client as Client
+from .aggregator import AggregatorConsumer as AggregatorConsumer
+from .consumer import AsyncConsumer as AsyncConsumer
 from .consumer import Consumer as Consumer
 from .extractor import (
     RawDataType,
@@ -26,7 +31,9 @@ from .extractor import (
     extract_data_from_output,
     extract_metadata_from_input_output,
 )
-from .log_queue import Event, LogQueue
+from .log_queue import Event, LogQueue, OverflowPolicy
+from .serialization import Serializer
+from .spill import SpillQueue, claim_worker_dir
 from .tasks import Task
 from .testing import PhosphoTest
 from .utils import (
@@ -42,6 +49,10 @@ from .utils import (
 client = None
 log_queue = None
 consumer = None
+# Arguments of the latest call to phospho.init(), used to re-init after a fork
+_init_kwargs: Optional[Dict[str, Any]] = None
+# Lock of the worker spill directory of a forked process, held until it exits
+_worker_spill_lock: Optional[IO] = None
 latest_task_id = None
 latest_session_id = None
 
@@ -54,6 +65,17 @@ def init(
     base_url: Optional[str] = None,
     tick: float = 0.5,
     raise_error_on_fail_to_send: bool = False,
+    transport: Literal["thread", "async", "aggregate"] = "thread",
+    max_batch_events: Optional[int] = 1000,
+    max_batch_bytes: Optional[int] = 5 * 1024 * 1024,
+    max_queue_size: Optional[int] = None,
+    overflow_policy: OverflowPolicy = "drop_oldest",
+    overflow_timeout: float = 1.0,
+    compression: Optional[Literal["gzip", "zstd"]] = "gzip",
+    serializer: Serializer = "auto",
+    spill_dir: Optional[str] = None,
+    max_spill_bytes: Optional[int] = 1024 * 1024 * 1024,
+    aggregator_socket_path: Optional[str] = None,
 ) -> None:
     """
     Initialize the phospho logging module.
@@ -67,23 +89,128 @@ def init(
     :param base_url: URL to the phospho backend
     :param verbose: whether to display logs
     :param tick: how frequently the consumer tries to push logs to the backend (in seconds)
+    :param transport: "thread" to push logs from a background thread, "async" to push logs
+        from a task on the running asyncio event loop, with a pooled connection (requires httpx).
+        With "async", use `await phospho.aflush()` to flush the log_queue.
+        "aggregate" is meant for apps with several worker processes on the same host (gunicorn,
+        uwsgi...): workers send their logs over a Unix socket to one of them, which batches
+        the logs of all the workers before pushing them to the backend.
+    :param max_batch_events: maximum number of log events sent in a single request
+    :param max_batch_bytes: maximum size (in bytes) of the log events sent in a single request
+    :param max_queue_size: maximum number of log events kept in memory. None means unbounded.
+    :param overflow_policy: what to do when logging to a full log_queue: "drop_oldest",
+        "drop_newest" or "block" (wait up to overflow_timeout seconds, then drop the new log)
+    :param overflow_timeout: maximum waiting time (in seconds) with the "block" policy
+    :param compression: encoding used to compress big batches of logs ("gzip" or "zstd",
+        which requires the `zstandard` package). None disables compression.
+    :param serializer: json library used to encode the logs: "orjson", "msgspec", "json"
+        (standard library) or "auto" (the fastest installed one, see `pip install phospho[fast]`)
+    :param spill_dir: if set, every tick, logs are written to segment files in this directory
+        before being sent, and deleted once sent. Logs survive backend outages and crashes,
+        except the logs of the last tick, and are sent on restart. Use one directory per process.
+    :param max_spill_bytes: maximum size of the logs stored in spill_dir (in bytes)
+    :param aggregator_socket_path: path of the Unix socket used with the "aggregate" transport.
+        Use the same path in all the workers of the host.
+
+    If the process is forked after phospho.init(), phospho is initialized again in the child
+    process with the same arguments, except spill_dir: the child spills its logs to a
+    worker subdirectory, that it holds until it exits. A new worker adopts the subdirectory
+    of a dead worker and sends the logs left in it.
     """
     global client
     global log_queue
     global consumer
+    global _init_kwargs
 
-    client = Client(api_key=api_key, project_id=project_id, base_url=base_url)
-    log_queue = LogQueue()
-    consumer = Consumer(
-        log_queue=log_queue,
-        client=client,
-        tick=tick,
-        raise_error_on_fail_to_send=raise_error_on_fail_to_send,
+    _init_kwargs = dict(locals())
+
+    client = Client(
+        api_key=api_key,
+        project_id=project_id,
+        base_url=base_url,
+        compression=compression,
+        serializer=serializer,
+    )
+    log_queue = LogQueue(
+        max_size=max_queue_size,
+        overflow_policy=overflow_policy,
+        block_timeout=overflow_timeout,
     )
-    # Start the consumer on a separate thread (this will periodically send logs to backend)
+    spill = None
+    if spill_dir is not None:
+        spill = SpillQueue(spill_dir=spill_dir, max_spill_bytes=max_spill_bytes)
+    if transport == "thread":
+        consumer = Consumer(
+            log_queue=log_queue,
+            client=client,
+            tick=tick,
+            raise_error_on_fail_to_send=raise_error_on_fail_to_send,
+            max_batch_events=max_batch_events,
+            max_batch_bytes=max_batch_bytes,
+            spill=spill,
+        )
+    elif transport == "async":
+        consumer = AsyncConsumer(
+            log_queue=log_queue,
+            client=client,
+            tick=tick,
+            raise_error_on_fail_to_send=raise_error_on_fail_to_send,
+            max_batch_events=max_batch_events,
+            max_batch_bytes=max_batch_bytes,
+            spill=spill,
+        )
+    elif transport == "aggregate":
+        consumer = AggregatorConsumer(
+            log_queue=log_queue,
+            client=client,
+            tick=tick,
+            raise_error_on_fail_to_send=raise_error_on_fail_to_send,
+            max_batch_events=max_batch_events,
+            max_batch_bytes=max_batch_bytes,
+            **(
+                {"socket_path": aggregator_socket_path}
+                if aggregator_socket_path is not None
+                else {}
+            ),
+        )
+    else:
+        raise NotImplementedError(f"Transport {transport} is not supported.")
+    # Start the consumer on a separate thread or on the running event loop
+    # (this will periodically send logs to backend)
     consumer.start()
 
 
+def _reinit_after_fork() -> None:
+    """
+    The consumer thread doesn't survive a fork. Initialize phospho again in the child
+    process, so that it gets its own log_queue, connection pool and consumer.
+    """
+    global consumer
+    global _worker_spill_lock
+
+    if _init_kwargs is None:
+        return
+    if consumer is not None:
+        # Don't send the logs of the parent a second time
+        consumer.close_after_fork()
+    if _worker_spill_lock is not None:
+        # The parent keeps its worker directory
+        _worker_spill_lock.close()
+        _worker_spill_lock = None
+    init_kwargs = dict(_init_kwargs)
+    spill_dir = init_kwargs["spill_dir"]
+    if spill_dir is not None:
+        # The segments of the parent must not be sent by the child too
+        init_kwargs["spill_dir"], _worker_spill_lock = claim_worker_dir(spill_dir)
+    init(**init_kwargs)
+    # The children of this process claim their worker directories in the same spill_dir
+    _init_kwargs["spill_dir"] = spill_dir
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
 def new_session() -> str:
     """
     Sessions are used to group tasks and logs together.
@@ -141,19 +268,35 @@ def _log_single_event(
     """
     global client
     global log_queue
+    global consumer
     global latest_task_id
     global latest_session_id
 
+    assert (
+        (log_queue is not None) and (client is not None)
+    ), "phospho.log() was called but the global variable log_queue was not found. Make sure that phospho.init() was called."
+
+    # Intermediate chunk of a stream: only accumulate the output
+    if not to_log and task_id is not None:
+        existing_event = log_queue.events.get(task_id)
+        if existing_event is not None and not existing_event.to_log:
+            latest_task_id = task_id
+            latest_session_id = session_id
+            return _accumulate_stream_chunk(
+                event=existing_event,
+                input=input,
+                output=output,
+                raw_output=raw_output,
+                output_to_str_function=output_to_str_function,
+                input_output_to_usage_function=input_output_to_usage_function,
+            )
+
     input = convert_content_to_loggable_content(input)
     output = convert_content_to_loggable_content(output)
     raw_input = convert_content_to_loggable_content(raw_input)
     raw_output = convert_content_to_loggable_content(raw_output)
     kwargs = convert_content_to_loggable_content(kwargs)
 
-    assert (
-        (log_queue is not None) and (client is not None)
-    ), "phospho.log() was called but the global variable log_queue was not found. Make sure that phospho.init() was called."
-
     # Process the input and output to convert them to dict
     (
         input_to_log,
@@ -217,6 +360,8 @@ def _log_single_event(
     if task_id in log_queue.events.keys():
         # If the task_id already exists in log_queue, update the existing event content
         # Update the dict inplace
+        # Merge the chunks streamed so far, if any
+        log_queue.events[task_id].close_stream()
         existing_log_content = log_queue.events[task_id].content
 
         # Concatenate the log event output strings, unless if everything is None
@@ -288,12 +433,48 @@ def _log_single_event(
         # Append event to log_queue
         log_queue.append(event=Event(id=task_id, content=log_content, to_log=to_log))
 
+    # With the async transport, make sure the consumer task runs on the current loop
+    if isinstance(consumer, AsyncConsumer):
+        consumer.ensure_running()
+
     # logger.debug("Updated dict:" + str(log_queue.events[task_id].content))
     # logger.debug("To log" + str(log_queue.events[task_id].to_log))
 
     return log_content
 
 
+def _accumulate_stream_chunk(
+    event: Event,
+    input: Union[RawDataType, str],
+    output: Optional[Union[RawDataType, str]] = None,
+    raw_output: Optional[RawDataType] = None,
+    output_to_str_function: Optional[Callable[[Any], str]] = None,
+    input_output_to_usage_function: Optional[
+        Callable[[Any, Any], Dict[str, float]]
+    ] = None,
+) -> Dict[str, object]:
+    """Add an intermediate chunk of a streamed output to an event of the log_queue.
+
+    The input and the other metadata were already processed with the first chunk of the
+    stream, and are processed again with the last one. The chunk is stored as is: it is
+    only converted, and its usage counted, when the stream ends or the event is flushed.
+    """
+    event.stream().append(
+        input=input,
+        output=output,
+        raw_output=raw_output,
+        output_to_str_function=output_to_str_function,
+        input_output_to_usage_function=input_output_to_usage_function,
+    )
+    log_content = event.content
+    log_content["last_update"] = generate_timestamp()
+
+    if isinstance(consumer, AsyncConsumer):
+        consumer.ensure_running()
+
+    return log_content
+
+
 def _wrap_iterable(
     output: Union[Iterable[RawDataType], AsyncIterable[RawDataType]]
 ) -> None:
@@ -834,3 +1015,17 @@ def flush() -> None:
     global consumer
 
     consumer.send_batch()
+
+
+async def aflush() -> None:
+    """
+    Flush the log_queue without blocking the event loop. This will send all the logs to phospho.
+    """
+    global consumer
+
+    if isinstance(consumer, AsyncConsumer):
+        await consumer.asend_batch()
+    else:
+        # The thread consumer uses a blocking client: run it in the default executor
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, consumer.send_batch)
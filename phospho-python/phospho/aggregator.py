@@ -0,0 +1,243 @@
+"""
+Per-host aggregation of logs, for apps with several worker processes (gunicorn, uwsgi...)
+
+Instead of every worker posting its own small batches to the phospho backend, workers push
+their log events over a Unix domain socket to a single aggregator. The aggregator batches
+the events of all the workers and posts them to the backend with a regular Consumer.
+
+There is no separate process to run: the first worker that takes the lock next to the
+socket becomes the aggregator. If it exits, another worker takes over on its next tick.
+Events are newline-delimited json lists. Events in flight when the aggregator is killed
+are lost.
+
+All the workers of a host must log with the same API key.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+from .client import Client
+from .consumer import Consumer, get_batch_payload
+from .log_queue import Event, LogQueue
+from .utils import generate_uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "phospho-aggregator.sock")
+
+
+def push_to_log_queue(
+    log_queue: LogQueue, events_content: List[Dict[str, object]]
+) -> None:
+    """Push the events content sent by a worker to the aggregator log_queue"""
+    events: Dict[str, Event] = {}
+    for event_content in events_content:
+        event_id = str(event_content.get("task_id", generate_uuid()))
+        events[event_id] = Event(id=event_id, content=event_content)
+    log_queue.extend(events)
+
+
+class _AggregatorRequestHandler(socketserver.StreamRequestHandler):
+    """Read the batches sent by a worker and push them to the aggregator log_queue"""
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                events_content = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("phospho aggregator received an invalid batch")
+                continue
+            push_to_log_queue(self.server.log_queue, events_content)  # type: ignore
+
+
+class _AggregatorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, log_queue: LogQueue) -> None:
+        self.log_queue = log_queue
+        super().__init__(socket_path, _AggregatorRequestHandler)
+
+
+class Aggregator:
+    """Receives the log events of the workers of the host and sends them to the backend"""
+
+    def __init__(
+        self,
+        socket_path: str,
+        lock_file,
+        client: Client,
+        log_queue: LogQueue,
+        **consumer_kwargs,
+    ) -> None:
+        self.socket_path = socket_path
+        # Held as long as this process is the aggregator
+        self.lock_file = lock_file
+        self.log_queue = log_queue
+        self.consumer = Consumer(log_queue=log_queue, client=client, **consumer_kwargs)
+        # The lock guarantees that the socket file, if any, is stale
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.server = _AggregatorServer(socket_path, log_queue)
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+
+    @classmethod
+    def try_create(
+        cls, socket_path: str, client: Client, log_queue: LogQueue, **consumer_kwargs
+    ) -> Optional["Aggregator"]:
+        """Become the aggregator of the host, if there is none. Returns None otherwise."""
+        if fcntl is None:
+            raise NotImplementedError("Log aggregation requires a POSIX system.")
+        lock_file = open(socket_path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Another process is the aggregator
+            lock_file.close()
+            return None
+        logger.info(f"phospho aggregator listening on {socket_path} (pid {os.getpid()})")
+        try:
+            aggregator = cls(
+                socket_path=socket_path,
+                lock_file=lock_file,
+                client=client,
+                log_queue=log_queue,
+                **consumer_kwargs,
+            )
+        except Exception:
+            lock_file.close()
+            raise
+        aggregator.start()
+        return aggregator
+
+    def start(self) -> None:
+        self.server_thread.start()
+        self.consumer.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.consumer.stop()
+        # Send the events pushed since the consumer last ticked
+        self.consumer.send_batch()
+        self.lock_file.close()
+
+    def close_after_fork(self) -> None:
+        """In a forked child, release the file descriptors inherited from the aggregator."""
+        self.server.socket.close()
+        self.lock_file.close()
+
+
+class AggregatorConsumer(Consumer):
+    """Every tick, the consumer sends the accumulated logs to the aggregator of the host.
+
+    If there is no aggregator, this process becomes the aggregator.
+    """
+
+    def __init__(
+        self,
+        log_queue: LogQueue,
+        client: Client,
+        tick: float = 0.5,  # How often to try to send logs
+        raise_error_on_fail_to_send: bool = False,
+        max_batch_events: Optional[int] = 1000,  # Max number of events per message
+        max_batch_bytes: Optional[int] = 5 * 1024 * 1024,  # Max size of a message
+        socket_path: str = DEFAULT_SOCKET_PATH,
+    ) -> None:
+        self.socket_path = socket_path
+        self.socket: Optional[socket.socket] = None
+        self.aggregator: Optional[Aggregator] = None
+        super().__init__(
+            log_queue=log_queue,
+            client=client,
+            tick=tick,
+            raise_error_on_fail_to_send=raise_error_on_fail_to_send,
+            max_batch_events=max_batch_events,
+            max_batch_bytes=max_batch_bytes,
+        )
+
+    def connect(self) -> socket.socket:
+        """Connect to the aggregator of the host"""
+        if self.socket is not None:
+            return self.socket
+        unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            unix_socket.connect(self.socket_path)
+        except OSError:
+            unix_socket.close()
+            raise
+        self.socket = unix_socket
+        return unix_socket
+
+    def disconnect(self) -> None:
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+            self.socket = None
+
+    def post_batch(self, batch: List[Dict[str, object]]) -> None:
+        payload = get_batch_payload(batch)
+        if payload is None:
+            return
+        events_content: List[Dict[str, object]] = payload["batched_log_events"]  # type: ignore
+
+        if self.aggregator is None and self.socket is None:
+            # Become the aggregator if there is none (or if it exited)
+            self.aggregator = Aggregator.try_create(
+                socket_path=self.socket_path,
+                client=self.client,
+                # Bounded like the log_queue of the workers
+                log_queue=LogQueue(
+                    max_size=self.log_queue.max_size,
+                    overflow_policy=self.log_queue.overflow_policy,
+                    block_timeout=self.log_queue.block_timeout,
+                ),
+                tick=self.tick,
+                max_batch_events=self.max_batch_events,
+                max_batch_bytes=self.max_batch_bytes,
+            )
+        if self.aggregator is not None:
+            # This process is the aggregator: no need to go through the socket
+            push_to_log_queue(self.aggregator.log_queue, events_content)
+            self.nb_consecutive_errors = 0
+            return
+
+        logger.debug(f"Sending {len(batch)} log events to {self.socket_path}")
+        message = (json.dumps(events_content) + "\n").encode()
+        try:
+            self.connect().sendall(message)
+        except OSError:
+            # The aggregator is gone: reconnect (or take over) next tick
+            self.disconnect()
+            raise
+        self.nb_consecutive_errors = 0
+
+    def stop(self):
+        super().stop()
+        self.disconnect()
+        if self.aggregator is not None:
+            self.aggregator.stop()
+
+    def close_after_fork(self) -> None:
+        """In a forked child, release the file descriptors inherited from the parent."""
+        super().close_after_fork()
+        self.disconnect()
+        if self.aggregator is not None:
+            self.aggregator.close_after_fork()
+            self.aggregator = None
@@ -4,14 +4,16 @@ phospho client to interact with the phospho API
 TODO
 - Add support for pagination and filters
 - Add support for retrying requests and handling rate limits
-- Add support for AsyncIO -> be non blocking in the background
 """
+import asyncio
+import gzip
 import os
-from typing import Dict, Literal, Optional
+from typing import Any, Dict, Literal, Optional, Tuple
 
 import requests
 
 import phospho.config as config
+from phospho.serialization import Serializer, get_json_dumps
 
 from phospho.sessions import SessionCollection
 from phospho.tasks import TaskCollection, Task
@@ -26,13 +28,31 @@ class Client:
         api_key: Optional[str] = None,
         project_id: Optional[str] = None,
         base_url: Optional[str] = None,
+        compression: Optional[Literal["gzip", "zstd"]] = "gzip",
+        compression_threshold: int = 1024,
+        serializer: Serializer = "auto",
     ) -> None:
+        """
+        :param compression: compress the body of POST requests with this encoding.
+            "zstd" requires the `zstandard` package. None disables compression.
+        :param compression_threshold: only compress bodies bigger than this (in bytes)
+        :param serializer: json library used to encode the body of POST requests:
+            "orjson", "msgspec", "json" (standard library) or "auto" (the fastest installed one)
+        """
         self.api_key = api_key
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self._json_dumps = get_json_dumps(serializer)
         self.project_id = project_id
         if not base_url:
             self.base_url = config.BASE_URL
         else:
             self.base_url = base_url
+        # Reuse the same connection pool across calls (keep-alive)
+        self._session = requests.Session()
+        # Lazily created, see _async_session()
+        self._async_client: Optional[Any] = None
+        self._async_client_loop: Optional[asyncio.AbstractEventLoop] = None
 
     def _api_key(self) -> str:
         token = self.api_key
@@ -66,11 +86,44 @@ class Client:
             "accept": "application/json",
         }
 
+    def _encode_payload(
+        self, payload: Optional[Dict[str, object]], compress: bool = False
+    ) -> Tuple[Optional[bytes], Dict[str, str]]:
+        """
+        Encode the payload as json. If compress, compress it if it's big enough.
+        Returns the body and the headers of the request.
+        """
+        headers = self._headers()
+        if payload is None:
+            return None, headers
+        body = self._json_dumps(payload)
+        if (
+            not compress
+            or self.compression is None
+            or len(body) < self.compression_threshold
+        ):
+            return body, headers
+
+        if self.compression == "gzip":
+            body = gzip.compress(body, compresslevel=6)
+        elif self.compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError(
+                    "Please install the `zstandard` package to use zstd compression."
+                )
+            body = zstandard.ZstdCompressor().compress(body)
+        else:
+            raise NotImplementedError(f"Compression {self.compression} is not supported.")
+        headers["Content-Encoding"] = self.compression
+        return body, headers
+
     def _get(
         self, path: str, params: Optional[Dict[str, str]] = None
     ) -> requests.Response:
         url = f"{self.base_url}{path}"
-        response = requests.get(url, headers=self._headers(), params=params)
+        response = self._session.get(url, headers=self._headers(), params=params)
 
         if response.status_code >= 200 and response.status_code < 300:
             return response
@@ -87,10 +140,18 @@ class Client:
                 )
 
     def _post(
-        self, path: str, payload: Optional[Dict[str, object]] = None
+        self,
+        path: str,
+        payload: Optional[Dict[str, object]] = None,
+        compress: bool = False,
     ) -> requests.Response:
+        """
+        Post the payload as json. If compress, the body is compressed when it's
+        big enough. Only use it with endpoints that accept compressed bodies.
+        """
         url = f"{self.base_url}{path}"
-        response = requests.post(url, headers=self._headers(), json=payload)
+        body, headers = self._encode_payload(payload, compress=compress)
+        response = self._session.post(url, headers=headers, data=body)
 
         if response.status_code >= 200 and response.status_code < 300:
             return response
@@ -105,6 +166,66 @@ class Client:
                     f"Error posting {url} (code: {response.status_code}): {response.text}"
                 )
 
+    def _async_session(self) -> Any:
+        """
+        Return a pooled httpx.AsyncClient bound to the running event loop.
+        The client is recreated if the event loop changed since its creation.
+        """
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError(
+                "Please install the `httpx` package to use the async transport: `pip install phospho[async]`"
+            )
+
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            try:
+                import h2  # noqa: F401
+
+                http2 = True
+            except ImportError:
+                http2 = False
+            self._async_client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+                timeout=httpx.Timeout(30.0),
+            )
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def _apost(
+        self,
+        path: str,
+        payload: Optional[Dict[str, object]] = None,
+        compress: bool = False,
+    ) -> Any:
+        """Async version of _post, that reuses a pooled keep-alive connection"""
+        url = f"{self.base_url}{path}"
+        session = self._async_session()
+        body, headers = self._encode_payload(payload, compress=compress)
+        response = await session.post(url, headers=headers, content=body)
+
+        if response.status_code >= 200 and response.status_code < 300:
+            return response
+        else:
+            try:
+                json = response.json()
+                raise ValueError(
+                    f"Error posting {url} (code: {response.status_code}): {json}"
+                )
+            except Exception as e:
+                raise ValueError(
+                    f"Error posting {url} (code: {response.status_code}): {response.text}"
+                )
+
+    async def aclose(self) -> None:
+        """Close the async connection pool, if any"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_client_loop = None
+
     @property
     def sessions(self) -> SessionCollection:
         """Return a SessionCollection to interact with the sessions of the project"""
@@ -1,16 +1,38 @@
-from .log_queue import LogQueue
+from .log_queue import LogQueue, split_batch
 from .client import Client
+from .spill import SpillQueue
 
+import asyncio
 import time
 import atexit
 import os
-from threading import Thread
+from threading import Lock, Thread
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def get_batch_payload(batch: List[Dict[str, object]]) -> Optional[Dict[str, object]]:
+    """
+    Build the payload sent to the /log endpoint from a batch of log events.
+    Returns None if the batch should not be sent (test mode with another metric).
+    """
+    PHOSPHO_TEST_ID = os.getenv("PHOSPHO_TEST_ID")
+    PHOSPHO_TEST_METRIC = os.getenv("PHOSPHO_TEST_METRIC")
+    if PHOSPHO_TEST_ID is None:
+        # Normal behaviour : send logs to backend
+        return {"batched_log_events": batch}
+    # Test mode: send logs if we are in the right metric
+    if PHOSPHO_TEST_METRIC == "evaluate":
+        # Add the test_id to the log events
+        for event in batch:
+            event["test_id"] = PHOSPHO_TEST_ID
+        return {"batched_log_events": batch}
+    return None
+
+
 class Consumer(Thread):
     """Every tick, the consumer tries to send the accumulated logs to the backend."""
 
@@ -20,12 +42,20 @@ class Consumer(Thread):
         client: Client,
         tick: float = 0.5,  # How often to try to send logs
         raise_error_on_fail_to_send: bool = False,
+        max_batch_events: Optional[int] = 1000,  # Max number of events per request
+        max_batch_bytes: Optional[int] = 5 * 1024 * 1024,  # Max size of a request
+        spill: Optional[SpillQueue] = None,  # Store logs on disk before sending them
     ) -> None:
         self.running = True
         self.log_queue = log_queue
         self.client = client
         self.tick = tick
         self.raise_error_on_fail_to_send = raise_error_on_fail_to_send
+        self.max_batch_events = max_batch_events
+        self.max_batch_bytes = max_batch_bytes
+        self.spill = spill
+        # Only one flush at a time can send the segments on disk
+        self.spill_lock = Lock()
         self.nb_consecutive_errors = 0
 
         Thread.__init__(self, daemon=True)
@@ -42,51 +72,240 @@ class Consumer(Thread):
 
     def run(self) -> None:
         while self.running:
-            self.send_batch()
+            try:
+                self.send_batch()
+            except Exception as e:
+                # Keep ticking: the thread must not die with the logs in the queue
+                logger.error(f"Error in phospho consumer: {e}")
             time.sleep(self.get_wait_time())
 
         self.send_batch()
 
-    def send_batch(self) -> None:
+    def get_batches(self) -> List[List[Dict[str, object]]]:
+        """Drain the log queue into batches bounded in number of events and bytes."""
+        return self.log_queue.get_batches(
+            max_batch_events=self.max_batch_events,
+            max_batch_bytes=self.max_batch_bytes,
+            json_dumps=self.client._json_dumps,
+        )
+
+    def iter_spilled_batches(
+        self,
+    ) -> Iterator[Tuple[str, List[List[Dict[str, object]]]]]:
+        """
+        Write the content of the log queue to disk, then yield the segments on disk
+        (oldest first) with their events split into bounded batches.
+        A segment is only read when the caller asks for it, so at most one segment is
+        held in memory, and the caller can stop at the first segment it fails to send.
+        """
+        assert self.spill is not None
         batch = self.log_queue.get_batch()
+        try:
+            self.spill.append(batch)
+        except OSError as e:
+            # eg. the disk is full: keep the events in memory until the next tick, and
+            # still send the segments already on disk
+            logger.warning(f"Error writing log events to disk: {e}")
+            self.log_queue.add_batch(batch)
+        for segment in self.spill.segments():
+            events_content = self.spill.read(segment)
+            if len(events_content) == 0:
+                self.spill.remove(segment)
+                continue
+            yield (
+                segment,
+                split_batch(
+                    events_content,
+                    max_batch_events=self.max_batch_events,
+                    max_batch_bytes=self.max_batch_bytes,
+                    json_dumps=self.client._json_dumps,
+                ),
+            )
+
+    def handle_send_error(
+        self,
+        e: Exception,
+        unsent_batches: List[List[Dict[str, object]]],
+        segment: Optional[str] = None,
+    ) -> None:
+        unsent_events = [event for batch in unsent_batches for event in batch]
+        if segment is not None and self.spill is not None:
+            # Only keep the events that weren't sent in the segment
+            self.spill.rewrite(segment, unsent_events)
+
+        if self.raise_error_on_fail_to_send:
+            # If we are in a test, we want to raise the error
+            raise e
+        else:
+            self.nb_consecutive_errors += 1
+            logger.warning(
+                f"Error sending log events: {e}. Retrying in {self.get_wait_time()}s"
+            )
 
-        if len(batch) > 0:
-            logger.debug(f"Sending {len(batch)} log events to {self.client.base_url}")
+            if segment is None:
+                # Put all the events back into the log queue, so they are logged next tick
+                self.log_queue.add_batch(unsent_events)
 
+    def post_batch(self, batch: List[Dict[str, object]]) -> None:
+        logger.debug(f"Sending {len(batch)} log events to {self.client.base_url}")
+        payload = get_batch_payload(batch)
+        if payload is not None:
+            self.client._post(
+                f"/log/{self.client._project_id()}", payload, compress=True
+            )
+            self.nb_consecutive_errors = 0
+
+    def send_batch(self) -> None:
+        if self.spill is not None:
+            if not self.spill_lock.acquire(False):  # non-blocking
+                return
             try:
-                PHOSPHO_TEST_ID = os.getenv("PHOSPHO_TEST_ID")
-                PHOSPHO_TEST_METRIC = os.getenv("PHOSPHO_TEST_METRIC")
-                if PHOSPHO_TEST_ID is None:
-                    # Normal behaviour : send logs to backend
-                    self.client._post(
-                        f"/log/{self.client._project_id()}",
-                        {"batched_log_events": batch},
-                    )
-                    self.nb_consecutive_errors = 0
-                elif PHOSPHO_TEST_ID is not None:
-                    # Test mode: send logs if we are in the right metric
-                    if PHOSPHO_TEST_METRIC == "evaluate":
-                        # Add the test_id to the log events
-                        for event in batch:
-                            event["test_id"] = PHOSPHO_TEST_ID
-                        self.client._post(
-                            f"/log/{self.client._project_id()}",
-                            {"batched_log_events": batch},
-                        )
-                        self.nb_consecutive_errors = 0
+                for segment, batches in self.iter_spilled_batches():
+                    for i, batch in enumerate(batches):
+                        try:
+                            self.post_batch(batch)
+                        except Exception as e:
+                            # Stop at the first error: the backend is probably unreachable
+                            self.handle_send_error(e, batches[i:], segment=segment)
+                            return
+                    self.spill.remove(segment)
+            finally:
+                self.spill_lock.release()
+            return
+
+        batches = self.get_batches()
+
+        for i, batch in enumerate(batches):
+            try:
+                self.post_batch(batch)
             except Exception as e:
-                if self.raise_error_on_fail_to_send:
-                    # If we are in a test, we want to raise the error
-                    raise e
-                else:
-                    self.nb_consecutive_errors += 1
-                    logger.warning(
-                        f"Error sending log events: {e}. Retrying in {self.get_wait_time()}s"
+                # Stop at the first error: the backend is probably unreachable
+                self.handle_send_error(e, batches[i:])
+                return
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join()
+
+    def close_after_fork(self) -> None:
+        """
+        In a forked child, the consumer thread is gone. Forget the logs of the parent
+        process, so that they are not sent a second time by the child.
+        """
+        self.running = False
+        self.log_queue = LogQueue()
+        self.spill = None
+
+
+class AsyncConsumer(Consumer):
+    """Every tick, the consumer tries to send the accumulated logs to the backend.
+
+    Instead of a separate thread, the AsyncConsumer runs as a task on the running
+    asyncio event loop and reuses a pooled keep-alive connection to the backend.
+    If no event loop is running when it is started, the task is started lazily
+    the next time a log is pushed from within an event loop.
+    """
+
+    def __init__(
+        self,
+        log_queue: LogQueue,
+        client: Client,
+        tick: float = 0.5,  # How often to try to send logs
+        raise_error_on_fail_to_send: bool = False,
+        max_batch_events: Optional[int] = 1000,  # Max number of events per request
+        max_batch_bytes: Optional[int] = 5 * 1024 * 1024,  # Max size of a request
+        spill: Optional[SpillQueue] = None,  # Store logs on disk before sending them
+    ) -> None:
+        self._task: Optional[asyncio.Task] = None
+        super().__init__(
+            log_queue=log_queue,
+            client=client,
+            tick=tick,
+            raise_error_on_fail_to_send=raise_error_on_fail_to_send,
+            max_batch_events=max_batch_events,
+            max_batch_bytes=max_batch_bytes,
+            spill=spill,
+        )
+
+    def start(self) -> None:
+        """Start the consumer task on the running event loop, if there is one."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.debug("No running event loop. The consumer will start later.")
+            return
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self.running = True
+            self._task = loop.create_task(self.arun())
+
+    def ensure_running(self) -> None:
+        """Cheap check used on every log call to lazily start the consumer task."""
+        if self._task is None or self._task.done():
+            self.start()
+
+    async def arun(self) -> None:
+        while self.running:
+            try:
+                await self.asend_batch()
+            except Exception as e:
+                logger.error(f"Error in phospho async consumer: {e}")
+            await asyncio.sleep(self.get_wait_time())
+
+    async def apost_batch(self, batch: List[Dict[str, object]]) -> None:
+        logger.debug(f"Sending {len(batch)} log events to {self.client.base_url}")
+        payload = get_batch_payload(batch)
+        if payload is not None:
+            await self.client._apost(
+                f"/log/{self.client._project_id()}", payload, compress=True
+            )
+            self.nb_consecutive_errors = 0
+
+    async def asend_batch(self) -> None:
+        if self.spill is not None:
+            if not self.spill_lock.acquire(False):  # non-blocking
+                return
+            try:
+                # Don't block the event loop with the disk reads and writes
+                loop = asyncio.get_running_loop()
+                spilled_batches = self.iter_spilled_batches()
+                while True:
+                    spilled_batch = await loop.run_in_executor(
+                        None, next, spilled_batches, None
                     )
+                    if spilled_batch is None:
+                        break
+                    segment, batches = spilled_batch
+                    for i, batch in enumerate(batches):
+                        try:
+                            await self.apost_batch(batch)
+                        except Exception as e:
+                            # Stop at the first error: the backend is probably unreachable
+                            self.handle_send_error(e, batches[i:], segment=segment)
+                            return
+                    self.spill.remove(segment)
+            finally:
+                self.spill_lock.release()
+            return
+
+        batches = self.get_batches()
 
-                    # Put all the events back into the log queue, so they are logged next tick
-                    self.log_queue.add_batch(batch)
+        for i, batch in enumerate(batches):
+            try:
+                await self.apost_batch(batch)
+            except Exception as e:
+                # Stop at the first error: the backend is probably unreachable
+                self.handle_send_error(e, batches[i:])
+                return
 
     def stop(self):
         self.running = False
-        self.join()
+        if self._task is not None and not self._task.done():
+            try:
+                if not self._task.get_loop().is_closed():
+                    self._task.cancel()
+            except RuntimeError:
+                # The event loop was closed in the meantime, with the task still pending
+                pass
+        # The event loop may already be closed at exit: send what remains synchronously
+        self.send_batch()
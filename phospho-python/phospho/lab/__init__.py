@@ -1,3 +1,12 @@
 from .lab import Workload, Job
 from .models import JobResult, Message, JobConfig, EventConfig, ResultType
+from .llm_cache import (
+    LLMCache,
+    InMemoryLLMCache,
+    SQLiteLLMCache,
+    MongoLLMCache,
+    get_llm_cache,
+    set_llm_cache,
+)
+from .language_models import aclose_clients, set_client_limits
 from . import job_library as job_library
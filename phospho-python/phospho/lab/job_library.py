@@ -4,14 +4,22 @@ Each job is a function that takes a message and a set of parameters and returns
 The result is a JobResult object.
 """
 
+import asyncio
+import json
 import logging
 import random
 import time
-from typing import List, Literal, Optional, cast
+from typing import Dict, List, Literal, Optional, cast
 
 from phospho import config
 
-from .language_models import get_async_client, get_provider_and_model, get_sync_client
+from .language_models import (
+    get_async_client,
+    get_cohere_async_client,
+    get_provider_and_model,
+    get_sync_client,
+)
+from .llm_cache import async_get_chat_completion_content, get_chat_completion_content
 from .models import JobResult, Message, ResultType
 
 logger = logging.getLogger(__name__)
@@ -37,7 +45,9 @@ def prompt_to_bool(
         message_context=message.previous_messages_transcript(with_role=True),
         **format_kwargs,
     )
-    response = openai_client.chat.completions.create(
+    llm_response, _ = get_chat_completion_content(
+        openai_client,
+        provider,
         model=model,
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -47,8 +57,8 @@ def prompt_to_bool(
             },
         ],
         max_tokens=1,
+        temperature=0,
     )
-    llm_response = response.choices[0].message.content
 
     # Cast the response to a bool
     if llm_response is None:
@@ -87,7 +97,9 @@ def prompt_to_literal(
         ),
         **format_kwargs,
     )
-    response = openai_client.chat.completions.create(
+    llm_response, _ = get_chat_completion_content(
+        openai_client,
+        provider,
         model=model,
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -100,7 +112,7 @@ def prompt_to_literal(
         temperature=0,
     )
 
-    response_content = response.choices[0].message.content
+    response_content = llm_response
     literal_response = None
     if response_content is not None:
         response_content = response_content.strip()
@@ -110,7 +122,7 @@ def prompt_to_literal(
                 job_id="prompt_to_literal",
                 result_type=ResultType.literal,
                 value=response_content,
-                logs=[formated_prompt, response.choices[0].message.content],
+                logs=[formated_prompt, llm_response],
             )
         # Greedy: Check if the response contains one of the output_literal
         for literal in output_literal:
@@ -119,14 +131,14 @@ def prompt_to_literal(
                     job_id="prompt_to_literal",
                     result_type=ResultType.literal,
                     value=response_content,
-                    logs=[formated_prompt, response.choices[0].message.content],
+                    logs=[formated_prompt, llm_response],
                 )
 
     return JobResult(
         job_id="prompt_to_literal",
         result_type=ResultType.literal,
         value=literal_response,
-        logs=[formated_prompt, response.choices[0].message.content],
+        logs=[formated_prompt, llm_response],
     )
 
 
@@ -184,7 +196,9 @@ You have to say if the event is present in the transcript or not. Respond with o
     start_time = time.time()
 
     try:
-        response = await async_openai_client.chat.completions.create(
+        llm_response, cache_hit = await async_get_chat_completion_content(
+            async_openai_client,
+            provider,
             model=model_name,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
@@ -207,7 +221,6 @@ You have to say if the event is present in the transcript or not. Respond with o
     logger.debug(f"event_detection call to OpenAI API ({api_call_time} sec)")
 
     # Parse the response
-    llm_response = response.choices[0].message.content
     logger.debug(f"event_detection llm_response : {llm_response}")
     if llm_response is not None:
         llm_response = llm_response.strip()
@@ -237,12 +250,205 @@ You have to say if the event is present in the transcript or not. Respond with o
         metadata={
             "api_call_time": api_call_time,
             "evaluation_source": evaluation_source,
+            # Source of the detected events
+            "source": evaluation_source,
+            "cache_hit": cache_hit,
+            # No call to record if the response comes from the cache
             "llm_call": {
                 "model": model_name,
                 "prompt": prompt,
                 "llm_output": llm_response,
                 "api_call_time": api_call_time,
                 "evaluation_source": evaluation_source,
+            }
+            if not cache_hit
+            else None,
+        },
+    )
+
+
+def parse_multi_event_detection_response(
+    llm_response: Optional[str], event_names: List[str]
+) -> Dict[str, Optional[bool]]:
+    """
+    Parse the json verdicts of multi_event_detection.
+    Events with a missing or invalid verdict are None.
+    """
+    verdicts: Dict[str, Optional[bool]] = {event_name: None for event_name in event_names}
+    if llm_response is None:
+        return verdicts
+    # Ignore the text around the json object, such as markdown code blocks
+    start, end = llm_response.find("{"), llm_response.rfind("}")
+    if start == -1 or end < start:
+        return verdicts
+    try:
+        parsed_response = json.loads(llm_response[start : end + 1])
+    except json.JSONDecodeError:
+        return verdicts
+    if not isinstance(parsed_response, dict):
+        return verdicts
+
+    # Match the event names case insensitively
+    event_names_by_key = {event_name.lower(): event_name for event_name in event_names}
+    for key, value in parsed_response.items():
+        event_name = event_names_by_key.get(str(key).strip().lower())
+        if event_name is None:
+            continue
+        if isinstance(value, str):
+            value = {"true": True, "false": False}.get(value.strip().lower())
+        if isinstance(value, bool):
+            verdicts[event_name] = value
+    return verdicts
+
+
+async def multi_event_detection(
+    message: Message,
+    events: Dict[str, str],
+    model: str = "openai:gpt-3.5-turbo",
+) -> JobResult:
+    """
+    Detects which events are present in a message, with one LLM call for all the events.
+
+    events is a mapping event_name -> event_description. The events with a missing or
+    invalid verdict in the LLM response are detected one by one with event_detection.
+
+    The value of the result is a mapping event_name -> detected (or None if the detection
+    failed). metadata["event_results"] is a mapping event_name -> JobResult.
+    """
+    if len(events) <= 1:
+        # Nothing to batch
+        event_results = {
+            event_name: await event_detection(
+                message, event_name, event_description, model=model
+            )
+            for event_name, event_description in events.items()
+        }
+        return JobResult(
+            job_id="multi_event_detection",
+            result_type=ResultType.dict,
+            value={
+                event_name: result.value for event_name, result in event_results.items()
+            },
+            metadata={"event_results": event_results},
+        )
+
+    provider, model_name = get_provider_and_model(model)
+    async_openai_client = get_async_client(provider)
+
+    events_list = "\n".join(
+        f"- {event_name}: {event_description}"
+        for event_name, event_description in events.items()
+    )
+    interaction_context = message.latest_interaction_context()
+    if interaction_context is not None:
+        context_prompt = f"""
+Here are the previous messages of the conversation before the interaction to help you better understand the extract:
+[START CONTEXT]
+{interaction_context}
+[END CONTEXT]
+"""
+    else:
+        context_prompt = ""
+    prompt = f"""
+You are classifying an interaction between an end user and an assistant. The assistant is a chatbot that can perform tasks for the end user and answer his questions. 
+The assistant might make some mistakes or not be useful.
+The events you are looking for are, in the format "- event name: event description":
+{events_list}
+{context_prompt}
+Here is the transcript of the interaction:
+[START INTERACTION]
+{message.latest_interaction()}
+[END INTERACTION]
+
+For each event, you have to say if the event is present in the transcript or not. Respond with only a json object mapping each event name to true or false.
+    """
+
+    logger.debug(f"multi_event_detection prompt : {prompt}")
+
+    # Call the API
+    start_time = time.time()
+
+    llm_response: Optional[str] = None
+    cache_hit = False
+    try:
+        llm_response, cache_hit = await async_get_chat_completion_content(
+            async_openai_client,
+            provider,
+            model=model_name,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt},
+            ],
+            # About 10 tokens per verdict
+            max_tokens=20 + 20 * len(events),
+            temperature=0,
+        )
+    except Exception as e:
+        logger.error(f"multi_event_detection call to OpenAI API failed : {e}")
+
+    api_call_time = time.time() - start_time
+
+    logger.debug(f"multi_event_detection call to OpenAI API ({api_call_time} sec)")
+    logger.debug(f"multi_event_detection llm_response : {llm_response}")
+
+    # Identifier of the source of the evaluation, with the version of the model if phospho
+    evaluation_source = "phospho-4"
+
+    verdicts = parse_multi_event_detection_response(llm_response, list(events.keys()))
+    event_results: Dict[str, JobResult] = {}
+    for event_name, detected_event in verdicts.items():
+        if detected_event is not None:
+            event_results[event_name] = JobResult(
+                job_id="multi_event_detection",
+                result_type=ResultType.bool,
+                value=detected_event,
+                metadata={
+                    "evaluation_source": evaluation_source,
+                    "source": evaluation_source,
+                },
+            )
+
+    # Fallback: detect the events without a valid verdict one by one
+    fallback_event_names = [
+        event_name for event_name, verdict in verdicts.items() if verdict is None
+    ]
+    if len(fallback_event_names) > 0:
+        logger.info(
+            f"multi_event_detection: no valid verdict for {len(fallback_event_names)} events, detecting them one by one"
+        )
+        fallback_results = await asyncio.gather(
+            *[
+                event_detection(message, event_name, events[event_name], model=model)
+                for event_name in fallback_event_names
+            ]
+        )
+        event_results.update(zip(fallback_event_names, fallback_results))
+
+    return JobResult(
+        job_id="multi_event_detection",
+        result_type=ResultType.dict,
+        value={
+            event_name: event_results[event_name].value for event_name in events.keys()
+        },
+        logs=[prompt, llm_response],
+        metadata={
+            "api_call_time": api_call_time,
+            "evaluation_source": evaluation_source,
+            # Source of the detected events
+            "source": evaluation_source,
+            "cache_hit": cache_hit,
+            # No call to record if the response comes from the cache
+            "llm_call": {
+                "model": model_name,
+                "prompt": prompt,
+                "llm_output": llm_response,
+                "api_call_time": api_call_time,
+                "evaluation_source": evaluation_source,
+            }
+            if not cache_hit
+            else None,
+            "event_results": {
+                event_name: event_results[event_name] for event_name in events.keys()
             },
         },
     )
@@ -293,6 +499,7 @@ async def evaluate_task(
     # Additional metadata
     api_call_time: Optional[float] = None
     llm_call: Optional[dict] = None
+    cache_hit = False
 
     async def zero_shot_evaluation(
         prompt: str,
@@ -304,9 +511,12 @@ async def evaluate_task(
         """
         nonlocal api_call_time
         nonlocal llm_call
+        nonlocal cache_hit
 
         start_time = time.time()
-        response = await async_openai_client.chat.completions.create(
+        llm_response, cache_hit = await async_get_chat_completion_content(
+            async_openai_client,
+            provider,
             model=model_name,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant."},
@@ -314,17 +524,17 @@ async def evaluate_task(
             ],
             temperature=0,
         )
-
-        llm_response = response.choices[0].message.content
         api_call_time = time.time() - start_time
 
-        llm_call = {
-            "model": model_name,
-            "prompt": prompt,
-            "llm_output": llm_response,
-            "api_call_time": api_call_time,
-            "evaluation_source": "phospho-4",
-        }
+        # No call to record if the response comes from the cache
+        if not cache_hit:
+            llm_call = {
+                "model": model_name,
+                "prompt": prompt,
+                "llm_output": llm_response,
+                "api_call_time": api_call_time,
+                "evaluation_source": "phospho-4",
+            }
 
         # Parse the llm response to avoid basic errors
         if llm_response is not None:
@@ -356,10 +566,10 @@ async def evaluate_task(
         We use the most recent examples for the two categories
         (the ones with the smaller index in the list)
         """
-        import cohere
         from cohere.responses.classify import Example
 
-        co = cohere.AsyncClient(config.COHERE_API_KEY, timeout=40)
+        # The client is shared by the jobs, to reuse its connections
+        co = get_cohere_async_client(config.COHERE_API_KEY, timeout=40)
 
         half_few_shot_max = few_shot_max_number_of_examples // 2
         # Truncate the examples to the max number of examples
@@ -402,7 +612,6 @@ async def evaluate_task(
             inputs=inputs,
             examples=examples,
         )
-        await co.close()  # the AsyncClient client should be closed when done
 
         flag = response.classifications[0].prediction
         confidence = response.classifications[0].confidence
@@ -479,6 +688,7 @@ async def evaluate_task(
         logs=[prompt, flag],
         metadata={
             "api_call_time": api_call_time,
+            "cache_hit": cache_hit,
             "llm_call": llm_call,
         },
     )
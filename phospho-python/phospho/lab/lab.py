@@ -1,5 +1,7 @@
 import asyncio
-import concurrent.futures
+import contextlib
+import functools
+import inspect
 import logging
 from typing import (
     Awaitable,
@@ -16,6 +18,7 @@ from typing import (
 
 import phospho.lab.job_library as job_library
 
+from .language_models import get_provider_and_model
 from .models import JobConfig, JobResult, Message, ResultType
 
 logger = logging.getLogger(__name__)
@@ -49,10 +52,14 @@ class Job:
         ] = None,
         name: Optional[str] = None,
         config: Optional[JobConfig] = None,
+        max_parallelism: Optional[int] = None,
     ):
         """
         A job is a function that takes a message and a set of parameters and returns a result.
         It stores the result.
+
+        The job_function can be sync or async. Sync functions are run in a thread pool.
+        max_parallelism is the max number of messages the job runs on at once in a Workload.
         """
 
         if job_function is None and name is None:
@@ -72,6 +79,7 @@ class Job:
                 id = job_function.__name__
 
         self.id = id
+        self.max_parallelism = max_parallelism
 
         # message.id -> job_result
         self.results: Dict[str, JobResult] = {}
@@ -90,6 +98,38 @@ class Job:
         for c in self.alternative_configs:
             self.alternative_results.append({})
 
+    @property
+    def provider(self) -> Optional[str]:
+        """
+        The provider of the language model used by the job, if any. Eg: "openai"
+
+        Read from the `model` of the config, or else the default `model` of the job_function.
+        """
+        model = getattr(self.config, "model", None)
+        if model is None:
+            try:
+                parameter = inspect.signature(self.job_function).parameters.get("model")
+            except (TypeError, ValueError):
+                parameter = None
+            if parameter is not None:
+                model = parameter.default
+        if not isinstance(model, str):
+            return None
+        provider, _ = get_provider_and_model(model)
+        return provider
+
+    async def _call_job_function(self, message: Message, params: dict) -> JobResult:
+        """
+        Call the job_function on the message. Sync functions run in the thread pool of the
+        event loop, so that they don't block the other jobs.
+        """
+        if asyncio.iscoroutinefunction(self.job_function):
+            return await self.job_function(message, **params)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(self.job_function, message, **params)
+        )
+
     async def async_run(self, message: Message) -> JobResult:
         """
         Asynchronously run the job on the message.
@@ -97,10 +137,7 @@ class Job:
         logger.debug(f"Running job {self.id} on message {message.id}.")
         params = self.config.model_dump()
 
-        if asyncio.iscoroutinefunction(self.job_function):
-            result = await self.job_function(message, **params)
-        else:
-            result = self.job_function(message, **params)
+        result = await self._call_job_function(message, params)
 
         if result is None:
             logger.error(f"Job {self.id} returned None for message {message.id}.")
@@ -126,10 +163,7 @@ class Job:
 
         for alternative_config_index in range(0, len(self.alternative_configs)):
             params = self.alternative_configs[alternative_config_index].model_dump()
-            if asyncio.iscoroutinefunction(self.job_function):
-                prediction = await self.job_function(message, **params)
-            else:
-                prediction = self.job_function(message, **params)
+            prediction = await self._call_job_function(message, params)
 
             if prediction is None:
                 logger.error(
@@ -277,41 +311,110 @@ class Workload:
             )
         return cls.from_config(config)
 
+    async def _schedule(
+        self,
+        run_one: Callable[[Job, Message], Awaitable[Any]],
+        messages: List[Message],
+        max_parallelism: int,
+        max_parallelism_per_provider: Optional[Dict[str, int]],
+        progress_callback: Optional[Callable[[int, int], None]],
+    ) -> None:
+        """
+        Run `run_one` on every (job, message) pair concurrently, on the event loop.
+
+        A pair waits for a slot of its job (Job.max_parallelism), then of its provider,
+        then a global slot. If a pair fails or if the run is cancelled, the pairs still
+        running are cancelled. (Sync jobs already running in a thread finish in the background.)
+        """
+        semaphore = asyncio.Semaphore(max_parallelism)
+        provider_semaphores = {
+            provider: asyncio.Semaphore(limit)
+            for provider, limit in (max_parallelism_per_provider or {}).items()
+        }
+        job_semaphores = {
+            job.id: asyncio.Semaphore(job.max_parallelism)
+            for job in self.jobs
+            if job.max_parallelism is not None
+        }
+
+        async def run_with_limits(job: Job, message: Message) -> None:
+            # Wait for the job and provider slots before taking a global slot, so that
+            # saturated jobs and providers don't hold the slots of the others
+            async with contextlib.AsyncExitStack() as stack:
+                for limit in [
+                    job_semaphores.get(job.id),
+                    provider_semaphores.get(job.provider or ""),
+                ]:
+                    if limit is not None:
+                        await stack.enter_async_context(limit)
+                async with semaphore:
+                    await run_one(job, message)
+
+        tasks = [
+            asyncio.ensure_future(run_with_limits(job, one_message))
+            for job in self.jobs
+            for one_message in messages
+        ]
+        nb_done = 0
+        try:
+            for completed in asyncio.as_completed(tasks):
+                await completed
+                nb_done += 1
+                if progress_callback is not None:
+                    progress_callback(nb_done, len(tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
     async def async_run(
         self,
         messages: Iterable[Message],
         executor_type: Literal["parallel", "sequential"] = "parallel",
         max_parallelism: int = 10,
+        max_parallelism_per_provider: Optional[Dict[str, int]] = None,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
     ) -> Dict[str, Dict[str, JobResult]]:
         """
         Runs all the jobs on the message.
 
+        With the "parallel" executor, every (job, message) pair runs concurrently:
+        - at most `max_parallelism` at once
+        - at most `max_parallelism_per_provider[provider]` at once for the jobs calling
+        this provider (eg: {"openai": 5}), to stay under its rate limits.
+        - at most `job.max_parallelism` at once for each job
+
+        progress_callback(nb_done, nb_total) is called every time a (job, message) pair completes.
+
         Returns: a mapping of message.id -> job_id -> job_result
         """
+        # The messages are iterated several times
+        messages = list(messages)
 
-        # Run the jobs sequentially on every message
-        # TODO : Run the jobs in parallel on every message
-        for job in self.jobs:
-            if executor_type == "parallel":
-                # Await all the results
-                semaphore = asyncio.Semaphore(max_parallelism)
-
-                async def job_limit_wrap(url):
-                    async with semaphore:
-                        return await job.async_run(url)
+        if executor_type == "parallel":
 
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    # Submit tasks to the executor
-                    executor_results = executor.map(job_limit_wrap, messages)
+            async def run_one(job: Job, message: Message) -> JobResult:
+                return await job.async_run(message)
 
-                await asyncio.gather(*executor_results)
-            elif executor_type == "sequential":
+            await self._schedule(
+                run_one,
+                messages,
+                max_parallelism=max_parallelism,
+                max_parallelism_per_provider=max_parallelism_per_provider,
+                progress_callback=progress_callback,
+            )
+        elif executor_type == "sequential":
+            nb_done = 0
+            for job in self.jobs:
                 for one_message in messages:
                     await job.async_run(one_message)
-            else:
-                raise NotImplementedError(
-                    f"Executor type {executor_type} is not implemented"
-                )
+                    nb_done += 1
+                    if progress_callback is not None:
+                        progress_callback(nb_done, len(self.jobs) * len(messages))
+        else:
+            raise NotImplementedError(
+                f"Executor type {executor_type} is not implemented"
+            )
 
         # Collect the results:
         # Result is a mapping of message.id -> job_id -> job_result
@@ -328,31 +431,40 @@ class Workload:
         self,
         messages: Iterable[Message],
         executor_type: Literal["parallel", "sequential"] = "parallel",
+        max_parallelism: int = 10,
+        max_parallelism_per_provider: Optional[Dict[str, int]] = None,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
     ) -> None:
         """
-        Runs all the jobs on the message.
-
-        Returns: a mapping of message.id -> job_id -> job_result
+        Runs all the jobs on the message, in all their alternative configurations.
+        The concurrency options are the same as async_run.
         """
+        messages = list(messages)
 
-        # Run the jobs sequentially on every message
-        # TODO : Run the jobs in parallel on every message
-        for job in self.jobs:
-            if executor_type == "parallel":
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    # Submit tasks to the executor
-                    executor_predictions = executor.map(
-                        job.async_run_on_alternative_configurations, messages
-                    )
-                # Await all the results
-                await asyncio.gather(*executor_predictions)
-            elif executor_type == "sequential":
+        if executor_type == "parallel":
+
+            async def run_one(job: Job, message: Message) -> None:
+                await job.async_run_on_alternative_configurations(message)
+
+            await self._schedule(
+                run_one,
+                messages,
+                max_parallelism=max_parallelism,
+                max_parallelism_per_provider=max_parallelism_per_provider,
+                progress_callback=progress_callback,
+            )
+        elif executor_type == "sequential":
+            nb_done = 0
+            for job in self.jobs:
                 for one_message in messages:
                     await job.async_run_on_alternative_configurations(one_message)
-            else:
-                raise NotImplementedError(
-                    f"Executor type {executor_type} is not implemented"
-                )
+                    nb_done += 1
+                    if progress_callback is not None:
+                        progress_callback(nb_done, len(self.jobs) * len(messages))
+        else:
+            raise NotImplementedError(
+                f"Executor type {executor_type} is not implemented"
+            )
 
         # We do not collect the results here, as we want to keep the alternative results
         # They are stored in the job object, in the alternative_results attribute
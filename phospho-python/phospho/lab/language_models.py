@@ -1,11 +1,48 @@
+"""
+Clients of the language model providers.
+
+The clients are created once per process (and per event loop for the async clients)
+and reused by all the jobs, to share their pool of http connections.
+Call `await aclose_clients()` on shutdown.
+"""
+
+import asyncio
 import os
-from typing import Tuple
+import weakref
+from typing import Any, Dict, Optional, Tuple
 
 try:
     from openai import AsyncOpenAI, OpenAI
 except ImportError:
     pass
 
+# provider -> base_url of its OpenAI compatible API (None: the OpenAI API)
+PROVIDER_BASE_URLS: Dict[str, Optional[str]] = {
+    "openai": None,
+    "mistral": "https://api.mistral.ai/v1/",
+    "ollama": "http://localhost:11434/v1/",
+}
+# provider -> environment variable of its API key (None: the OpenAI default)
+PROVIDER_API_KEY_ENV: Dict[str, Optional[str]] = {
+    "openai": None,
+    "mistral": "MISTRAL_API_KEY",
+    "ollama": None,
+}
+
+# Connection pool limits of the clients. None: the defaults of the openai package
+_client_limits: Dict[str, Optional[int]] = {
+    "max_connections": None,
+    "max_keepalive_connections": None,
+}
+
+# (provider, base_url) -> client
+_sync_clients: Dict[Tuple[str, Optional[str]], "OpenAI"] = {}
+# Async clients are bound to the event loop of their connections
+# event loop -> (provider, base_url) -> client
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, Optional[str]], Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+
 
 def get_provider_and_model(model: str) -> Tuple[str, str]:
     """
@@ -24,25 +61,108 @@ def get_provider_and_model(model: str) -> Tuple[str, str]:
     return split_result[0], split_result[1]
 
 
-def get_async_client(provider: str) -> AsyncOpenAI:
-    if provider == "openai":
-        return AsyncOpenAI()
-    if provider == "mistral":
-        return AsyncOpenAI(
-            base_url="https://api.mistral.ai/v1/", api_key=os.getenv("MISTRAL_API_KEY")
-        )
-    if provider == "ollama":
-        return AsyncOpenAI(base_url="http://localhost:11434/v1/")
-    raise NotImplementedError(f"Provider {provider} is not supported.")
-
-
-def get_sync_client(provider: str) -> OpenAI:
-    if provider == "openai":
-        return OpenAI()
-    if provider == "mistral":
-        return OpenAI(
-            base_url="https://api.mistral.ai/v1/", api_key=os.getenv("MISTRAL_API_KEY")
-        )
-    if provider == "ollama":
-        return OpenAI(base_url="http://localhost:11434/v1/")
-    raise NotImplementedError(f"Provider {provider} is not supported.")
+def set_client_limits(
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+) -> None:
+    """
+    Set the connection pool limits of the clients created from now on.
+    """
+    _client_limits["max_connections"] = max_connections
+    _client_limits["max_keepalive_connections"] = max_keepalive_connections
+
+
+def _get_client_kwargs(provider: str, base_url: Optional[str]) -> Dict[str, Any]:
+    if provider not in PROVIDER_BASE_URLS:
+        raise NotImplementedError(f"Provider {provider} is not supported.")
+    kwargs: Dict[str, Any] = {}
+    if base_url is not None:
+        kwargs["base_url"] = base_url
+    api_key_env = PROVIDER_API_KEY_ENV.get(provider)
+    if api_key_env is not None:
+        kwargs["api_key"] = os.getenv(api_key_env)
+    return kwargs
+
+
+def _get_http_limits() -> Optional[Any]:
+    if all(limit is None for limit in _client_limits.values()):
+        return None
+    import httpx
+
+    # httpx.Limits defaults
+    return httpx.Limits(
+        max_connections=_client_limits["max_connections"] or 100,
+        max_keepalive_connections=_client_limits["max_keepalive_connections"] or 20,
+    )
+
+
+def get_async_client(provider: str, base_url: Optional[str] = None) -> "AsyncOpenAI":
+    """
+    Get the async client of the provider, shared by the jobs running on this event loop.
+    """
+    if base_url is None:
+        base_url = PROVIDER_BASE_URLS.get(provider)
+    loop = asyncio.get_running_loop()
+    loop_clients = _async_clients.setdefault(loop, {})
+    client = loop_clients.get((provider, base_url))
+    if client is None:
+        kwargs = _get_client_kwargs(provider, base_url)
+        http_limits = _get_http_limits()
+        if http_limits is not None:
+            import httpx
+
+            kwargs["http_client"] = httpx.AsyncClient(limits=http_limits, timeout=600)
+        client = AsyncOpenAI(**kwargs)
+        loop_clients[(provider, base_url)] = client
+    return client
+
+
+def get_sync_client(provider: str, base_url: Optional[str] = None) -> "OpenAI":
+    """
+    Get the client of the provider, shared by all the jobs of the process.
+    """
+    if base_url is None:
+        base_url = PROVIDER_BASE_URLS.get(provider)
+    client = _sync_clients.get((provider, base_url))
+    if client is None:
+        kwargs = _get_client_kwargs(provider, base_url)
+        http_limits = _get_http_limits()
+        if http_limits is not None:
+            import httpx
+
+            kwargs["http_client"] = httpx.Client(limits=http_limits, timeout=600)
+        client = OpenAI(**kwargs)
+        # setdefault: keep a single client if two threads created one
+        client = _sync_clients.setdefault((provider, base_url), client)
+    return client
+
+
+def get_cohere_async_client(api_key: Optional[str], timeout: int = 40) -> Any:
+    """
+    Get the Cohere async client, shared by the jobs running on this event loop.
+    """
+    import cohere
+
+    loop_clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = loop_clients.get(("cohere", api_key))
+    if client is None:
+        client = cohere.AsyncClient(api_key, timeout=timeout)
+        loop_clients[("cohere", api_key)] = client
+    return client
+
+
+async def aclose_clients() -> None:
+    """
+    Close the clients of the running event loop and the sync clients.
+    """
+    loop_clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        if hasattr(client, "close") and asyncio.iscoroutinefunction(client.close):
+            await client.close()
+    close_sync_clients()
+
+
+def close_sync_clients() -> None:
+    for client in _sync_clients.values():
+        client.close()
+    _sync_clients.clear()
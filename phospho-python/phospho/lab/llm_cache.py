@@ -0,0 +1,321 @@
+"""
+Cache of the LLM responses of the lab jobs.
+
+Calls with the same provider, model, messages and parameters return the same response when
+the temperature is 0. Caching them makes reprocessed tasks, backtests and alternative
+configurations runs almost free.
+
+```python
+from phospho import lab
+
+lab.set_llm_cache(lab.InMemoryLLMCache(max_size=10_000))
+# or, to keep the cache between runs
+lab.set_llm_cache(lab.SQLiteLLMCache("llm_cache.db", ttl=7 * 24 * 3600))
+
+... # Run a workload
+print(lab.get_llm_cache().stats())
+```
+"""
+
+import asyncio
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache:
+    """
+    Base class of the LLM response caches. Subclasses implement _get and _set.
+
+    ttl is the time to live of the responses, in seconds (None: no expiration).
+    By default, only the calls with a temperature of 0 are cached, since the other calls
+    are not deterministic. Set cache_nondeterministic=True to cache all the calls.
+    """
+
+    def __init__(
+        self, ttl: Optional[float] = None, cache_nondeterministic: bool = False
+    ):
+        self.ttl = ttl
+        self.cache_nondeterministic = cache_nondeterministic
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(provider: str, **params: Any) -> str:
+        """Hash of the provider, model, messages and parameters of the call"""
+        content = json.dumps(
+            {"provider": provider, **params}, sort_keys=True, default=str
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def is_cacheable(self, params: Dict[str, Any]) -> bool:
+        return self.cache_nondeterministic or params.get("temperature") == 0
+
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self._set(key, value)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Get without blocking the event loop. Override for caches that do IO."""
+        return self.get(key)
+
+    async def aset(self, key: str, value: str) -> None:
+        self.set(key, value)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+
+class _BlockingLLMCache(LLMCache):
+    """Run the get and set of the caches doing IO in a thread, in async code"""
+
+    async def aget(self, key: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.get, key))
+
+    async def aset(self, key: str, value: str) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(self.set, key, value))
+
+
+class InMemoryLLMCache(LLMCache):
+    """
+    LRU cache in memory, with at most max_size responses.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        ttl: Optional[float] = None,
+        cache_nondeterministic: bool = False,
+    ):
+        super().__init__(ttl=ttl, cache_nondeterministic=cache_nondeterministic)
+        self.max_size = max_size
+        # key -> (value, created_at)
+        self._responses: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            response = self._responses.get(key)
+            if response is None:
+                return None
+            value, created_at = response
+            if self.ttl is not None and time.time() - created_at > self.ttl:
+                del self._responses[key]
+                return None
+            self._responses.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._responses[key] = (value, time.time())
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+
+class SQLiteLLMCache(_BlockingLLMCache):
+    """
+    Cache on disk in a SQLite database, to keep the responses between runs.
+    When there are more than max_size responses, the least recently used are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = "phospho_llm_cache.db",
+        max_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        cache_nondeterministic: bool = False,
+    ):
+        super().__init__(ttl=ttl, cache_nondeterministic=cache_nondeterministic)
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                """CREATE TABLE IF NOT EXISTS llm_responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS llm_responses_last_access ON llm_responses (last_access)"
+            )
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._connection.execute(
+                    "DELETE FROM llm_responses WHERE key = ?", (key,)
+                )
+                return None
+            self._connection.execute(
+                "UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            return value
+
+    def _set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if self.max_size is not None:
+                self._connection.execute(
+                    """DELETE FROM llm_responses WHERE key IN (
+                        SELECT key FROM llm_responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )""",
+                    (self.max_size,),
+                )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM llm_responses"
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class MongoLLMCache(_BlockingLLMCache):
+    """
+    Cache in a MongoDB collection, shared by several processes.
+
+    collection is a pymongo Collection. Expired responses are deleted by a TTL index.
+    The size of the collection is not bounded: set a ttl.
+    """
+
+    def __init__(
+        self,
+        collection: Any,
+        ttl: Optional[float] = None,
+        cache_nondeterministic: bool = False,
+    ):
+        super().__init__(ttl=ttl, cache_nondeterministic=cache_nondeterministic)
+        self.collection = collection
+        if ttl is not None:
+            self.collection.create_index("expire_at", expireAfterSeconds=0)
+
+    def _get(self, key: str) -> Optional[str]:
+        response = self.collection.find_one({"_id": key})
+        if response is None:
+            return None
+        expire_at = response.get("expire_at")
+        # The TTL index deletes the expired responses only every minute
+        if expire_at is not None and expire_at.replace(
+            tzinfo=datetime.timezone.utc
+        ) < datetime.datetime.now(datetime.timezone.utc):
+            return None
+        return response["value"]
+
+    def _set(self, key: str, value: str) -> None:
+        response: Dict[str, Any] = {"value": value}
+        if self.ttl is not None:
+            response["expire_at"] = datetime.datetime.now(
+                datetime.timezone.utc
+            ) + datetime.timedelta(seconds=self.ttl)
+        self.collection.update_one({"_id": key}, {"$set": response}, upsert=True)
+
+
+_llm_cache: Optional[LLMCache] = None
+
+
+def set_llm_cache(llm_cache: Optional[LLMCache]) -> None:
+    """Set the cache used by the jobs of the lab. None disables the cache."""
+    global _llm_cache
+    _llm_cache = llm_cache
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    return _llm_cache
+
+
+def get_chat_completion_content(
+    client: Any, provider: str, **params: Any
+) -> Tuple[Optional[str], bool]:
+    """
+    Call client.chat.completions.create(**params) and return the content of the response,
+    from the cache if possible.
+    Returns (content, cache_hit). No call was made to the provider if cache_hit.
+    """
+    llm_cache = _llm_cache
+    if llm_cache is None or not llm_cache.is_cacheable(params):
+        response = client.chat.completions.create(**params)
+        return response.choices[0].message.content, False
+
+    key = llm_cache.key(provider, **params)
+    content = llm_cache.get(key)
+    if content is not None:
+        return content, True
+    response = client.chat.completions.create(**params)
+    content = response.choices[0].message.content
+    if content is not None:
+        llm_cache.set(key, content)
+    return content, False
+
+
+async def async_get_chat_completion_content(
+    async_client: Any, provider: str, **params: Any
+) -> Tuple[Optional[str], bool]:
+    """
+    Call async_client.chat.completions.create(**params) and return the content of the
+    response, from the cache if possible.
+    Returns (content, cache_hit). No call was made to the provider if cache_hit.
+    """
+    llm_cache = _llm_cache
+    if llm_cache is None or not llm_cache.is_cacheable(params):
+        response = await async_client.chat.completions.create(**params)
+        return response.choices[0].message.content, False
+
+    key = llm_cache.key(provider, **params)
+    content = await llm_cache.aget(key)
+    if content is not None:
+        return content, True
+    response = await async_client.chat.completions.create(**params)
+    content = response.choices[0].message.content
+    if content is not None:
+        await llm_cache.aset(key, content)
+    return content, False
@@ -95,6 +95,7 @@ class ResultType(Enum):
     error = "error"
     bool = "bool"
     literal = "literal"
+    dict = "dict"
 
 
 class JobResult(BaseModel, extra="allow"):
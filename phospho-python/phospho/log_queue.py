@@ -1,31 +1,260 @@
+import logging
 import threading
+import time
 import pydantic
-from typing import Dict, List
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
 
-from .utils import generate_uuid
+from .extractor import extract_data_from_output, extract_metadata_from_input_output
+from .serialization import get_json_dumps
+from .utils import convert_content_to_loggable_content, generate_uuid
+
+logger = logging.getLogger(__name__)
+
+# What to do when an event is pushed to a full queue
+OverflowPolicy = Literal["drop_oldest", "drop_newest", "block"]
+
+
+class StreamAccumulator:
+    """
+    Accumulates the chunks of a streamed output into the content of an event.
+
+    The chunks are stored as received. They are converted to loggable content, and the
+    usage metadata is extracted from them, once, when the stream ends or when the event
+    is flushed. The output strings are then joined, and the raw outputs are appended in
+    place to the raw_output list of the content.
+    """
+
+    def __init__(self, content: Dict[str, object]) -> None:
+        self.content = content
+        # (input, output, raw_output, output_to_str_function, input_output_to_usage_function)
+        self.chunks: List[Tuple[Any, Any, Any, Any, Any]] = []
+        self.output_chunks: List[str] = []
+        if content.get("output") is not None:
+            self.output_chunks.append(str(content["output"]))
+        self.raw_output: Optional[List[object]] = None
+        if content.get("raw_output") is not None:
+            self._append_raw_output(content["raw_output"])
+
+    def _append_raw_output(self, raw_output: object) -> None:
+        if self.raw_output is None:
+            self.raw_output = []
+            self.content["raw_output"] = self.raw_output
+        if isinstance(raw_output, list):
+            self.raw_output.extend(raw_output)
+        else:
+            self.raw_output.append(raw_output)
+
+    def append(
+        self,
+        input: Any,
+        output: Any = None,
+        raw_output: Any = None,
+        output_to_str_function: Optional[Callable[[Any], str]] = None,
+        input_output_to_usage_function: Optional[
+            Callable[[Any, Any], Dict[str, float]]
+        ] = None,
+    ) -> None:
+        """Store a chunk of the stream, without processing it"""
+        self.chunks.append(
+            (
+                input,
+                output,
+                raw_output,
+                output_to_str_function,
+                input_output_to_usage_function,
+            )
+        )
+
+    def _process_chunks(self) -> None:
+        for (
+            input,
+            output,
+            raw_output,
+            output_to_str_function,
+            input_output_to_usage_function,
+        ) in self.chunks:
+            output = convert_content_to_loggable_content(output)
+            raw_output = convert_content_to_loggable_content(raw_output)
+            output_to_log, raw_output_to_log = extract_data_from_output(
+                output=output,
+                raw_output=raw_output,
+                output_to_str_function=output_to_str_function,
+            )
+            metadata_to_log = extract_metadata_from_input_output(
+                input=input,
+                output=output,
+                input_output_to_usage_function=input_output_to_usage_function,
+            )
+            if output_to_log is not None:
+                self.output_chunks.append(str(output_to_log))
+            if raw_output_to_log is not None:
+                self._append_raw_output(raw_output_to_log)
+            # Usage metrics are summed over the chunks
+            for key in ["completion_tokens", "total_tokens"]:
+                if key in metadata_to_log:
+                    self.content[key] = metadata_to_log.pop(key) + self.content.get(
+                        key, 0
+                    )
+            self.content.update(metadata_to_log)
+            self.content["raw_output_type_name"] = type(output).__name__
+        self.chunks = []
+
+    def close(self) -> None:
+        """Process the stored chunks and join the output chunks into the content"""
+        self._process_chunks()
+        if len(self.output_chunks) > 0:
+            self.content["output"] = "".join(self.output_chunks)
+        self.output_chunks = []
 
 
 class Event(pydantic.BaseModel, extra="allow"):
     id: str
     content: Dict[str, object]
     to_log: bool = True
+    # Set while the output of the event is streamed
+    _stream: Optional[StreamAccumulator] = pydantic.PrivateAttr(default=None)
+
+    def stream(self) -> StreamAccumulator:
+        """Get the accumulator of the streamed output of the event"""
+        if self._stream is None:
+            self._stream = StreamAccumulator(self.content)
+        return self._stream
+
+    def close_stream(self) -> None:
+        """Merge the streamed output into the content of the event"""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+def split_batch(
+    batch: List[Dict[str, object]],
+    max_batch_events: Optional[int] = None,
+    max_batch_bytes: Optional[int] = None,
+    json_dumps: Optional[Callable[[Any], bytes]] = None,
+) -> List[List[Dict[str, object]]]:
+    """
+    Split a batch of events content into several batches, each of them with at most
+    max_batch_events events and at most max_batch_bytes bytes (json encoded).
+    An event bigger than max_batch_bytes is sent alone in its batch.
+
+    The sizes are measured with json_dumps: pass the serializer of the Client, which
+    encodes the batches anyway. Defaults to the fastest installed serializer.
+    """
+    if len(batch) == 0:
+        return []
+    if max_batch_events is None and max_batch_bytes is None:
+        return [batch]
+    if max_batch_bytes is not None and json_dumps is None:
+        json_dumps = get_json_dumps()
+
+    batches: List[List[Dict[str, object]]] = []
+    current_batch: List[Dict[str, object]] = []
+    current_batch_bytes = 0
+    for event_content in batch:
+        event_bytes = 0
+        if max_batch_bytes is not None:
+            event_bytes = len(json_dumps(event_content))  # type: ignore
+        if len(current_batch) > 0 and (
+            (max_batch_events is not None and len(current_batch) >= max_batch_events)
+            or (
+                max_batch_bytes is not None
+                and current_batch_bytes + event_bytes > max_batch_bytes
+            )
+        ):
+            batches.append(current_batch)
+            current_batch = []
+            current_batch_bytes = 0
+        current_batch.append(event_content)
+        current_batch_bytes += event_bytes
+    batches.append(current_batch)
+    return batches
 
 
 class LogQueue:
     """Queue logs here to group them in batchs"""
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        overflow_policy: OverflowPolicy = "drop_oldest",
+        block_timeout: float = 1.0,
+    ) -> None:
+        """
+        :param max_size: maximum number of events in the queue. None means unbounded.
+        :param overflow_policy: what to do when an event is pushed to a full queue.
+            "drop_oldest" drops the oldest event of the queue, "drop_newest" drops the
+            pushed event, "block" waits up to block_timeout seconds for the consumer to
+            make room, then drops the pushed event.
+        :param block_timeout: maximum waiting time (in seconds) with the "block" policy
+        """
         self.lock = threading.Lock()
+        # Notified when the queue is drained
+        self.not_full = threading.Condition(self.lock)
         # The queue itself is a dictionary. Each event has a unique id.
         self.events: Dict[str, Event] = {}
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        # Number of events dropped because the queue was full
+        self.nb_dropped_events = 0
+
+    def _is_full(self) -> bool:
+        return self.max_size is not None and len(self.events) >= self.max_size
+
+    def _drop(self, nb_events: int, oldest: bool) -> None:
+        """Drop nb_events events from the queue, starting with the oldest or newest ones."""
+        if nb_events <= 0:
+            return
+        event_ids = list(self.events.keys())
+        if oldest:
+            event_ids_to_drop = event_ids[:nb_events]
+        else:
+            event_ids_to_drop = event_ids[-nb_events:]
+        for event_id in event_ids_to_drop:
+            del self.events[event_id]
+        self.nb_dropped_events += len(event_ids_to_drop)
+        logger.warning(
+            f"phospho log queue is full (max_size={self.max_size}): dropped {len(event_ids_to_drop)} events"
+        )
+
+    def _make_room(self, event_id: str) -> bool:
+        """
+        Apply the overflow policy before pushing a new event.
+        Must be called with the lock held. Returns False if the event should be dropped.
+        """
+        if event_id in self.events or not self._is_full():
+            # Updating an existing event doesn't grow the queue
+            return True
+        if self.overflow_policy == "drop_oldest":
+            self._drop(len(self.events) - self.max_size + 1, oldest=True)
+            return True
+        if self.overflow_policy == "block":
+            deadline = time.monotonic() + self.block_timeout
+            while self._is_full():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.not_full.wait(remaining)
+            if not self._is_full():
+                return True
+        # drop_newest, or block timed out
+        self.nb_dropped_events += 1
+        logger.warning(
+            f"phospho log queue is full (max_size={self.max_size}): dropped event {event_id}"
+        )
+        return False
 
     def append(self, event: Event) -> None:
         with self.lock:
-            self.events[event.id] = event
+            if self._make_room(event.id):
+                self.events[event.id] = event
 
     def extend(self, events_queue: Dict[str, Event]) -> None:
         with self.lock:
-            self.events.update(events_queue)
+            for event_id, event in events_queue.items():
+                if self._make_room(event_id):
+                    self.events[event_id] = event
 
     def add_batch(self, events_content_list: List[Dict[str, object]]) -> None:
         """This is used to add back events to the log queue, eg when they
@@ -45,19 +274,45 @@ class LogQueue:
                 )
                 for event_content in events_content_list
             }
-            self.events.update(new_events)
+            # These events are older than the ones in queue: put them first
+            new_events.update(self.events)
+            self.events = new_events
+            # Never block here, as this is called by the consumer
+            if self.max_size is not None and len(self.events) > self.max_size:
+                self._drop(
+                    len(self.events) - self.max_size,
+                    oldest=self.overflow_policy == "drop_oldest",
+                )
 
     def get_batch(self) -> List[Dict[str, object]]:
         if self.lock.acquire(False):  # non-blocking
             try:
                 # The batch is only made of events marked as to_log
-                events_to_log = filter(lambda e: e.to_log, self.events.values())
+                events_to_log = [e for e in self.events.values() if e.to_log]
                 # Events not marked as to_log will stay in queue
                 self.events = dict(
                     filter(lambda pair: not pair[1].to_log, self.events.items())
                 )
+                # Wake up the producers waiting for room in the queue
+                self.not_full.notify_all()
+                for e in events_to_log:
+                    e.close_stream()
                 return [e.content for e in events_to_log]
             finally:
                 self.lock.release()
         else:
             return []
+
+    def get_batches(
+        self,
+        max_batch_events: Optional[int] = None,
+        max_batch_bytes: Optional[int] = None,
+        json_dumps: Optional[Callable[[Any], bytes]] = None,
+    ) -> List[List[Dict[str, object]]]:
+        """Drain the queue like get_batch, split into bounded batches (see split_batch)."""
+        return split_batch(
+            self.get_batch(),
+            max_batch_events=max_batch_events,
+            max_batch_bytes=max_batch_bytes,
+            json_dumps=json_dumps,
+        )
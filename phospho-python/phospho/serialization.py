@@ -0,0 +1,61 @@
+"""
+json serialization of the payloads sent to the phospho backend.
+
+orjson or msgspec are used when installed (`pip install phospho[fast]`), with a
+fallback to the standard library.
+"""
+
+import json
+from typing import Any, Callable, Literal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None  # type: ignore
+
+Serializer = Literal["auto", "orjson", "msgspec", "json"]
+
+
+def _orjson_dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _msgspec_dumps(content: Any) -> bytes:
+    return msgspec.json.encode(content)
+
+
+def _json_dumps(content: Any) -> bytes:
+    return json.dumps(content, allow_nan=False).encode()
+
+
+def get_json_dumps(serializer: Serializer = "auto") -> Callable[[Any], bytes]:
+    """
+    Get a function serializing content to json bytes.
+    serializer is "orjson", "msgspec", "json" or "auto" (the fastest installed one).
+    """
+    if serializer == "auto":
+        if orjson is not None:
+            return _orjson_dumps
+        if msgspec is not None:
+            return _msgspec_dumps
+        return _json_dumps
+    if serializer == "orjson":
+        if orjson is None:
+            raise ImportError(
+                "Please install the `orjson` package to use it as serializer: `pip install phospho[fast]`"
+            )
+        return _orjson_dumps
+    if serializer == "msgspec":
+        if msgspec is None:
+            raise ImportError(
+                "Please install the `msgspec` package to use it as serializer."
+            )
+        return _msgspec_dumps
+    if serializer == "json":
+        return _json_dumps
+    raise NotImplementedError(f"Serializer {serializer} is not supported.")
@@ -0,0 +1,193 @@
+"""
+Durable on-disk queue for log events, used by the consumer to survive crashes and
+long outages of the phospho backend.
+
+Every tick, the consumer writes the events drained from the log_queue to a new
+append-only segment file (json lines) and fsyncs it once. Segments are then sent
+oldest first, and deleted once they were successfully posted. Segments left on disk
+by a previous process are sent on restart. This gives at-least-once delivery
+(the backend ignores tasks it already stored) with a bounded memory usage: segments
+are read one at a time when they are sent.
+
+The spill is not a write-ahead log: events are written to disk at the next tick, so the
+events logged during the last tick (at most `tick` seconds) are lost if the process crashes.
+
+Forked worker processes spill to worker directories of the spill_dir (see
+claim_worker_dir). A worker directory is locked as long as its worker runs: when a worker
+dies, the next worker that starts adopts its directory and sends the segments left in it.
+"""
+
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import IO, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".jsonl"
+WORKER_DIR_PREFIX = "worker-"
+
+
+def claim_worker_dir(spill_dir: str) -> Tuple[str, IO]:
+    """
+    Claim the first worker directory of spill_dir (worker-0, worker-1...) that no running
+    process holds, with the segments a dead worker may have left in it.
+
+    The directory is held with a lock (flock) as long as the returned lock file is open.
+    Keep it open for the lifetime of the process: the lock is released when it exits.
+    """
+    if fcntl is None:
+        raise NotImplementedError("Worker spill directories require a POSIX system.")
+    for slot in itertools.count():
+        worker_dir = os.path.join(spill_dir, f"{WORKER_DIR_PREFIX}{slot}")
+        os.makedirs(worker_dir, exist_ok=True)
+        lock_file = open(os.path.join(worker_dir, ".lock"), "w")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Held by a running worker
+            lock_file.close()
+            continue
+        return worker_dir, lock_file
+    raise AssertionError("unreachable")
+
+
+class SpillQueue:
+    """Append-only segment files in a directory"""
+
+    def __init__(
+        self,
+        spill_dir: str,
+        max_spill_bytes: Optional[int] = 1024 * 1024 * 1024,
+        fsync: bool = True,
+    ) -> None:
+        """
+        :param spill_dir: directory where segments are stored. It must not be shared by
+            several processes running at the same time.
+        :param max_spill_bytes: maximum size of the segments on disk. When reached,
+            the oldest segments are dropped. None means unbounded.
+        :param fsync: whether to fsync segments once written
+        """
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        # Used to order the segments written during the same nanosecond
+        self._counter = itertools.count()
+        # Number of events dropped because the spill was full
+        self.nb_dropped_events = 0
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def _new_segment_path(self) -> str:
+        name = f"{time.time_ns():020d}-{next(self._counter):06d}-{os.getpid()}"
+        return os.path.join(self.spill_dir, name + SEGMENT_SUFFIX)
+
+    def _write(self, path: str, events_content: List[Dict[str, object]]) -> None:
+        """Write the events to path atomically, and fsync them if enabled."""
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for event_content in events_content:
+                    f.write(json.dumps(event_content, default=str))
+                    f.write("\n")
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except OSError:
+            # eg. the disk is full: don't leave a partial file behind
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def append(self, events_content: List[Dict[str, object]]) -> Optional[str]:
+        """Write the events to a new segment. Returns the path of the segment."""
+        if len(events_content) == 0:
+            return None
+        with self.lock:
+            path = self._new_segment_path()
+            self._write(path, events_content)
+            self._enforce_max_spill_bytes()
+        return path
+
+    def segments(self) -> List[str]:
+        """Return the paths of the segments on disk, oldest first."""
+        return [
+            os.path.join(self.spill_dir, name)
+            for name in sorted(os.listdir(self.spill_dir))
+            if name.endswith(SEGMENT_SUFFIX)
+        ]
+
+    def read(self, path: str) -> List[Dict[str, object]]:
+        """Read the events of a segment. Lines that can't be decoded are skipped."""
+        events_content: List[Dict[str, object]] = []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        events_content.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Can happen if the process was killed while writing
+                        logger.warning(f"Skipping a corrupted log event in {path}")
+        except FileNotFoundError:
+            pass
+        return events_content
+
+    def rewrite(self, path: str, events_content: List[Dict[str, object]]) -> None:
+        """Replace the content of a segment, eg with the events that couldn't be sent."""
+        with self.lock:
+            if len(events_content) == 0:
+                self.remove(path)
+            else:
+                self._write(path, events_content)
+
+    def remove(self, path: str) -> None:
+        """Delete a segment, once its events were successfully sent."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def size(self) -> int:
+        """Total size of the segments on disk, in bytes"""
+        total_size = 0
+        for path in self.segments():
+            try:
+                total_size += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return total_size
+
+    def _enforce_max_spill_bytes(self) -> None:
+        if self.max_spill_bytes is None:
+            return
+        segments = self.segments()
+        total_size = self.size()
+        # Always keep the latest segment
+        for path in segments[:-1]:
+            if total_size <= self.max_spill_bytes:
+                break
+            try:
+                segment_size = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            nb_events = len(self.read(path))
+            self.remove(path)
+            total_size -= segment_size
+            self.nb_dropped_events += nb_events
+            logger.warning(
+                f"phospho spill is full (max_spill_bytes={self.max_spill_bytes}): dropped {nb_events} events"
+            )
@@ -1,6 +1,6 @@
 from phospho.collection import Collection
 
-from typing import Dict, Literal, Optional, List, Union
+from typing import Dict, Iterator, Literal, Optional, List, Union
 from phospho.models import TaskModel
 
 
@@ -115,15 +115,24 @@ class TaskCollection(Collection):
 
         return Task(self._client, response.json()["id"])
 
-    def get_all(self) -> List[Task]:
-        """Returns a list of all of the project tasks"""
-        # TODO : Filters
-        # TODO : Limit
+    def get_all(self, page_size: int = 1000) -> Iterator[Task]:
+        """
+        Iterate over all the tasks of the project, newest first.
 
-        response = self._client._get(
-            f"/projects/{self._client._project_id()}/tasks",
-        )
-        return [
-            Task(client=self._client, task_id=task["id"], _content=task)
-            for task in response.json()["tasks"]
-        ]
+        The tasks are fetched lazily, page_size at a time: use list() to get them all at once.
+        """
+        cursor: Optional[str] = None
+        while True:
+            params = {"limit": str(page_size)}
+            if cursor is not None:
+                params["cursor"] = cursor
+            response = self._client._get(
+                f"/projects/{self._client._project_id()}/tasks", params=params
+            )
+            content = response.json()
+            for task in content["tasks"]:
+                yield Task(client=self._client, task_id=task["id"], _content=task)
+            # Servers without pagination return all the tasks and no cursor
+            cursor = content.get("next_cursor")
+            if cursor is None:
+                return
@@ -202,7 +202,7 @@ class BacktestLoader:
         # Pull the logs from phospho
         # TODO : Add time range filter
         # TODO : Add pull from dataset
-        tasks = client.tasks.get_all()
+        tasks = list(client.tasks.get_all())
         if len(tasks) == 0:
             raise ValueError("No tasks found in the project")
 
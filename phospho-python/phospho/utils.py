@@ -1,8 +1,10 @@
+import dataclasses
 import time
 import json
 import uuid
 import logging
 import pydantic
+from pydantic import v1 as pydantic_v1
 
 from typing import Any, Dict, AsyncGenerator, Generator, Callable, Union
 
@@ -18,12 +20,22 @@ def generate_uuid() -> str:
     return uuid.uuid4().hex
 
 
+# Types that json.dumps serializes natively, as values and as dict keys
+_JSON_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
 def is_jsonable(x: Any) -> bool:
-    try:
-        json.dumps(x)
+    """Whether x can be serialized with json.dumps. Walks x instead of serializing it."""
+    if isinstance(x, _JSON_SCALAR_TYPES):
         return True
-    except TypeError:
-        return False
+    if isinstance(x, dict):
+        return all(
+            isinstance(key, _JSON_SCALAR_TYPES) and is_jsonable(value)
+            for key, value in x.items()
+        )
+    if isinstance(x, (list, tuple)):
+        return all(is_jsonable(value) for value in x)
+    return False
 
 
 def filter_nonjsonable_keys(arg_dict: dict, verbose: bool = False) -> Dict[str, object]:
@@ -44,37 +56,104 @@ def filter_nonjsonable_keys(arg_dict: dict, verbose: bool = False) -> Dict[str,
     return new_arg_dict
 
 
+def _convert_scalar(content: Any) -> Any:
+    return content
+
+
+def _convert_dict(content: dict) -> dict:
+    new_content = {}
+    is_converted = False
+    for key, value in content.items():
+        new_value = convert_content_to_loggable_content(value)
+        if not isinstance(key, _JSON_SCALAR_TYPES):
+            key = str(key)
+            is_converted = True
+        is_converted = is_converted or (new_value is not value)
+        new_content[key] = new_value
+    # Don't copy dicts that are already json serializable
+    return new_content if is_converted else content
+
+
+def _convert_list(content: list) -> Union[list, str]:
+    new_content = [convert_content_to_loggable_content(x) for x in content]
+    if all(new_x is x for new_x, x in zip(new_content, content)):
+        return content
+    # Special case for list
+    return str(new_content)
+
+
+def _convert_tuple(content: tuple) -> Union[tuple, str]:
+    if all(convert_content_to_loggable_content(x) is x for x in content):
+        return content
+    return str(content)
+
+
+def _convert_pydantic_model(content: pydantic.BaseModel) -> Any:
+    try:
+        return content.model_dump(mode="json")
+    except Exception:
+        # Fields that pydantic can't serialize
+        return convert_content_to_loggable_content(content.model_dump())
+
+
+def _convert_pydantic_v1_model(content: pydantic_v1.BaseModel) -> Any:
+    return convert_content_to_loggable_content(content.dict())
+
+
+def _convert_dataclass(content: Any) -> Any:
+    return convert_content_to_loggable_content(dataclasses.asdict(content))
+
+
+def _convert_bytes(content: bytes) -> Any:
+    # Probably a byte representation of json
+    return json.loads(content.decode())
+
+
+def _convert_to_str(content: Any) -> str:
+    # Fallback to str
+    logger.debug(f"Unknwon type {type(content)} for content {content}. Fallback to str.")
+    return str(content)
+
+
+def _find_converter(content_type: type) -> Callable[[Any], Any]:
+    if issubclass(content_type, _JSON_SCALAR_TYPES):
+        return _convert_scalar
+    if issubclass(content_type, dict):
+        return _convert_dict
+    if issubclass(content_type, list):
+        return _convert_list
+    if issubclass(content_type, tuple):
+        return _convert_tuple
+    if issubclass(content_type, pydantic.BaseModel):
+        return _convert_pydantic_model
+    if issubclass(content_type, pydantic_v1.BaseModel):
+        return _convert_pydantic_v1_model
+    if dataclasses.is_dataclass(content_type):
+        return _convert_dataclass
+    if issubclass(content_type, bytes):
+        return _convert_bytes
+    return _convert_to_str
+
+
+# Converter of every type met so far
+_converters: Dict[type, Callable[[Any], Any]] = {}
+
+
 def convert_content_to_loggable_content(
     content: Any
 ) -> Union[Dict[str, object], str, None]:
     """
     Convert objects to json serializable content. Notably, nested dicts and lists are converted.
-    """
-    if is_jsonable(content):
-        return content
 
-    if isinstance(content, dict):
-        new_content = {
-            key: convert_content_to_loggable_content(value)
-            for key, value in content.items()
-        }
-        return new_content
-    elif isinstance(content, list):
-        # Special case for list
-        return str([convert_content_to_loggable_content(x) for x in content])
-    elif isinstance(content, pydantic.BaseModel):
-        return content.model_dump()
-    elif isinstance(content, pydantic.v1.BaseModel):
-        return content.dict()
-    elif isinstance(content, bytes):
-        # Probably a byte representation of json
-        return json.loads(content.decode())
-    else:
-        # Fallback to str
-        logger.debug(
-            f"Unknwon type {type(content)} for content {content}. Fallback to str."
-        )
-        return str(content)
+    The content is walked only once. Content that is already json serializable is returned
+    as is, without being copied.
+    """
+    content_type = type(content)
+    converter = _converters.get(content_type)
+    if converter is None:
+        converter = _find_converter(content_type)
+        _converters[content_type] = converter
+    return converter(content)
 
 
 class MutableGenerator:
@@ -123,3 +123,268 @@ async def test_evaluation():
 
     await workload.async_run(messages=messages, executor_type="parallel")
     assert len(workload.results) == 1
+
+
+@pytest.mark.asyncio
+async def test_workload_parallel_limits():
+    import asyncio
+
+    running = {"total": 0, "mistral": 0, "max_total": 0, "max_mistral": 0}
+
+    async def fake_llm_job(
+        message: lab.Message, model: str = "openai:gpt-3.5-turbo", **kwargs
+    ) -> lab.JobResult:
+        provider = model.split(":")[0]
+        running["total"] += 1
+        running[provider] = running.get(provider, 0) + 1
+        running["max_total"] = max(running["max_total"], running["total"])
+        running["max_mistral"] = max(running["max_mistral"], running["mistral"])
+        await asyncio.sleep(0.01)
+        running["total"] -= 1
+        running[provider] -= 1
+        return lab.JobResult(
+            job_id="fake_llm_job", result_type=lab.ResultType.bool, value=True
+        )
+
+    class MistralConfig(lab.JobConfig):
+        model: str = "mistral:mistral-small"
+
+    workload = lab.Workload()
+    for i in range(4):
+        workload.add_job(lab.Job(id=f"openai_{i}", job_function=fake_llm_job))
+        workload.add_job(
+            lab.Job(id=f"mistral_{i}", job_function=fake_llm_job, config=MistralConfig())
+        )
+    assert workload.jobs[0].provider == "openai"
+    assert workload.jobs[1].provider == "mistral"
+
+    messages = [lab.Message(content=f"message {i}") for i in range(5)]
+    results = await workload.async_run(
+        messages=(message for message in messages),
+        executor_type="parallel",
+        max_parallelism=6,
+        max_parallelism_per_provider={"mistral": 2},
+    )
+    assert len(results) == 5
+    assert all(len(message_results) == 8 for message_results in results.values())
+    # The (job, message) pairs ran concurrently, within the limits
+    assert running["max_total"] == 6
+    assert running["max_mistral"] == 2
+
+
+@pytest.mark.asyncio
+async def test_workload_scheduler():
+    import asyncio
+    import threading
+    import time
+
+    running = {"slow": 0, "max_slow": 0}
+    threads = set()
+
+    def sync_job(message: lab.Message, **kwargs) -> lab.JobResult:
+        threads.add(threading.get_ident())
+        time.sleep(0.01)
+        return lab.JobResult(
+            job_id="sync_job", result_type=lab.ResultType.literal, value=message.content
+        )
+
+    async def slow_job(message: lab.Message, **kwargs) -> lab.JobResult:
+        running["slow"] += 1
+        running["max_slow"] = max(running["max_slow"], running["slow"])
+        await asyncio.sleep(0.01)
+        running["slow"] -= 1
+        return lab.JobResult(
+            job_id="slow_job", result_type=lab.ResultType.bool, value=True
+        )
+
+    workload = lab.Workload()
+    workload.add_job(lab.Job(job_function=sync_job))
+    workload.add_job(lab.Job(job_function=slow_job, max_parallelism=3))
+
+    messages = [lab.Message(content=f"message {i}") for i in range(20)]
+    progress = []
+    start = time.perf_counter()
+    results = await workload.async_run(
+        messages=messages,
+        max_parallelism=20,
+        progress_callback=lambda nb_done, nb_total: progress.append(
+            (nb_done, nb_total)
+        ),
+    )
+    # Sync jobs ran in threads, concurrently with the async jobs
+    assert threading.get_ident() not in threads
+    assert time.perf_counter() - start < 20 * 0.01 + 0.1
+    assert results[messages[3].id]["sync_job"].value == "message 3"
+    assert running["max_slow"] == 3
+    assert progress[-1] == (40, 40)
+    assert [nb_done for nb_done, _ in progress] == list(range(1, 41))
+
+    # A failing job cancels the jobs still running
+    cancelled = []
+
+    async def failing_job(message: lab.Message, **kwargs) -> lab.JobResult:
+        if message.content == "message 0":
+            raise ValueError("Job failed")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(message.id)
+            raise
+        return lab.JobResult(
+            job_id="failing_job", result_type=lab.ResultType.bool, value=True
+        )
+
+    workload = lab.Workload()
+    workload.add_job(lab.Job(job_function=failing_job))
+    with pytest.raises(ValueError):
+        await workload.async_run(messages=messages, max_parallelism=5)
+    # Only the jobs that had a slot were started
+    assert 0 < len(cancelled) <= 5
+
+
+@pytest.mark.asyncio
+async def test_multi_event_detection(monkeypatch):
+    from types import SimpleNamespace
+
+    prompts = []
+
+    class FakeCompletions:
+        async def create(self, model, messages, max_tokens, **kwargs):
+            prompt = messages[-1]["content"]
+            prompts.append(prompt)
+            if max_tokens == 1:
+                # Per event detection
+                content = "True"
+            else:
+                content = '```json\n{"Greetings": true, "complaint": "false", "Product question": "maybe"}\n```'
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+            )
+
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    monkeypatch.setattr(
+        lab.job_library, "get_async_client", lambda provider: fake_client
+    )
+
+    events = {
+        "Greetings": "The user says hello",
+        "Complaint": "The user complains about the product",
+        "Product question": "The user asks a question about a product",
+        "Refund": "The user asks for a refund",
+    }
+    result = await lab.job_library.multi_event_detection(
+        lab.Message(role="User", content="Hello! Is this product any good?"),
+        events=events,
+    )
+    assert result.result_type == lab.ResultType.dict
+    assert result.value == {
+        "Greetings": True,
+        "Complaint": False,
+        "Product question": True,
+        "Refund": True,
+    }
+    # One call for all the events, then one per event without a valid verdict
+    assert len(prompts) == 3
+    event_results = result.metadata["event_results"]
+    assert event_results["Greetings"].job_id == "multi_event_detection"
+    assert event_results["Refund"].job_id == "event_detection"
+    assert "llm_call" in event_results["Refund"].metadata
+    # The source of the detected events is stored by the extractor
+    for event_result in event_results.values():
+        assert event_result.metadata["source"] == "phospho-4"
+
+
+@pytest.mark.asyncio
+async def test_llm_cache(monkeypatch, tmp_path):
+    import time
+    from types import SimpleNamespace
+
+    calls = []
+
+    class FakeCompletions:
+        async def create(self, model, messages, **kwargs):
+            calls.append(messages[-1]["content"])
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content="True"))]
+            )
+
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    monkeypatch.setattr(
+        lab.job_library, "get_async_client", lambda provider: fake_client
+    )
+
+    message = lab.Message(role="User", content="Hello!")
+    for llm_cache in [
+        lab.InMemoryLLMCache(max_size=2),
+        lab.SQLiteLLMCache(str(tmp_path / "llm_cache.db"), max_size=2),
+    ]:
+        calls.clear()
+        lab.set_llm_cache(llm_cache)
+        try:
+            for i in range(3):
+                result = await lab.job_library.event_detection(
+                    message, event_name="Greetings", event_description="Hello"
+                )
+                assert result.value is True
+                # Only the calls to the provider are recorded
+                assert result.metadata["cache_hit"] is (i > 0)
+                assert (result.metadata["llm_call"] is None) is (i > 0)
+            # The first call is cached
+            assert len(calls) == 1
+            assert llm_cache.stats() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3}
+
+            # Least recently used responses are evicted
+            for event_name in ["Complaint", "Refund"]:
+                await lab.job_library.event_detection(
+                    message, event_name=event_name, event_description="Hello"
+                )
+            assert len(llm_cache) == 2
+            await lab.job_library.event_detection(
+                message, event_name="Greetings", event_description="Hello"
+            )
+            assert len(calls) == 4
+        finally:
+            lab.set_llm_cache(None)
+
+    # Responses expire after the ttl
+    llm_cache = lab.InMemoryLLMCache(ttl=0.01)
+    llm_cache.set("key", "value")
+    assert llm_cache.get("key") == "value"
+    time.sleep(0.02)
+    assert llm_cache.get("key") is None
+
+
+def test_client_registry(monkeypatch):
+    import asyncio
+
+    from phospho.lab import language_models
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("MISTRAL_API_KEY", "test-mistral")
+
+    async def get_clients():
+        openai_client = language_models.get_async_client("openai")
+        # The client is reused
+        assert language_models.get_async_client("openai") is openai_client
+        mistral_client = language_models.get_async_client("mistral")
+        assert mistral_client is not openai_client
+        assert mistral_client.api_key == "test-mistral"
+        return openai_client
+
+    async def run_and_close():
+        client = await get_clients()
+        await lab.aclose_clients()
+        return client
+
+    first_loop_client = asyncio.run(get_clients())
+    # Another event loop gets its own client
+    assert asyncio.run(run_and_close()) is not first_loop_client
+
+    sync_client = language_models.get_sync_client("openai")
+    assert language_models.get_sync_client("openai") is sync_client
+    language_models.close_sync_clients()
+    assert language_models.get_sync_client("openai") is not sync_client
+
+    with pytest.raises(NotImplementedError):
+        language_models.get_sync_client("unknown")
+    language_models.close_sync_clients()
@@ -1,6 +1,8 @@
 import pytest
 import phospho
+import json
 import logging
+import os
 import time
 
 from openai.types.chat import ChatCompletion, ChatCompletionMessage, ChatCompletionChunk
@@ -224,6 +226,8 @@ def test_stream():
         assert (
             task_id in phospho.log_queue.events.keys()
         ), f"{task_id} not found in the log_queue.events: {phospho.log_queue.events.keys()}, round {i}"
+        # The chunks are converted when the stream is merged, as on a flush
+        phospho.log_queue.events[task_id].close_stream()
         raw_output = phospho.log_queue.events[task_id].content["raw_output"]
         if isinstance(raw_output, list):
             assert raw_output[-1] == groundtruth_r.model_dump()
@@ -277,6 +281,8 @@ async def test_async_stream():
             assert r == groundtruth_r
             # Log queue has been flushed at the last response
             if i < len(MOCK_OPENAI_STREAM_RESPONSE) - 1:
+                # The chunks are converted when the stream is merged, as on a flush
+                phospho.log_queue.events[log["task_id"]].close_stream()
                 log_content = phospho.log_queue.events[log["task_id"]].content
                 raw_output = log_content["raw_output"]
                 if isinstance(raw_output, list):
@@ -333,6 +339,8 @@ async def test_async_stream():
             assert (
                 task_id in phospho.log_queue.events.keys()
             ), f"{task_id} not found in the log_queue.events: {phospho.log_queue.events.keys()}"
+            # The chunks are converted when the stream is merged, as on a flush
+            phospho.log_queue.events[log["task_id"]].close_stream()
             log_content = phospho.log_queue.events[log["task_id"]].content
             raw_output = log_content["raw_output"]
             if isinstance(raw_output, list):
@@ -343,3 +351,396 @@ async def test_async_stream():
     assert i <= len(MOCK_OPENAI_STREAM_RESPONSE), str(r)
 
     time.sleep(0.1)
+
+
+@pytest.mark.asyncio
+async def test_async_transport():
+    phospho.init(tick=0.05, transport="async")
+    assert isinstance(phospho.consumer, phospho.AsyncConsumer)
+
+    sent_batches = []
+
+    async def fake_apost(path, payload=None, compress=False):
+        sent_batches.append(payload["batched_log_events"])
+
+    # Intercept the calls to the backend
+    phospho.client._apost = fake_apost
+
+    phospho.log(input="Say hi !", output="Hello! How can I assist you today?")
+    phospho.log(input="Say hi again !", output="Hello again!")
+    await phospho.aflush()
+
+    sent_events = [event for batch in sent_batches for event in batch]
+    assert len(sent_events) == 2
+    assert sent_events[0]["input"] == "Say hi !"
+    assert len(phospho.log_queue.events) == 0
+
+    phospho.consumer.stop()
+
+
+def test_async_consumer_stop_after_loop_closed():
+    import asyncio
+
+    client = phospho.Client(api_key="test", project_id="test")
+    log_queue = phospho.LogQueue()
+    consumer = phospho.AsyncConsumer(log_queue=log_queue, client=client, tick=60)
+    sent_events = []
+
+    def fake_post(path, payload=None, compress=False):
+        sent_events.extend(payload["batched_log_events"])
+
+    client._post = fake_post
+
+    async def start_consumer():
+        consumer.start()
+
+    # The event loop is closed with the consumer task still pending, as at exit
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start_consumer())
+    loop.close()
+    assert not consumer._task.done()
+
+    log_queue.append(phospho.Event(id="0", content={"task_id": "0"}))
+    consumer.stop()
+    assert [event["task_id"] for event in sent_events] == ["0"]
+    # The task can't be cancelled anymore: don't warn when it is garbage collected
+    consumer._task._log_destroy_pending = False
+
+
+def test_log_queue_bounded():
+    from phospho.log_queue import split_batch
+
+    batch = [{"task_id": str(i), "input": "x" * 100} for i in range(10)]
+    # Split by number of events
+    batches = split_batch(batch, max_batch_events=3)
+    assert [len(b) for b in batches] == [3, 3, 3, 1]
+    # Split by size: each event is a bit more than 100 bytes
+    batches = split_batch(batch, max_batch_bytes=300)
+    assert [len(b) for b in batches] == [2, 2, 2, 2, 2]
+    # An event bigger than the limit is sent alone
+    batches = split_batch(batch[:2], max_batch_bytes=10)
+    assert [len(b) for b in batches] == [1, 1]
+    # The sizes are measured with the given serializer, once per event
+    encoded_events = []
+
+    def fake_json_dumps(content):
+        encoded_events.append(content)
+        return b"x" * 150
+
+    batches = split_batch(batch, max_batch_bytes=300, json_dumps=fake_json_dumps)
+    assert [len(b) for b in batches] == [2, 2, 2, 2, 2]
+    assert encoded_events == batch
+
+    # Drop the oldest events when the queue is full
+    log_queue = phospho.LogQueue(max_size=3, overflow_policy="drop_oldest")
+    for i in range(5):
+        log_queue.append(phospho.Event(id=str(i), content={"task_id": str(i)}))
+    assert list(log_queue.events.keys()) == ["2", "3", "4"]
+    assert log_queue.nb_dropped_events == 2
+
+    # Drop the newest events when the queue is full
+    log_queue = phospho.LogQueue(max_size=3, overflow_policy="drop_newest")
+    for i in range(5):
+        log_queue.append(phospho.Event(id=str(i), content={"task_id": str(i)}))
+    assert list(log_queue.events.keys()) == ["0", "1", "2"]
+    # Events sent back to the queue are older than the ones in queue
+    log_queue.get_batch()
+    log_queue.append(phospho.Event(id="5", content={"task_id": "5"}))
+    log_queue.add_batch([{"task_id": "0"}, {"task_id": "1"}, {"task_id": "2"}])
+    assert list(log_queue.events.keys()) == ["0", "1", "2"]
+
+    # Block until timeout, then drop the new event
+    log_queue = phospho.LogQueue(max_size=1, overflow_policy="block", block_timeout=0.05)
+    log_queue.append(phospho.Event(id="0", content={"task_id": "0"}))
+    start = time.time()
+    log_queue.append(phospho.Event(id="1", content={"task_id": "1"}))
+    assert time.time() - start >= 0.05
+    assert list(log_queue.events.keys()) == ["0"]
+
+
+def test_compressed_log_payload(requests_mock):
+    import gzip
+    import json
+
+    client = phospho.Client(
+        api_key="test", project_id="test", base_url="http://phospho.test"
+    )
+    requests_mock.post("http://phospho.test/log/test", json={"logged_events": []})
+
+    # Small payloads are sent as is
+    small_payload = {"batched_log_events": [{"input": "Say hi !"}]}
+    client._post("/log/test", small_payload, compress=True)
+    request = requests_mock.last_request
+    assert "Content-Encoding" not in request.headers
+    assert json.loads(request.body) == small_payload
+
+    # Big payloads are gzipped
+    big_payload = {"batched_log_events": [{"input": "Say hi !" * 1000}]}
+    client._post("/log/test", big_payload, compress=True)
+    request = requests_mock.last_request
+    assert request.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(request.body)) == big_payload
+
+
+def test_get_all_tasks_pages(requests_mock):
+    client = phospho.Client(
+        api_key="test", project_id="test", base_url="http://phospho.test"
+    )
+    task = {"id": "1", "input": "Say hi !", "project_id": "test"}
+    requests_mock.get(
+        "http://phospho.test/projects/test/tasks",
+        [
+            {"json": {"tasks": [task, {**task, "id": "2"}], "next_cursor": "abc"}},
+            {"json": {"tasks": [{**task, "id": "3"}], "next_cursor": None}},
+        ],
+    )
+
+    tasks = client.tasks.get_all(page_size=2)
+    # Lazy: nothing is fetched before iterating
+    assert requests_mock.call_count == 0
+    assert [task.id for task in tasks] == ["1", "2", "3"]
+    assert requests_mock.call_count == 2
+    assert requests_mock.request_history[0].qs == {"limit": ["2"]}
+    assert requests_mock.request_history[1].qs == {"limit": ["2"], "cursor": ["abc"]}
+
+
+def test_spill(tmp_path):
+    spill = phospho.SpillQueue(spill_dir=str(tmp_path))
+    client = phospho.Client(api_key="test", project_id="test")
+    log_queue = phospho.LogQueue()
+    consumer = phospho.Consumer(
+        log_queue=log_queue, client=client, spill=spill, max_batch_events=2
+    )
+
+    sent_events = []
+    fail = True
+
+    def fake_post(path, payload=None, compress=False):
+        if fail:
+            raise ValueError("Backend is down")
+        sent_events.extend(payload["batched_log_events"])
+
+    client._post = fake_post
+
+    for i in range(3):
+        log_queue.append(phospho.Event(id=str(i), content={"task_id": str(i)}))
+    # The backend is down: the logs are kept on disk, not in memory
+    consumer.send_batch()
+    assert len(log_queue.events) == 0
+    assert len(spill.segments()) == 1
+    assert [e["task_id"] for e in spill.read(spill.segments()[0])] == ["0", "1", "2"]
+
+    # A new consumer (eg. after a restart) sends the logs on disk
+    fail = False
+    log_queue.append(phospho.Event(id="3", content={"task_id": "3"}))
+    restarted_consumer = phospho.Consumer(
+        log_queue=log_queue, client=client, spill=phospho.SpillQueue(str(tmp_path))
+    )
+    restarted_consumer.send_batch()
+    assert [e["task_id"] for e in sent_events] == ["0", "1", "2", "3"]
+    assert len(spill.segments()) == 0
+
+
+def test_spill_reads_segments_lazily(tmp_path):
+    spill = phospho.SpillQueue(spill_dir=str(tmp_path))
+    for i in range(3):
+        spill.append([{"task_id": str(i)}])
+    client = phospho.Client(api_key="test", project_id="test")
+    consumer = phospho.Consumer(
+        log_queue=phospho.LogQueue(), client=client, spill=spill
+    )
+
+    read_segments = []
+    read = spill.read
+
+    def spy_read(path):
+        read_segments.append(path)
+        return read(path)
+
+    spill.read = spy_read
+
+    def fake_post(path, payload=None, compress=False):
+        raise ValueError("Backend is down")
+
+    client._post = fake_post
+
+    # The first segment fails to be sent: the other segments are not read
+    consumer.send_batch()
+    assert read_segments == spill.segments()[:1]
+    assert len(spill.segments()) == 3
+
+
+def test_spill_write_error(tmp_path):
+    spill = phospho.SpillQueue(spill_dir=str(tmp_path))
+    spill.append([{"task_id": "0"}])
+    client = phospho.Client(api_key="test", project_id="test")
+    log_queue = phospho.LogQueue()
+    consumer = phospho.Consumer(log_queue=log_queue, client=client, spill=spill)
+
+    sent_events = []
+
+    def fake_post(path, payload=None, compress=False):
+        sent_events.extend(payload["batched_log_events"])
+
+    client._post = fake_post
+
+    def full_disk_append(events_content):
+        raise OSError(28, "No space left on device")
+
+    spill.append = full_disk_append
+
+    # The disk is full: the new events stay in memory, the segments on disk are sent
+    log_queue.append(phospho.Event(id="1", content={"task_id": "1"}))
+    consumer.send_batch()
+    assert [e["task_id"] for e in sent_events] == ["0"]
+    assert list(log_queue.events.keys()) == ["1"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_spill_after_fork(tmp_path):
+    # The backend is unreachable: the segments stay on disk
+    phospho.init(
+        api_key="test",
+        project_id="test",
+        base_url="http://127.0.0.1:9",
+        tick=0.1,
+        spill_dir=str(tmp_path),
+    )
+    assert phospho.consumer.spill.spill_dir == str(tmp_path)
+
+    def run_child(leave_segment: bool) -> dict:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Child: report its spill directory and the segments in it, then die
+            try:
+                os.close(read_fd)
+                spill = phospho.consumer.spill
+                report = {"spill_dir": spill.spill_dir, "segments": spill.segments()}
+                if leave_segment:
+                    spill.append([{"task_id": "left by a dead worker"}])
+                os.write(write_fd, json.dumps(report).encode())
+            finally:
+                os._exit(0)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            report = json.loads(f.read())
+        os.waitpid(pid, 0)
+        return report
+
+    # Each forked process spills to a worker directory
+    first_report = run_child(leave_segment=True)
+    assert first_report["spill_dir"] == os.path.join(str(tmp_path), "worker-0")
+    # The next worker adopts the directory of the dead worker, with its segments
+    second_report = run_child(leave_segment=False)
+    assert second_report["spill_dir"] == first_report["spill_dir"]
+    assert len(second_report["segments"]) == 1
+    # A worker directory held by a running process is not shared
+    from phospho.spill import claim_worker_dir
+
+    worker_dir, lock_file = claim_worker_dir(str(tmp_path))
+    other_worker_dir, other_lock_file = claim_worker_dir(str(tmp_path))
+    assert other_worker_dir != worker_dir
+    lock_file.close()
+    other_lock_file.close()
+
+    phospho.consumer.stop()
+    assert phospho.consumer.spill.spill_dir == str(tmp_path)
+
+
+def test_aggregator(tmp_path):
+    socket_path = str(tmp_path / "phospho.sock")
+    client = phospho.Client(api_key="test", project_id="test")
+    sent_events = []
+
+    def fake_post(path, payload=None, compress=False):
+        sent_events.extend(payload["batched_log_events"])
+
+    client._post = fake_post
+
+    # Two workers of the same host
+    workers = [
+        phospho.AggregatorConsumer(
+            log_queue=phospho.LogQueue(max_size=100),
+            client=client,
+            tick=0.05,
+            socket_path=socket_path,
+        )
+        for _ in range(2)
+    ]
+    for i, worker in enumerate(workers):
+        worker.log_queue.append(
+            phospho.Event(id=str(i), content={"task_id": str(i)})
+        )
+        worker.send_batch()
+
+    # The first worker became the aggregator, the second one sent its logs to it
+    assert workers[0].aggregator is not None
+    assert workers[1].aggregator is None
+    # The queue of the aggregator is bounded like the queues of the workers
+    assert workers[0].aggregator.log_queue.max_size == 100
+    start = time.time()
+    while len(sent_events) < 2 and time.time() - start < 2:
+        time.sleep(0.05)
+    assert sorted(event["task_id"] for event in sent_events) == ["0", "1"]
+
+    for worker in reversed(workers):
+        worker.stop()
+
+
+def test_stream_accumulation():
+    phospho.init(tick=60, raise_error_on_fail_to_send=True)
+
+    def make_chunk(content, finish_reason=None):
+        return ChatCompletionChunk(
+            id="chatcmpl-stream",
+            choices=[
+                chunk_Choice(
+                    delta=ChoiceDelta(content=content),
+                    finish_reason=finish_reason,
+                    index=0,
+                )
+            ],
+            created=1701092540,
+            model="gpt-3.5-turbo-0613",
+            object="chat.completion.chunk",
+        )
+
+    tokens = [f"token{i} " for i in range(500)]
+
+    def fake_openai_call_stream(model, messages, stream: bool = True):
+        for token in tokens:
+            yield make_chunk(token)
+        yield make_chunk(None, finish_reason="stop")
+
+    response = phospho.wrap(fake_openai_call_stream, stream=True)(
+        **MOCK_OPENAI_QUERY, stream=True
+    )
+    for i, _ in enumerate(response):
+        if i == 10:
+            # Chunks are stored as is in the event while streaming
+            (event,) = phospho.log_queue.events.values()
+            assert not event.to_log
+            assert len(event.stream().chunks) == 10
+            assert event.stream().chunks[-1][1] is not None
+            assert len(event.content["raw_output"]) == 1
+
+    (event,) = phospho.log_queue.events.values()
+    assert event.to_log
+    assert event.content["output"] == "".join(tokens)
+    assert len(event.content["raw_output"]) == len(tokens)
+    assert event.content["input"] == MOCK_OPENAI_QUERY["messages"][-1]["content"]
+    phospho.log_queue.events.clear()
+
+
+@pytest.mark.parametrize("serializer", ["auto", "json"])
+def test_serializer(requests_mock, serializer):
+    client = phospho.Client(
+        api_key="test", project_id="test", base_url="http://test", serializer=serializer
+    )
+    requests_mock.post("http://test/log/test", json={})
+    payload = {"batched_log_events": [{"task_id": "1", "input": "é", "output": None}]}
+    client._post("/log/test", payload)
+
+    assert json.loads(requests_mock.last_request.body) == payload
@@ -0,0 +1,128 @@
+import dataclasses
+import json
+import timeit
+import logging
+import datetime
+
+import pydantic
+
+from phospho.utils import (
+    convert_content_to_loggable_content,
+    filter_nonjsonable_keys,
+    is_jsonable,
+)
+
+from .test_log import (
+    MOCK_OPENAI_QUERY,
+    MOCK_OPENAI_RESPONSE,
+    MOCK_OPENAI_STREAM_RESPONSE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_is_jsonable(x) -> bool:
+    try:
+        json.dumps(x)
+        return True
+    except TypeError:
+        return False
+
+
+def legacy_convert_content_to_loggable_content(content):
+    """The previous implementation, which serializes the content at every level"""
+    if legacy_is_jsonable(content):
+        return content
+    if isinstance(content, dict):
+        return {
+            key: legacy_convert_content_to_loggable_content(value)
+            for key, value in content.items()
+        }
+    elif isinstance(content, list):
+        return str([legacy_convert_content_to_loggable_content(x) for x in content])
+    elif isinstance(content, pydantic.BaseModel):
+        return content.model_dump()
+    else:
+        return str(content)
+
+
+def legacy_log_call(kwargs):
+    kwargs = legacy_convert_content_to_loggable_content(kwargs)
+    return {key: value for key, value in kwargs.items() if legacy_is_jsonable(value)}
+
+
+def log_call(kwargs):
+    kwargs = convert_content_to_loggable_content(kwargs)
+    return filter_nonjsonable_keys(kwargs)
+
+
+def test_convert_content_to_loggable_content():
+    @dataclasses.dataclass
+    class Metadata:
+        user_id: str
+        created_at: datetime.datetime
+
+    created_at = datetime.datetime(2024, 1, 1)
+    query = {**MOCK_OPENAI_QUERY, "temperature": 0.5}
+    # Already json serializable content is not copied
+    assert convert_content_to_loggable_content(query) is query
+    assert is_jsonable(query)
+
+    content = {
+        "input": query,
+        "output": MOCK_OPENAI_RESPONSE,
+        "metadata": Metadata(user_id="user", created_at=created_at),
+        "raw": b'{"a": 1}',
+        "chunks": MOCK_OPENAI_STREAM_RESPONSE,
+        1: (1, 2),
+    }
+    assert not is_jsonable(content)
+    loggable_content = convert_content_to_loggable_content(content)
+    assert is_jsonable(loggable_content)
+    json.dumps(loggable_content)
+    assert loggable_content["input"] is query
+    assert loggable_content["output"] == MOCK_OPENAI_RESPONSE.model_dump()
+    assert loggable_content["metadata"] == {
+        "user_id": "user",
+        "created_at": str(created_at),
+    }
+    assert loggable_content["raw"] == {"a": 1}
+    # Lists with non serializable items are converted to str
+    assert isinstance(loggable_content["chunks"], str)
+    assert loggable_content[1] == (1, 2)
+    # Same result as the previous implementation on OpenAI shapes
+    for value in [query, MOCK_OPENAI_RESPONSE, MOCK_OPENAI_STREAM_RESPONSE[0]]:
+        assert convert_content_to_loggable_content(
+            value
+        ) == legacy_convert_content_to_loggable_content(value)
+
+
+def test_convert_content_to_loggable_content_long_query():
+    # A long conversation, as sent to the OpenAI API
+    long_query = {
+        "model": "gpt-4",
+        "messages": [
+            {"role": "user" if i % 2 else "assistant", "content": "Hello world! " * 200}
+            for i in range(30)
+        ],
+        "temperature": 0.7,
+        "stream": False,
+    }
+    kwargs = {
+        "input": long_query,
+        "raw_input": long_query,
+        "output": MOCK_OPENAI_RESPONSE,
+        "user_id": "user",
+        "version_id": "v1",
+        "metadata": {"nested": {"query": long_query}},
+    }
+    assert log_call(kwargs) == legacy_log_call(kwargs)
+
+    # Informative only: timings on shared runners are too noisy to be asserted
+    number = 200
+    legacy_time = min(timeit.repeat(lambda: legacy_log_call(kwargs), number=number))
+    new_time = min(timeit.repeat(lambda: log_call(kwargs), number=number))
+    logger.info(
+        f"convert_content_to_loggable_content: {new_time / number * 1e6:.1f}µs per call"
+        + f" (previously {legacy_time / number * 1e6:.1f}µs)"
+    )